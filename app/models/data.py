@@ -70,16 +70,19 @@ class Transaction(BaseModel):
     extrinsic_idx = sa.Column(sa.Integer(), primary_key=True, index=True)
     batch_idx = sa.Column(sa.Integer(), primary_key=True, index=True,
                           default=0)  # Added to handle Utility Batch extrinsics
+    call_path = sa.Column(sa.String(64), nullable=True)  # position of a nested call, e.g. '2.1'
     extrinsic_length = sa.Column(sa.String(10))
     extrinsic_hash = sa.Column(sa.String(66), nullable=True)
     signed = sa.Column(sa.SmallInteger(), nullable=False)
 
-    from_address = sa.Column(sa.String(64), index=True)
-    to_address = sa.Column(sa.String(64), index=True, nullable=True)
-    value = sa.Column(sa.Numeric(precision=65, scale=10), default=0, nullable=True)
+    from_address = sa.Column(sa.String(64))
+    to_address = sa.Column(sa.String(64), nullable=True)
+    from_address_id = sa.Column(sa.Integer(), index=True, nullable=True)
+    to_address_id = sa.Column(sa.Integer(), index=True, nullable=True)
+    value = sa.Column(sa.Numeric(precision=39, scale=0), default=0, nullable=True)  # planck
     signature = sa.Column(sa.String(150))
-    tip = sa.Column(sa.Numeric(precision=65, scale=10), default=0, nullable=True)
-    fee = sa.Column(sa.Numeric(precision=65, scale=10), default=0, nullable=True)
+    tip = sa.Column(sa.Numeric(precision=39, scale=0), default=0, nullable=True)  # planck
+    fee = sa.Column(sa.Numeric(precision=39, scale=0), default=0, nullable=True)  # planck
     nonce = sa.Column(sa.Integer())
 
     module_id = sa.Column(sa.String(64), index=True)
@@ -96,6 +99,19 @@ class Transaction(BaseModel):
         return '{}-{}-{}'.format(self.block_id, self.extrinsic_idx, self.batch_idx)
 
 
+class Address(BaseModel):
+    __tablename__ = 'address'
+
+    # dictionary of the SS58 addresses to compact integer ids, assigned at ingest time
+    # the address is the primary key so that its uniqueness is also checked when unique_checks are disabled
+    address = sa.Column(sa.String(64), primary_key=True)
+    id = sa.Column(sa.Integer(), autoincrement=True, unique=True, nullable=False)
+    pkey = sa.Column(sa.String(64), index=True, nullable=True)
+
+    def serialize_id(self):
+        return self.id
+
+
 class Account(BaseModel):
     __tablename__ = 'account'
 
@@ -118,9 +134,9 @@ class Account(BaseModel):
     was_sudo = sa.Column(sa.Boolean, default=False, index=True)
     is_treasury = sa.Column(sa.Boolean, default=False, index=True)
     count_reaped = sa.Column(sa.Integer(), default=0)
-    balance_total = sa.Column(sa.Numeric(precision=65, scale=10), nullable=True, index=True)
-    balance_free = sa.Column(sa.Numeric(precision=65, scale=10), nullable=True, index=True)
-    balance_reserved = sa.Column(sa.Numeric(precision=65, scale=10), nullable=True, index=True)
+    balance_total = sa.Column(sa.Numeric(precision=39, scale=0), nullable=True, index=True)  # planck
+    balance_free = sa.Column(sa.Numeric(precision=39, scale=0), nullable=True, index=True)  # planck
+    balance_reserved = sa.Column(sa.Numeric(precision=39, scale=0), nullable=True, index=True)  # planck
     nonce = sa.Column(sa.Integer(), nullable=True)
     has_identity = sa.Column(sa.Boolean, default=False, index=True)
     has_subidentity = sa.Column(sa.Boolean, default=False, index=True)
@@ -144,13 +160,55 @@ class Account(BaseModel):
 
 class AccountInfoSnapshot(BaseModel):
     __tablename__ = 'account_info_snapshot'
+    # balances of a snapshot in keyset pages sorted by balance, see app/scripts/account_balance_distribution.py
+    __table_args__ = (sa.Index('ix_account_info_snapshot_block_balance', 'block_id', 'balance_total', 'account_id'),)
+
     block_id = sa.Column(sa.Integer(), primary_key=True, index=True)
-    account_id = sa.Column(sa.String(64), primary_key=True, index=True)
+    account_id = sa.Column(sa.String(64), primary_key=True)
+    address_id = sa.Column(sa.Integer(), index=True, nullable=True)
     pkey = sa.Column(sa.String(64), index=True)
-    balance_total = sa.Column(sa.Numeric(precision=65, scale=10), nullable=True, index=True)
-    balance_free = sa.Column(sa.Numeric(precision=65, scale=10), nullable=True, index=True)
-    balance_reserved = sa.Column(sa.Numeric(precision=65, scale=10), nullable=True, index=True)
+    balance_total = sa.Column(sa.Numeric(precision=39, scale=0), nullable=True, index=True)  # planck
+    balance_free = sa.Column(sa.Numeric(precision=39, scale=0), nullable=True, index=True)  # planck
+    balance_reserved = sa.Column(sa.Numeric(precision=39, scale=0), nullable=True, index=True)  # planck
     nonce = sa.Column(sa.Integer(), nullable=True)
+    is_validator = sa.Column(sa.Boolean, default=False, index=True)
+    is_nominator = sa.Column(sa.Boolean, default=False, index=True)
+    is_council = sa.Column(sa.Boolean, default=False, index=True)
+    identity_display = sa.Column(sa.JSON(), nullable=True)
+
+
+class IdentityCache(BaseModel):
+    __tablename__ = 'identity_cache'
+
+    # Identity.IdentityOf of an account only changes on Identity events, so a cached entry is valid from
+    # the block of the last Identity event of the account until the block before its next one
+    account_id = sa.Column(sa.String(64), primary_key=True)
+    valid_from_block = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    valid_to_block = sa.Column(sa.Integer(), nullable=True)
+    identity_display = sa.Column(sa.JSON(), nullable=True)
+    identity_judgement = sa.Column(sa.JSON(), nullable=True)
+
+    def serialize_id(self):
+        return '{}-{}'.format(self.account_id, self.valid_from_block)
+
+
+class AccountFlow(BaseModel):
+    __tablename__ = 'account_flow'
+
+    # transfers per account and bucket of FLOW_BUCKET_BLOCKS blocks (block_id DIV FLOW_BUCKET_BLOCKS),
+    # maintained during ingestion, see app/scripts/account_flow.py
+    address_id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    block_bucket = sa.Column(sa.Integer(), primary_key=True, autoincrement=False, index=True)
+    incoming_count = sa.Column(sa.Integer(), default=0, nullable=False)
+    incoming_sum = sa.Column(sa.Numeric(precision=39, scale=0), default=0, nullable=False)  # planck
+    outgoing_count = sa.Column(sa.Integer(), default=0, nullable=False)
+    outgoing_sum = sa.Column(sa.Numeric(precision=39, scale=0), default=0, nullable=False)  # planck
+    self_loop_count = sa.Column(sa.Integer(), default=0, nullable=False)
+    self_loop_sum = sa.Column(sa.Numeric(precision=39, scale=0), default=0, nullable=False)  # planck
+    zero_value_count = sa.Column(sa.Integer(), default=0, nullable=False)
+
+    def serialize_id(self):
+        return '{}-{}'.format(self.address_id, self.block_bucket)
 
 
 class Event(BaseModel):
@@ -170,3 +228,234 @@ class Event(BaseModel):
 
     def serialize_id(self):
         return '{}-{}'.format(self.block_id, self.event_idx)
+
+
+class TransferEvent(BaseModel):
+    __tablename__ = 'transfer_event'
+
+    # Balances.Transfer events projected at ingest time, see app/scripts/balance_events.py
+    block_id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    event_idx = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    extrinsic_idx = sa.Column(sa.Integer(), nullable=True)
+    from_address_id = sa.Column(sa.Integer(), index=True, nullable=False)
+    to_address_id = sa.Column(sa.Integer(), index=True, nullable=False)
+    amount = sa.Column(sa.Numeric(precision=39, scale=0), nullable=False)  # planck
+
+    def serialize_id(self):
+        return '{}-{}'.format(self.block_id, self.event_idx)
+
+
+class BalanceEvent(BaseModel):
+    __tablename__ = 'balance_event'
+
+    # Balances Withdraw/Deposit/Endowed/DustLost/Slashed/ReserveRepatriated, Treasury Deposit and
+    # System NewAccount/KilledAccount events, projected at ingest time
+    block_id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    event_idx = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    extrinsic_idx = sa.Column(sa.Integer(), nullable=True)
+    module_id = sa.Column(sa.String(64), nullable=False)
+    event_id = sa.Column(sa.String(64), index=True, nullable=False)
+    address_id = sa.Column(sa.Integer(), index=True, nullable=False)
+    # account debited by Balances.ReserveRepatriated, credited to address_id
+    from_address_id = sa.Column(sa.Integer(), nullable=True)
+    amount = sa.Column(sa.Numeric(precision=39, scale=0), nullable=True)  # planck
+
+    def serialize_id(self):
+        return '{}-{}'.format(self.block_id, self.event_idx)
+
+
+class BalanceCheckpoint(BaseModel):
+    __tablename__ = 'balance_checkpoint'
+
+    # non-zero balances replayed from the balance events up to and including block_id,
+    # see app/scripts/balance_engine.py
+    block_id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    address_id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    balance = sa.Column(sa.Numeric(precision=39, scale=0), nullable=False)  # planck, signed to expose missing events
+
+    def serialize_id(self):
+        return '{}-{}'.format(self.block_id, self.address_id)
+
+
+class BalanceHistogram(BaseModel):
+    __tablename__ = 'balance_histogram'
+
+    # log-binned balances of a snapshot, see app/scripts/account_balance_distribution.py
+    block_id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    bin_idx = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    count = sa.Column(sa.Integer(), nullable=False)
+    balance_sum = sa.Column(sa.Numeric(precision=39, scale=0), nullable=False)  # planck
+
+    def serialize_id(self):
+        return '{}-{}'.format(self.block_id, self.bin_idx)
+
+
+class BalanceQuantile(BaseModel):
+    __tablename__ = 'balance_quantile'
+
+    block_id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    quantile = sa.Column(sa.Numeric(precision=5, scale=4), primary_key=True, autoincrement=False)
+    balance = sa.Column(sa.Numeric(precision=39, scale=0), nullable=False)  # planck
+
+    def serialize_id(self):
+        return '{}-{}'.format(self.block_id, self.quantile)
+
+
+class WealthConcentration(BaseModel):
+    __tablename__ = 'wealth_concentration'
+
+    # concentration of the non-zero balances of a snapshot, see app/scripts/wealth_concentration.py
+    block_id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    account_count = sa.Column(sa.Integer(), nullable=False)
+    balance_total = sa.Column(sa.Numeric(precision=39, scale=0), nullable=True)  # planck
+    gini = sa.Column(sa.Float(), nullable=True)
+    nakamoto_33 = sa.Column(sa.Integer(), nullable=True)
+    nakamoto_50 = sa.Column(sa.Integer(), nullable=True)
+    nakamoto_67 = sa.Column(sa.Integer(), nullable=True)
+    top_10_share = sa.Column(sa.Float(), nullable=True)
+    top_100_share = sa.Column(sa.Float(), nullable=True)
+    top_1000_share = sa.Column(sa.Float(), nullable=True)
+    top_10000_share = sa.Column(sa.Float(), nullable=True)
+
+    def serialize_id(self):
+        return self.block_id
+
+
+class LorenzPoint(BaseModel):
+    __tablename__ = 'lorenz_point'
+
+    block_id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    population_share = sa.Column(sa.Numeric(precision=3, scale=2), primary_key=True, autoincrement=False)
+    wealth_share = sa.Column(sa.Float(), nullable=False)
+
+    def serialize_id(self):
+        return '{}-{}'.format(self.block_id, self.population_share)
+
+
+class BlockProduction(BaseModel):
+    __tablename__ = 'block_production'
+
+    # blocks produced by a validator in a session, see app/scripts/block_production.py
+    session_id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    author = sa.Column(sa.String(48), primary_key=True, index=True)
+    blocks = sa.Column(sa.Integer(), nullable=False)
+    first_block = sa.Column(sa.Integer(), nullable=False)
+    last_block = sa.Column(sa.Integer(), nullable=False)
+
+    def serialize_id(self):
+        return '{}-{}'.format(self.session_id, self.author)
+
+
+class SessionProduction(BaseModel):
+    __tablename__ = 'session_production'
+
+    # blocks and missed slots of a session, see app/scripts/block_production.py
+    session_id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    first_block = sa.Column(sa.Integer(), nullable=False)
+    last_block = sa.Column(sa.Integer(), nullable=False)
+    first_slot = sa.Column(sa.BigInteger(), nullable=False)
+    last_slot = sa.Column(sa.BigInteger(), nullable=False)
+    blocks = sa.Column(sa.Integer(), nullable=False)
+    authors = sa.Column(sa.Integer(), nullable=False)
+    missed_slots = sa.Column(sa.Integer(), nullable=False)
+    max_slot_gap = sa.Column(sa.Integer(), nullable=False)
+
+    def serialize_id(self):
+        return self.session_id
+
+
+class VolumeBlock(BaseModel):
+    __tablename__ = 'volume_block'
+
+    # transaction volume of a block, maintained during ingestion, see app/scripts/volume_rollup.py
+    block_id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    datetime = sa.Column(sa.DateTime(), nullable=True, index=True)
+    transfer_count = sa.Column(sa.Integer(), default=0, nullable=False)
+    transfer_sum = sa.Column(sa.Numeric(precision=39, scale=0), default=0, nullable=False)  # planck
+    fee_sum = sa.Column(sa.Numeric(precision=39, scale=0), default=0, nullable=False)  # planck
+    signed_count = sa.Column(sa.Integer(), default=0, nullable=False)
+    accounts_new = sa.Column(sa.Integer(), default=0, nullable=False)
+    accounts_reaped = sa.Column(sa.Integer(), default=0, nullable=False)
+    sender_count = sa.Column(sa.Integer(), default=0, nullable=False)
+    receiver_count = sa.Column(sa.Integer(), default=0, nullable=False)
+    active_count = sa.Column(sa.Integer(), default=0, nullable=False)
+
+    def serialize_id(self):
+        return self.block_id
+
+
+class VolumeHour(BaseModel):
+    __tablename__ = 'volume_hour'
+
+    # sums of the volume_block rows of an hour, distinct accounts from active_account_hour
+    hour = sa.Column(sa.DateTime(), primary_key=True)
+    transfer_count = sa.Column(sa.Integer(), default=0, nullable=False)
+    transfer_sum = sa.Column(sa.Numeric(precision=39, scale=0), default=0, nullable=False)  # planck
+    fee_sum = sa.Column(sa.Numeric(precision=39, scale=0), default=0, nullable=False)  # planck
+    signed_count = sa.Column(sa.Integer(), default=0, nullable=False)
+    accounts_new = sa.Column(sa.Integer(), default=0, nullable=False)
+    accounts_reaped = sa.Column(sa.Integer(), default=0, nullable=False)
+    sender_count = sa.Column(sa.Integer(), default=0, nullable=False)
+    receiver_count = sa.Column(sa.Integer(), default=0, nullable=False)
+    active_count = sa.Column(sa.Integer(), default=0, nullable=False)
+
+    def serialize_id(self):
+        return self.hour
+
+
+class VolumeDay(BaseModel):
+    __tablename__ = 'volume_day'
+
+    # sums of the volume_hour rows of a day, distinct accounts from active_account_hour
+    day = sa.Column(sa.Date(), primary_key=True)
+    transfer_count = sa.Column(sa.Integer(), default=0, nullable=False)
+    transfer_sum = sa.Column(sa.Numeric(precision=39, scale=0), default=0, nullable=False)  # planck
+    fee_sum = sa.Column(sa.Numeric(precision=39, scale=0), default=0, nullable=False)  # planck
+    signed_count = sa.Column(sa.Integer(), default=0, nullable=False)
+    accounts_new = sa.Column(sa.Integer(), default=0, nullable=False)
+    accounts_reaped = sa.Column(sa.Integer(), default=0, nullable=False)
+    sender_count = sa.Column(sa.Integer(), default=0, nullable=False)
+    receiver_count = sa.Column(sa.Integer(), default=0, nullable=False)
+    active_count = sa.Column(sa.Integer(), default=0, nullable=False)
+
+    def serialize_id(self):
+        return self.day
+
+
+class ActiveAccountHour(BaseModel):
+    __tablename__ = 'active_account_hour'
+
+    # accounts sending (role 0) or receiving (role 1) transfers in an hour
+    hour = sa.Column(sa.DateTime(), primary_key=True)
+    role = sa.Column(sa.SmallInteger(), primary_key=True, autoincrement=False)
+    address_id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+
+    def serialize_id(self):
+        return '{}-{}-{}'.format(self.hour, self.role, self.address_id)
+
+
+class ActiveSketch(BaseModel):
+    __tablename__ = 'active_sketch'
+
+    # HyperLogLog registers of the senders (role 0), receivers (1) or participants (2) of the transfers of a day,
+    # see app/scripts/active_sketches.py
+    day = sa.Column(sa.Date(), primary_key=True)
+    role = sa.Column(sa.SmallInteger(), primary_key=True, autoincrement=False)
+    registers = sa.Column(sa.LargeBinary(), nullable=False)
+
+    def serialize_id(self):
+        return '{}-{}'.format(self.day, self.role)
+
+
+class HeavyHitter(BaseModel):
+    __tablename__ = 'heavy_hitter'
+
+    # Space-Saving counter of an account in the transfers of a month, see app/scripts/heavy_hitters.py
+    window_start = sa.Column(sa.Date(), primary_key=True)
+    metric = sa.Column(sa.String(16), primary_key=True)
+    address_id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    estimate = sa.Column(sa.Numeric(precision=39, scale=0), nullable=False)  # planck for the value metrics
+    error = sa.Column(sa.Numeric(precision=39, scale=0), nullable=False)
+
+    def serialize_id(self):
+        return '{}-{}-{}'.format(self.window_start, self.metric, self.address_id)
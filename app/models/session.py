@@ -23,10 +23,10 @@ class SessionValidator(BaseModel):
     rank = sa.Column(sa.Integer(), primary_key=True, autoincrement=False, index=True)
     stash_key = sa.Column(sa.String(64), index=True)
     controller_key = sa.Column(sa.String(64), index=True, nullable=True)
-    bonded_total = sa.Column(sa.Numeric(precision=65, scale=10), index=True)
-    bonded_active = sa.Column(sa.Numeric(precision=65, scale=10), index=True)
-    bonded_nominators = sa.Column(sa.Numeric(precision=65, scale=10), index=True)
-    bonded_own = sa.Column(sa.Numeric(precision=65, scale=10),  nullable=True, index=True)
+    bonded_total = sa.Column(sa.Numeric(precision=39, scale=0), index=True)  # planck
+    bonded_active = sa.Column(sa.Numeric(precision=39, scale=0), index=True)  # planck
+    bonded_nominators = sa.Column(sa.Numeric(precision=39, scale=0), index=True)  # planck
+    bonded_own = sa.Column(sa.Numeric(precision=39, scale=0), nullable=True, index=True)  # planck
     count_nominators = sa.Column(sa.Integer(), nullable=True, index=True)
     commission = sa.Column(sa.Numeric(precision=65, scale=10), nullable=True, index=True)
 
@@ -38,4 +38,28 @@ class SessionNominator(BaseModel):
     rank_validator = sa.Column(sa.Integer(), primary_key=True, autoincrement=False, index=True)
     rank_nominator = sa.Column(sa.Integer(), primary_key=True, autoincrement=False, index=True)
     stash_key = sa.Column(sa.String(64), index=True)
-    bonded = sa.Column(sa.Numeric(precision=65, scale=10), index=True)
\ No newline at end of file
+    bonded = sa.Column(sa.Numeric(precision=39, scale=0), index=True)  # planck
+
+
+class StakeConcentration(BaseModel):
+    __tablename__ = 'stake_concentration'
+
+    # stake concentration of a session, see app/scripts/stake_analytics.py
+    session_id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    validator_count = sa.Column(sa.Integer(), nullable=False)
+    stake_total = sa.Column(sa.Numeric(precision=39, scale=0), nullable=True)  # planck
+    stake_min = sa.Column(sa.Numeric(precision=39, scale=0), nullable=True)  # planck
+    stake_max = sa.Column(sa.Numeric(precision=39, scale=0), nullable=True)  # planck
+    stake_gini = sa.Column(sa.Float(), nullable=True)
+    nakamoto_33 = sa.Column(sa.Integer(), nullable=True)
+    nakamoto_50 = sa.Column(sa.Integer(), nullable=True)
+    own_stake_share = sa.Column(sa.Float(), nullable=True)
+    commission_mean = sa.Column(sa.Float(), nullable=True)
+    commission_median = sa.Column(sa.Float(), nullable=True)
+    commission_zero_share = sa.Column(sa.Float(), nullable=True)
+    commission_full_share = sa.Column(sa.Float(), nullable=True)
+    nominator_count = sa.Column(sa.Integer(), nullable=True)
+    nominator_exposures = sa.Column(sa.Integer(), nullable=True)
+    multi_validator_nominator_share = sa.Column(sa.Float(), nullable=True)
+    validator_pair_overlap = sa.Column(sa.Float(), nullable=True)
+    mean_pair_jaccard = sa.Column(sa.Float(), nullable=True)
@@ -1,26 +1,30 @@
 """
 account_balance_distribution.py
 
-Generating a distribution PDF plot of the account balances.
+Log-binned distribution and quantiles of the account balances of every snapshot, cached in the balance_histogram
+and balance_quantile tables.
 
 <Author>: Hanaa Abbas
 <Email>: hanaaloutfy94@gmail.com
 <Date>: 31 May, 2023
 
 GNU General Public License Version 3
-""" 
+"""
 import logging
+import math
 import sys
 import traceback
+from collections import defaultdict
 from logging.handlers import RotatingFileHandler
 from timeit import default_timer as timer
 
 from sqlalchemy import create_engine
-from sqlalchemy.sql import text
+from sqlalchemy.sql import bindparam, text
 
-import pandas as pd
 import matplotlib.pyplot as plt
 
+from app.settings import TOKEN_DECIMALS
+
 DB_NAME = "polkadot_analysis"
 DB_HOST = "localhost"
 DB_PORT = 3306
@@ -42,38 +46,197 @@ logging.basicConfig(level=logging.INFO,
                     datefmt='%Y-%m-%dT%H:%M:%S', )
 logger = logging.getLogger()
 
+# log-spaced bins: bin i holds the balances in [10 ** (i / BINS_PER_DECADE), 10 ** ((i + 1) / BINS_PER_DECADE)) planck
+BINS_PER_DECADE = 10
+# zero balances (emptied accounts) are counted in their own bin
+ZERO_BIN = -1
+
+# quantiles of the non-zero balances
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 0.999]
+
+# snapshot rows fetched per keyset page
+STREAM_CHUNK_SIZE = 10000
+
+# non-zero and missing balances of each snapshot, the missing ones are counted as zero balances
+snapshot_counts_sql = (
+    "SELECT block_id, SUM(balance_total > 0) AS count, SUM(balance_total IS NULL) AS null_count"
+    " FROM account_info_snapshot WHERE block_id IN :block_ids GROUP BY block_id"
+)
+
+# page of the balances of a snapshot sorted by balance, after the (balance, account) of the previous page
+snapshot_balances_sql = (
+    "SELECT account_id, balance_total FROM account_info_snapshot WHERE block_id = :block_id"
+    " AND (balance_total, account_id) > (:after_balance, :after_account)"
+    " ORDER BY balance_total, account_id LIMIT :limit"
+)
+
+cached_blocks_sql = "SELECT DISTINCT block_id FROM balance_histogram WHERE block_id IN :block_ids"
+
+insert_histogram_sql = (
+    "INSERT INTO balance_histogram (block_id, bin_idx, count, balance_sum)"
+    " VALUES (:block_id, :bin_idx, :count, :balance_sum)"
+)
+
+insert_quantile_sql = (
+    "INSERT INTO balance_quantile (block_id, quantile, balance) VALUES (:block_id, :quantile, :balance)"
+)
+
+
+def get_bin(balance):
+    if balance <= 0:
+        return ZERO_BIN
+    return int(math.floor(math.log10(balance) * BINS_PER_DECADE))
+
+
+def bin_lower_bound(bin_idx):
+    # lower bound in planck of a non-zero bin
+    return 10 ** (bin_idx / BINS_PER_DECADE)
+
+
+def quantile_ranks(count):
+    # {1-based rank in the sorted non-zero balances: [quantiles]}, nearest-rank method
+    ranks = defaultdict(list)
+    if count > 0:
+        for quantile in QUANTILES:
+            ranks[max(1, math.ceil(quantile * count))].append(quantile)
+    return ranks
+
+
+def stream_distributions(conn, block_ids):
+    """Yield (block_id, {bin_idx: [count, balance_sum]}, {quantile: balance}) for every snapshot.
+
+    The balances of a snapshot are read in keyset pages sorted by balance, so memory use does not depend on the
+    number of accounts: quantiles are picked at their rank, the non-zero balance counts being known beforehand
+    from a grouped count. The mysqlconnector dialect buffers whole result sets, hence the pages.
+    """
+    counts = {row.block_id: row for row in conn.execute(
+        text(snapshot_counts_sql).bindparams(bindparam('block_ids', expanding=True)), {"block_ids": block_ids})}
+
+    for block_id in block_ids:
+        if block_id not in counts:
+            continue
+        histogram = defaultdict(lambda: [0, 0])
+        if counts[block_id].null_count:
+            histogram[ZERO_BIN][0] += int(counts[block_id].null_count)
+        quantiles = {}
+        ranks = quantile_ranks(int(counts[block_id].count or 0))
+        rank = 0
+        page = {"block_id": block_id, "after_balance": -1, "after_account": '', "limit": STREAM_CHUNK_SIZE}
+        while True:
+            rows = conn.execute(text(snapshot_balances_sql), page).fetchall()
+            for row in rows:
+                balance = int(row.balance_total)
+                balance_bin = histogram[get_bin(balance)]
+                balance_bin[0] += 1
+                balance_bin[1] += balance
+                if balance > 0:
+                    rank += 1
+                    for quantile in ranks.get(rank, []):
+                        quantiles[quantile] = balance
+            if len(rows) < STREAM_CHUNK_SIZE:
+                break
+            page.update(after_balance=rows[-1].balance_total, after_account=rows[-1].account_id)
+        yield block_id, histogram, quantiles
+
+
+def write_distribution(conn, block_id, histogram, quantiles):
+    conn.execute(text("DELETE FROM balance_histogram WHERE block_id = :block_id"), {"block_id": block_id})
+    conn.execute(text("DELETE FROM balance_quantile WHERE block_id = :block_id"), {"block_id": block_id})
+    conn.execute(text(insert_histogram_sql), [
+        {"block_id": block_id, "bin_idx": bin_idx, "count": count, "balance_sum": balance_sum}
+        for bin_idx, (count, balance_sum) in histogram.items()])
+    if quantiles:
+        conn.execute(text(insert_quantile_sql), [{"block_id": block_id, "quantile": quantile, "balance": balance}
+                                                 for quantile, balance in quantiles.items()])
+
+
+def update_distributions(block_ids, refresh=False):
+    # compute the distributions of the snapshots missing from the cache, all of them with refresh
+    with engine.connect() as conn:
+        cached = set() if refresh else {row.block_id for row in conn.execute(
+            text(cached_blocks_sql).bindparams(bindparam('block_ids', expanding=True)), {"block_ids": block_ids})}
+    missing = [block_id for block_id in block_ids if block_id not in cached]
+    if not missing:
+        return
+
+    with engine.connect() as read_conn, engine.begin() as conn:
+        for block_id, histogram, quantiles in stream_distributions(read_conn, missing):
+            write_distribution(conn, block_id, histogram, quantiles)
+            logger.info("Balance distribution of snapshot {}: {} accounts".format(
+                block_id, sum(count for count, balance_sum in histogram.values())))
+
+
+def load_distributions(block_ids):
+    # ({block_id: [(bin_idx, count)]}, {block_id: {quantile: balance}}) from the cache
+    histograms = defaultdict(list)
+    quantiles = defaultdict(dict)
+    with engine.connect() as conn:
+        params = {"block_ids": block_ids}
+        for row in conn.execute(text(
+                "SELECT block_id, bin_idx, count FROM balance_histogram WHERE block_id IN :block_ids"
+                " ORDER BY block_id, bin_idx").bindparams(bindparam('block_ids', expanding=True)), params):
+            histograms[row.block_id].append((row.bin_idx, row.count))
+        for row in conn.execute(text(
+                "SELECT block_id, quantile, balance FROM balance_quantile WHERE block_id IN :block_ids")
+                .bindparams(bindparam('block_ids', expanding=True)), params):
+            quantiles[row.block_id][float(row.quantile)] = int(row.balance)
+    return histograms, quantiles
+
+
+def plot_distributions(block_ids, histograms, quantiles):
+    fig, (hist_ax, quantile_ax) = plt.subplots(1, 2, figsize=(18, 8))
+    colors = plt.cm.viridis([idx / max(1, len(block_ids) - 1) for idx in range(len(block_ids))])
+
+    for color, block_id in zip(colors, block_ids):
+        bins = [(bin_idx, count) for bin_idx, count in histograms[block_id] if bin_idx != ZERO_BIN]
+        if bins:
+            hist_ax.step([bin_lower_bound(bin_idx) / 10 ** TOKEN_DECIMALS for bin_idx, count in bins],
+                         [count for bin_idx, count in bins], where='post', color=color, label=str(block_id))
+    hist_ax.set_xscale("log")
+    hist_ax.set_yscale("log")
+    hist_ax.set_xlabel('Total Balance (DOT)')
+    hist_ax.set_ylabel('Number of accounts')
+    hist_ax.set_title('Distribution of Account Balances')
+    hist_ax.legend(fontsize='x-small', ncol=2)
+
+    for quantile in QUANTILES:
+        quantile_ax.plot(range(len(block_ids)), [quantiles[block_id].get(quantile, float('nan')) / 10 ** TOKEN_DECIMALS
+                                                 for block_id in block_ids], marker='o', label=str(quantile))
+    quantile_ax.set_yscale("log")
+    quantile_ax.set_xticks(range(len(block_ids)))
+    quantile_ax.set_xticklabels([str(block_id) for block_id in block_ids], rotation=90)
+    quantile_ax.set_xlabel('Snapshot block')
+    quantile_ax.set_ylabel('Total Balance (DOT)')
+    quantile_ax.set_title('Quantiles of the non-zero Account Balances')
+    quantile_ax.legend()
+
+    plt.tight_layout()
+    plt.show()
+
+
 # Main
 if __name__ == '__main__':
 
     try:
         start = timer()
 
-        with engine.connect().execution_options(autocommit=True) as conn:
-
-            # sql = ''' select e.block_id, CONVERT_TZ(e.datetime, '+03:00', '+00:00') as date_time,
-            #       count(e.block_id) as txns_volume, sum(e.value) as txns_total_value,
-            #       min(e.value) as minimum_value, max(e.value) as maximum_value
-            #       from extrinsic e
-            #       where e.module_id = 'Balances' and e.success = 1
-            #       group by e.block_id
-            #       order by e.block_id asc; '''
+        block_ids = [1293957, 1739297, 2168299, 2612529, 3042945, 3487164, 3932501, 4332719, 4778061, 5206293,
+                     5650640, 6082432, 6527621, 6973768, 7405900, 7847525, 8279239, 8725455,
+                     9171661, 9573880, 10019762, 10448617, 10883304, 11307029]
 
-            sql = ''' SELECT balance_total FROM account_info_snapshot; '''
-            query = conn.execute(text(sql))
-            df = pd.DataFrame(query.fetchall())
+        # recompute the cached distributions: account_balance_distribution.py refresh
+        update_distributions(block_ids, refresh=len(sys.argv) > 1 and sys.argv[1] == 'refresh')
+        histograms, quantiles = load_distributions(block_ids)
 
-            # df.to_csv(r'success_txn_per_block.csv', index=False)  # place 'r' before the path name
+        for block_id in block_ids:
+            logger.info("Block#{} --- Quantiles (DOT): {}".format(block_id, ", ".join(
+                "{}: {}".format(quantile, balance / 10 ** TOKEN_DECIMALS)
+                for quantile, balance in sorted(quantiles[block_id].items()))))
 
-            plt.figure(figsize=(12, 8))
-            df.balance_total.hist()
-            plt.gca().set_yscale("log")
-            plt.xlabel('Total Balance (DOT)')
-            plt.title('Distribution of Account Balances')
-            plt.ylabel('Number of accounts')
-            plt.show()
+        plot_distributions(block_ids, histograms, quantiles)
 
-            logger.info("Block Processing Total Execution Time (seconds): {}".format(timer() - start))
-            print("End of Execution....")
+        logger.info("Block Processing Total Execution Time (seconds): {}".format(timer() - start))
+        print("End of Execution....")
 
     except Exception as err:
         logger.error(traceback.format_exc())
@@ -18,11 +18,13 @@ from timeit import default_timer as timer
 
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy import tuple_, asc, text
+from sqlalchemy import text, Integer, String
 
 from substrateinterface import SubstrateInterface
 
-from app.models.data import Event, Account, AccountInfoSnapshot
+from app.models.data import Account, AccountInfoSnapshot
+from app.scripts.account_state import insert_account_history
+from app.scripts.address_normalizer import address_normalizer
 
 DB_NAME = "polkadot_analysis"
 DB_HOST = "localhost"
@@ -50,14 +52,90 @@ logger = logging.getLogger()
 EXTERNAL_URL = "wss://rpc.polkadot.io"
 INTERNAL_URL = "ws://172.20.135.65:9944"
 
-
-def handle_event_attributes(attributes):
-    for attr in attributes:
-        if type(attr) is str:
-            return attributes[0]
-        elif attr['type'] == 'AccountId':
-            addr = attr['value']
-    return addr
+# rows fetched per keyset page and accounts inserted per statement
+DISCOVERY_CHUNK_SIZE = 10000
+
+known_accounts_sql = "SELECT address FROM account WHERE address > :after_address ORDER BY address LIMIT :limit"
+
+endowed_events_sql = (
+    "SELECT be.block_id, be.event_idx, a.address, a.pkey FROM balance_event be JOIN address a ON a.id = be.address_id"
+    " WHERE be.event_id = 'Endowed' AND be.block_id BETWEEN :first_block AND :last_block"
+    " AND (be.block_id, be.event_idx) > (:after_block, :after_event)"
+    " ORDER BY be.block_id ASC, be.event_idx ASC LIMIT :limit"
+)
+
+insert_account_sql = (
+    "INSERT IGNORE INTO account (address, pkey, created_at_block, updated_at_block)"
+    " VALUES (:address, :pkey, :created_at_block, :updated_at_block)"
+)
+
+
+def keyset_rows(conn, query, params, after, next_after):
+    """Yield the rows of a query in pages of DISCOVERY_CHUNK_SIZE rows.
+
+    Every page starts after the ORDER BY key of the last row of the previous page: the after parameters of the
+    first page, next_after(row) for the others. The mysqlconnector dialect buffers the whole result set of a
+    query client-side (stream_results has no effect), so the pages bound the rows held in memory.
+    """
+    while True:
+        rows = conn.execute(query, dict(params, limit=DISCOVERY_CHUNK_SIZE, **after)).fetchall()
+        for row in rows:
+            yield row
+        if len(rows) < DISCOVERY_CHUNK_SIZE:
+            return
+        after = next_after(rows[-1])
+
+
+def insert_accounts(conn, new_accounts):
+    # insert a chunk of new accounts, the missing public keys parsed once per chunk
+    public_keys = address_normalizer.get_public_keys(
+        [account['address'] for account in new_accounts if account['pkey'] is None])
+    for account in new_accounts:
+        if account['pkey'] is None:
+            account['pkey'] = public_keys.get(account['address'])
+    conn.execute(text(insert_account_sql), new_accounts)
+    insert_account_history(conn, [account['address'] for account in new_accounts])
+    return len(new_accounts)
+
+
+def discover_accounts(first_block, last_block):
+    # create an account entry for each address endowed for the first time in the block range
+    count_events = 0
+    count_accounts = 0
+    with engine.connect() as conn:
+        known_addresses = set(row.address for row in keyset_rows(
+            conn, text(known_accounts_sql).columns(address=String), {}, {"after_address": ""},
+            lambda row: {"after_address": row.address}))
+        logger.info("Loaded {} known accounts".format(len(known_addresses)))
+
+        query = text(endowed_events_sql).columns(block_id=Integer, event_idx=Integer, address=String, pkey=String)
+        new_accounts = []
+        for account_event in keyset_rows(conn, query, {"first_block": first_block, "last_block": last_block},
+                                         {"after_block": -1, "after_event": -1},
+                                         lambda row: {"after_block": row.block_id, "after_event": row.event_idx}):
+            count_events += 1
+            addr = account_event.address
+            if addr in known_addresses:
+                continue
+
+            known_addresses.add(addr)
+            new_accounts.append({
+                "address": addr,
+                # the public key of addresses added by the address dictionary backfill is filled in per chunk
+                "pkey": account_event.pkey,
+                "created_at_block": account_event.block_id,
+                "updated_at_block": account_event.block_id,
+            })
+
+            if len(new_accounts) >= DISCOVERY_CHUNK_SIZE:
+                count_accounts += insert_accounts(conn, new_accounts)
+                new_accounts = []
+
+        if new_accounts:
+            count_accounts += insert_accounts(conn, new_accounts)
+
+    logger.info("Endowed events #{}, new accounts #{} between blocks {} and {}".format(
+        count_events, count_accounts, first_block, last_block))
 
 
 # Main
@@ -98,48 +176,15 @@ if __name__ == '__main__':
                 #              9171661, 9573880, 10019762, 10448617, 10883304, 11307029]
 
                 block_ids = [7405900]
-                keys = [('Balances', 'Endowed')]  # ('System', 'KilledAccount'),
 
                 # block ranges
                 for i in range(0, len(block_ids)):
 
                     second_index = block_ids[i]
 
-                    # handle account creation and reaping
-                    account_event_list = Event.query(db_session) \
-                        .filter(tuple_(Event.module_id, Event.event_id).in_(keys)) \
-                        .filter(Event.block_id.between(first_index, second_index)). \
-                        order_by(text("block_id asc, extrinsic_idx asc, event_idx asc"))
-
-                    logger.info("First set of events size #{}".format(account_event_list.count()))
-
-                    for account_event in account_event_list:
-                        addr = handle_event_attributes(account_event.attributes)
-                        # check if account entry exists in database
-                        account = Account.query(db_session).filter_by(address=addr).first()
-
-                        # if entry did not exist before, create it
-                        if not account:
-                            account = Account(
-                                address=addr,
-                                pkey=substrate.ss58_decode(addr),
-                                # balance_free=account_info['data']['free'].value / 10 ** token_decimals,
-                                # balance_reserved=account_info['data']['reserved'].value / 10 ** token_decimals,
-                                # balance_total=(account_info["data"]["free"].value + account_info["data"][
-                                #     "reserved"].value) / 10 ** token_decimals,
-                                # nonce=account_info['nonce'].value,
-                                created_at_block=account_event.block_id,
-                                updated_at_block=account_event.block_id,
-                                # is_reaped=False,
-                            )
-                            logger.info(
-                                "{} {} at block{}...".format(account_event.event_id, addr, account_event.block_id))
-                            account.save(db_session)
-
-                            # else:
-                            #     logger.error("FAILURE IN {} {} at Block {}".format(account_event.event_id, addr,
-                            #                                                        account_event.block_id))
-                    db_session.commit()
+                    # handle account creation
+                    discover_accounts(first_index, second_index)
+
                     #reaping an account that exists
                     # else:
                     #     if account_event.event_id == 'KilledAccount':
@@ -167,7 +212,6 @@ if __name__ == '__main__':
                         Account.created_at_block.between(1, second_index),
                         # Account.is_reaped.is_not(True)
                     )
-                    token_decimals = substrate.token_decimals if second_index >= 1248328 else 12
 
                     for account in accounts_list:
                         account_info = substrate.query(
@@ -181,10 +225,9 @@ if __name__ == '__main__':
                             block_id=second_index,
                             account_id=account.address,
                             pkey=account.pkey,
-                            balance_free=account_info['data']['free'].value / 10 ** token_decimals,
-                            balance_reserved=account_info['data']['reserved'].value / 10 ** token_decimals,
-                            balance_total=(account_info["data"]["free"].value + account_info["data"][
-                                "reserved"].value) / 10 ** token_decimals,
+                            balance_free=account_info['data']['free'].value,
+                            balance_reserved=account_info['data']['reserved'].value,
+                            balance_total=account_info["data"]["free"].value + account_info["data"]["reserved"].value,
                             nonce=account_info['nonce'].value,
                         )
                         snapshot.save(db_session)
@@ -0,0 +1,223 @@
+"""
+account_flow.py
+
+Cumulative per-account transfer flow (account_flow rollup table).
+
+GNU General Public License Version 3
+"""
+
+import logging
+import sys
+import traceback
+from collections import defaultdict
+from timeit import default_timer as timer
+
+from sqlalchemy import create_engine
+from sqlalchemy.sql import bindparam, text
+
+from app.scripts.address_dictionary import AddressDictionary
+
+logger = logging.getLogger(__name__)
+
+# number of blocks aggregated in one account_flow row (~1 day of 6 second blocks)
+FLOW_BUCKET_BLOCKS = 14400
+
+FLOW_COLUMNS = ['incoming_count', 'incoming_sum', 'outgoing_count', 'outgoing_sum', 'self_loop_count',
+                'self_loop_sum', 'zero_value_count']
+
+# successful balance transfers, as counted by richest_accounts.py and self_loops_algorithms.py
+transfer_filter = (
+    "e.module_id = 'Balances' and e.success = 1 and e.from_address_id is not null and e.to_address_id is not null"
+)
+
+# one row per transfer side: self-loops are counted on the incoming side, zero value transfers on the outgoing side
+flow_projection_sql = (
+    "SELECT {key} e.to_address_id AS address_id, 1 AS incoming_count, COALESCE(e.value, 0) AS incoming_sum,"
+    " 0 AS outgoing_count, 0 AS outgoing_sum, IF(e.from_address_id = e.to_address_id, 1, 0) AS self_loop_count,"
+    " IF(e.from_address_id = e.to_address_id, COALESCE(e.value, 0), 0) AS self_loop_sum, 0 AS zero_value_count"
+    " FROM {source} WHERE {filter} {to_address_filter}"
+    " UNION ALL "
+    "SELECT {key} e.from_address_id AS address_id, 0, 0, 1, COALESCE(e.value, 0), 0, 0, IF(e.value = 0, 1, 0)"
+    " FROM {source} WHERE {filter} {from_address_filter}"
+)
+
+flow_sums = ", ".join("SUM({0}) AS {0}".format(column) for column in FLOW_COLUMNS)
+
+upsert_flow_sql = (
+    "INSERT INTO account_flow (address_id, block_bucket, {columns}) VALUES (:address_id, :block_bucket, {values})"
+    " ON DUPLICATE KEY UPDATE {updates}"
+).format(columns=", ".join(FLOW_COLUMNS),
+         values=", ".join(":" + column for column in FLOW_COLUMNS),
+         updates=", ".join("{0} = {0} + VALUES({0})".format(column) for column in FLOW_COLUMNS))
+
+rebuild_flow_sql = (
+    "INSERT INTO account_flow (address_id, block_bucket, {columns})"
+    " SELECT address_id, block_bucket, {sums} FROM ({projection}) t GROUP BY address_id, block_bucket"
+).format(columns=", ".join(FLOW_COLUMNS), sums=flow_sums, projection=flow_projection_sql.format(
+    key="e.block_id DIV {} AS block_bucket,".format(FLOW_BUCKET_BLOCKS), source="extrinsic e",
+    filter=transfer_filter + " and e.block_id BETWEEN :first_block AND :last_block",
+    to_address_filter="", from_address_filter=""))
+
+# full buckets grouped by the first snapshot including them, see cumulative_account_flow
+bucket_flow_sql = (
+    "SELECT address_id, INTERVAL(block_bucket, {thresholds}) AS snapshot_idx, {sums} FROM account_flow"
+    " WHERE address_id IN :address_ids AND block_bucket < :last_bucket GROUP BY address_id, snapshot_idx"
+)
+
+# remaining blocks of a partially covered bucket, per snapshot
+partial_flow_sql = (
+    "SELECT address_id, snapshot_idx, {sums} FROM ({projection}) t GROUP BY address_id, snapshot_idx"
+)
+
+total_flow_sql = (
+    "SELECT address_id, {sums} FROM account_flow WHERE address_id IN :address_ids GROUP BY address_id"
+)
+
+address_dictionary = AddressDictionary()
+
+
+def get_block_bucket(block_id):
+    return block_id // FLOW_BUCKET_BLOCKS
+
+
+def flow_rows(transactions):
+    # aggregate the transfers of a batch of ingested extrinsic rows to account_flow increments
+    rows = defaultdict(lambda: dict.fromkeys(FLOW_COLUMNS, 0))
+    for txn in transactions:
+        if txn['module_id'] != 'Balances' or not txn['success'] or txn['from_address_id'] is None \
+                or txn['to_address_id'] is None:
+            continue
+
+        value = txn['value'] or 0
+        block_bucket = get_block_bucket(txn['block_id'])
+
+        incoming = rows[(txn['to_address_id'], block_bucket)]
+        incoming['incoming_count'] += 1
+        incoming['incoming_sum'] += value
+        if txn['from_address_id'] == txn['to_address_id']:
+            incoming['self_loop_count'] += 1
+            incoming['self_loop_sum'] += value
+
+        outgoing = rows[(txn['from_address_id'], block_bucket)]
+        outgoing['outgoing_count'] += 1
+        outgoing['outgoing_sum'] += value
+        if value == 0:
+            outgoing['zero_value_count'] += 1
+
+    return [dict(flow, address_id=address_id, block_bucket=block_bucket)
+            for (address_id, block_bucket), flow in rows.items()]
+
+
+def update_account_flow(session, transactions):
+    # incremental maintenance, executed in the same db transaction as the ingested extrinsics
+    rows = flow_rows(transactions)
+    if rows:
+        session.execute(text(upsert_flow_sql), rows)
+
+
+def rebuild_account_flow(conn, first_block, last_block):
+    # recompute the buckets covering [first_block, last_block] from the extrinsic table
+    first_bucket = get_block_bucket(first_block)
+    last_bucket = get_block_bucket(last_block)
+    conn.execute(text("DELETE FROM account_flow WHERE block_bucket BETWEEN :first_bucket AND :last_bucket"),
+                 {"first_bucket": first_bucket, "last_bucket": last_bucket})
+    conn.execute(text(rebuild_flow_sql), {"first_block": first_bucket * FLOW_BUCKET_BLOCKS,
+                                          "last_block": (last_bucket + 1) * FLOW_BUCKET_BLOCKS - 1})
+
+
+def account_flow_totals(session, addresses):
+    # {address: {column: value}} over all ingested blocks
+    query = text(total_flow_sql.format(sums=flow_sums)).bindparams(bindparam('address_ids', expanding=True))
+    totals = {address: dict.fromkeys(FLOW_COLUMNS, 0) for address in addresses}
+    address_ids = address_dictionary.lookup_ids(session, addresses)
+    if address_ids:
+        addresses_by_id = {address_id: address for address, address_id in address_ids.items()}
+        for row in session.execute(query, {"address_ids": list(addresses_by_id)}):
+            totals[addresses_by_id[row.address_id]] = {column: int(getattr(row, column)) for column in FLOW_COLUMNS}
+    return totals
+
+
+def cumulative_account_flow(session, addresses, block_ids):
+    """Return {address: [{column: value} up to each block of sorted(block_ids)]}.
+
+    Buckets fully below a block are summed from account_flow in a single query, grouped with INTERVAL() by the
+    first block including them. The blocks of the last, partially covered bucket of each block are read from the
+    extrinsic table by a second query.
+    """
+    block_ids = sorted(block_ids)
+    flow = {address: [dict.fromkeys(FLOW_COLUMNS, 0) for _ in block_ids] for address in addresses}
+    address_ids = address_dictionary.lookup_ids(session, addresses)
+    if not address_ids or not block_ids:
+        return flow
+
+    # the flow lists are shared by address and address id
+    flow_by_id = {address_id: flow[address] for address, address_id in address_ids.items()}
+
+    # number of complete buckets up to and including each block
+    full_buckets = [get_block_bucket(block_id + 1) for block_id in block_ids]
+    params = {"address_ids": list(flow_by_id), "last_bucket": full_buckets[-1]}
+
+    query = text(bucket_flow_sql.format(thresholds=", ".join(str(bucket) for bucket in full_buckets),
+                                        sums=flow_sums)).bindparams(bindparam('address_ids', expanding=True))
+    for row in session.execute(query, params):
+        for column in FLOW_COLUMNS:
+            flow_by_id[row.address_id][row.snapshot_idx][column] += int(getattr(row, column))
+
+    # running totals over the blocks
+    for totals in flow_by_id.values():
+        for idx in range(1, len(totals)):
+            for column in FLOW_COLUMNS:
+                totals[idx][column] += totals[idx - 1][column]
+
+    ranges = " UNION ALL ".join(
+        "SELECT {} AS snapshot_idx, {} AS first_block, {} AS last_block".format(idx, first_block, block_id)
+        for idx, (first_block, block_id) in enumerate(zip(
+            [bucket * FLOW_BUCKET_BLOCKS for bucket in full_buckets], block_ids)) if first_block <= block_id)
+    if ranges:
+        projection = flow_projection_sql.format(
+            key="r.snapshot_idx,",
+            source="({}) r JOIN extrinsic e ON e.block_id BETWEEN r.first_block AND r.last_block".format(ranges),
+            filter=transfer_filter, to_address_filter="and e.to_address_id IN :address_ids",
+            from_address_filter="and e.from_address_id IN :address_ids")
+        query = text(partial_flow_sql.format(sums=flow_sums, projection=projection)) \
+            .bindparams(bindparam('address_ids', expanding=True))
+        for row in session.execute(query, params):
+            if row.address_id in flow_by_id:
+                for column in FLOW_COLUMNS:
+                    flow_by_id[row.address_id][row.snapshot_idx][column] += int(getattr(row, column))
+
+    return flow
+
+
+# Main
+if __name__ == '__main__':
+    # backfill account_flow for blocks ingested before the table existed
+    # (address ids of the extrinsic table are backfilled first by address_dictionary.py)
+    from app.settings import DB_CONNECTION
+
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stdout)],
+                        format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+                        datefmt='%Y-%m-%dT%H:%M:%S', )
+
+    try:
+        start = timer()
+        engine = create_engine(DB_CONNECTION, isolation_level="READ_UNCOMMITTED", pool_pre_ping=True)
+
+        first_block = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+        last_block = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+        if last_block is None:
+            with engine.connect() as conn:
+                last_block = conn.execute(text("SELECT MAX(block_id) FROM extrinsic")).scalar() or 0
+
+        # one transaction per range of buckets to keep transactions small
+        step = 100 * FLOW_BUCKET_BLOCKS
+        for block_id in range(first_block, last_block + 1, step):
+            with engine.begin() as conn:
+                rebuild_account_flow(conn, block_id, min(block_id + step - 1, last_block))
+            logger.info("Rebuilt account_flow until block {}".format(min(block_id + step - 1, last_block)))
+
+        logger.info("Account Flow Total Execution Time (seconds): {}".format(timer() - start))
+
+    except Exception as err:
+        logger.error(traceback.format_exc())
@@ -22,6 +22,8 @@ from substrateinterface import SubstrateInterface
 from substrateinterface.exceptions import StorageFunctionNotFound
 
 from app.models.data import AccountInfoSnapshot
+from app.scripts.address_dictionary import AddressDictionary
+from app.scripts.address_normalizer import address_normalizer
 
 DB_NAME = "polkadot_analysis"
 DB_HOST = "localhost"
@@ -49,6 +51,44 @@ logger = logging.getLogger()
 EXTERNAL_URL = "wss://rpc.polkadot.io"
 INTERNAL_URL = "ws://172.20.135.65:9944"
 
+# System.Account entries fetched and saved per page
+ACCOUNT_PAGE_SIZE = 1000
+
+
+def save_snapshot_page(address_dictionary, block_id, page):
+    # save a page of (account, account_info) entries, the addresses normalized and mapped to ids once per page
+    try:
+        addresses = address_normalizer.normalize_many([account.value for account, account_info in page])
+        address_ids = address_dictionary.get_ids(db_session, list(addresses.values()))
+        public_keys = address_normalizer.get_public_keys(addresses.values())
+
+        rows = []
+        for account, account_info in page:
+            address = addresses[account.value]
+            rows.append(dict(
+                block_id=block_id,
+                account_id=address,
+                address_id=address_ids[address],
+                pkey=public_keys.get(address),
+                balance_free=account_info['data']['free'].value,
+                balance_reserved=account_info['data']['reserved'].value,
+                balance_total=account_info["data"]["free"].value + account_info["data"]["reserved"].value,
+                nonce=account_info['nonce'].value,
+            ))
+
+        # Make sure no rows inserted before processing these records
+        AccountInfoSnapshot.query(db_session).filter(
+            AccountInfoSnapshot.block_id == block_id,
+            AccountInfoSnapshot.account_id.in_(list(addresses.values()))).delete(synchronize_session=False)
+        db_session.execute(AccountInfoSnapshot.__table__.insert(), rows)
+        db_session.commit()
+        logger.info("Saved {} accounts, block#{}".format(len(rows), block_id))
+
+    except Exception as err:
+        # clear the db session.py
+        db_session.rollback()
+        logger.error(traceback.format_exc())
+
 
 # Main
 if __name__ == '__main__':
@@ -87,42 +127,23 @@ if __name__ == '__main__':
             #              5650640, 6082432, 6527621, 6973768, 7847525, 8279239, 8725455,
             #              9171661, 9573880, 10019762, 10448617, 10883304, 11307029]
             block_ids = [10883304, 11307029]
+            address_dictionary = AddressDictionary()
 
             for block_id in block_ids:
 
-                token_decimals = substrate.token_decimals if block_id >= 1248328 else 12
-                result = substrate.query_map('System', 'Account', page_size=1000)
+                # balances at block_id, the balance engine seeds and verifies its checkpoints with these snapshots
+                block_hash = substrate.get_block_hash(block_id)
+                result = substrate.query_map('System', 'Account', page_size=ACCOUNT_PAGE_SIZE, block_hash=block_hash)
 
+                page = []
                 for account, account_info in result:
-                    # Get balance for account
-                    try:
+                    page.append((account, account_info))
+                    if len(page) >= ACCOUNT_PAGE_SIZE:
+                        save_snapshot_page(address_dictionary, block_id, page)
+                        page = []
+                if page:
+                    save_snapshot_page(address_dictionary, block_id, page)
 
-                        # Make sure no rows inserted before processing this record
-                        AccountInfoSnapshot.query(db_session).filter_by(block_id=block_id,
-                                                                        account_id=account.value).delete()
-
-                        account_info_obj = AccountInfoSnapshot(
-                            block_id=block_id,
-                            account_id=account.value,
-                            pkey=substrate.ss58_decode(account.value),
-                            balance_free=account_info['data']['free'].value / 10 ** token_decimals,
-                            balance_reserved=account_info['data']['reserved'].value / 10 ** token_decimals,
-                            balance_total=(account_info["data"]["free"].value + account_info["data"][
-                                "reserved"].value) / 10 ** token_decimals,
-                            nonce=account_info['nonce'].value,
-                        )
-
-                        logger.info("Saving account {}, block#{}".format(account_info_obj.account_id, block_id))
-                        account_info_obj.save(db_session)
-
-                        db_session.commit()
-
-                    except Exception as err:
-                        # clear the db session.py
-                        db_session.rollback()
-                        logger.error(traceback.format_exc())
-
-                block_hash = substrate.get_block_hash(block_id)
                 nominators = []
                 validators = []
                 council_members = []
@@ -161,7 +182,7 @@ if __name__ == '__main__':
                     validators_q = []
 
                 for rank_nr, validator_account in enumerate(validators_q):
-                    validators.append(validator_account.value)
+                    validators.append(address_normalizer.normalize(validator_account.value))
 
                     try:
                         exposure = substrate.query(
@@ -180,13 +201,18 @@ if __name__ == '__main__':
 
                     # Store nominators
                     for rank_nominator, nominator_info in enumerate(exposure.get('others', [])):
-                        nominator_stash = nominator_info.get('who').replace('0x', '')
+                        nominator_stash = address_normalizer.normalize(nominator_info.get('who'))
                         nominators.append(nominator_stash)
 
+                # snapshot rows are matched on their address id, accounts without an id have no snapshot row
+                role_ids = address_dictionary.lookup_ids(db_session, validators + nominators + council_members)
+
                 for validator in validators:
+                    if validator not in role_ids:
+                        continue
                     try:
                         AccountInfoSnapshot.query(db_session).filter_by(block_id=block_id,
-                                                                        account_id=validator) \
+                                                                        address_id=role_ids[validator]) \
                             .update({AccountInfoSnapshot.is_validator: True, }, synchronize_session='fetch')
                         logger.info("Saving validator {}, block#{}".format(validator, block_id))
                         db_session.commit()
@@ -196,9 +222,11 @@ if __name__ == '__main__':
                         logger.error(traceback.format_exc())
 
                 for nominator in nominators:
+                    if nominator not in role_ids:
+                        continue
                     try:
                         AccountInfoSnapshot.query(db_session).filter_by(block_id=block_id,
-                                                                        account_id=nominator) \
+                                                                        address_id=role_ids[nominator]) \
                             .update({AccountInfoSnapshot.is_nominator: True, }, synchronize_session='fetch')
                         logger.info("Saving nominator {}, block#{}".format(nominator, block_id))
                         db_session.commit()
@@ -208,9 +236,11 @@ if __name__ == '__main__':
                         logger.error(traceback.format_exc())
 
                 for council in council_members:
+                    if council not in role_ids:
+                        continue
                     try:
                         AccountInfoSnapshot.query(db_session).filter_by(block_id=block_id,
-                                                                        account_id=council) \
+                                                                        address_id=role_ids[council]) \
                             .update({AccountInfoSnapshot.is_council: True, }, synchronize_session='fetch')
                         logger.info("Saving council {}, block#{}".format(council, block_id))
                         db_session.commit()
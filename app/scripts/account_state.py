@@ -0,0 +1,92 @@
+"""
+account_state.py
+
+Account state changes derived from events (reaping and re-creation), applied per batch of blocks with bulk
+account_history rows.
+
+GNU General Public License Version 3
+"""
+
+import logging
+
+from sqlalchemy.sql import bindparam, text
+
+from app.scripts.balance_events import get_event_values
+
+logger = logging.getLogger(__name__)
+
+# (module_id, event_id) of the events changing the state of an account: value of account.is_reaped afterwards
+ACCOUNT_STATE_EVENTS = {
+    ('System', 'KilledAccount'): True,
+    ('System', 'NewAccount'): False,
+}
+
+# accounts updated per statement
+ACCOUNT_STATE_CHUNK_SIZE = 1000
+
+# account columns copied to account_history, formerly by the account__ai and account__au row triggers
+HISTORY_COLUMNS = ['address', 'balance_free', 'balance_reserved', 'is_reaped', 'is_validator', 'is_nominator',
+                   'identity_display', 'identity_judgement', 'updated_at_block']
+
+update_account_state_sql = (
+    "UPDATE account a JOIN ({states}) s ON a.address = s.address"
+    " SET a.is_reaped = s.is_reaped, a.updated_at_block = s.block_id"
+)
+
+insert_account_history_sql = (
+    "INSERT INTO account_history ({columns}) SELECT {columns} FROM account WHERE address IN :addresses"
+).format(columns=", ".join(HISTORY_COLUMNS))
+
+
+def account_state_changes(events):
+    # [{address, is_reaped, block_id}] of decoded event rows, in event order
+    changes = []
+    for event in events:
+        is_reaped = ACCOUNT_STATE_EVENTS.get((event['module_id'], event['event_id']))
+        if is_reaped is None:
+            continue
+        try:
+            # pre and post-block 7229130 attribute layouts
+            address = get_event_values(event['attributes'])[0]
+        except IndexError:
+            logger.error("Unexpected attributes of event {}-{}: {}".format(event['block_id'], event['event_idx'],
+                                                                         event['attributes']))
+            continue
+        changes.append(dict(address=address, is_reaped=is_reaped, block_id=event['block_id']))
+    return changes
+
+
+def insert_account_history(session, addresses):
+    # one account_history row per account, with its current state
+    query = text(insert_account_history_sql).bindparams(bindparam('addresses', expanding=True))
+    addresses = list(addresses)
+    for chunk in range(0, len(addresses), ACCOUNT_STATE_CHUNK_SIZE):
+        session.execute(query, {"addresses": addresses[chunk:chunk + ACCOUNT_STATE_CHUNK_SIZE]})
+
+
+def apply_account_states(session, changes):
+    """Apply the account state changes of a batch of blocks with one set-based UPDATE per chunk of accounts.
+
+    Only the last change of each account is applied. Accounts without an account row are skipped, they are
+    created by account_data.discover_accounts. The history rows of the updated accounts are inserted in bulk, in
+    the same db transaction.
+    """
+    states = {}
+    for change in changes:
+        states[change['address']] = change
+    states = list(states.values())
+
+    for chunk in range(0, len(states), ACCOUNT_STATE_CHUNK_SIZE):
+        chunk_states = states[chunk:chunk + ACCOUNT_STATE_CHUNK_SIZE]
+        params = {}
+        selects = []
+        for idx, state in enumerate(chunk_states):
+            selects.append("SELECT :address_{0} AS address, :is_reaped_{0} AS is_reaped, :block_id_{0} AS block_id"
+                           .format(idx))
+            params.update({"address_{}".format(idx): state['address'],
+                           "is_reaped_{}".format(idx): state['is_reaped'],
+                           "block_id_{}".format(idx): state['block_id']})
+        session.execute(text(update_account_state_sql.format(states=" UNION ALL ".join(selects))), params)
+
+    insert_account_history(session, [state['address'] for state in states])
+    return len(states)
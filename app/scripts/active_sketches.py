@@ -0,0 +1,237 @@
+"""
+active_sketches.py
+
+HyperLogLog sketches of the distinct senders, receivers and participants of the transfers of every day
+(active_sketch table): distinct active accounts of any window from merging its daily sketches.
+
+GNU General Public License Version 3
+"""
+
+import logging
+import sys
+import traceback
+from datetime import date, timedelta
+from timeit import default_timer as timer
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.sql import bindparam, text
+
+from app.scripts.account_flow import FLOW_BUCKET_BLOCKS, transfer_filter
+from app.scripts.volume_rollup import RECEIVER, SENDER, is_transfer
+
+logger = logging.getLogger(__name__)
+
+# 2^14 one byte registers per sketch (16 KiB), standard error 1.04 / sqrt(2^14) = 0.81%
+HLL_PRECISION = 14
+
+# senders or receivers, role of the sketches of all the accounts of the transfers
+PARTICIPANT = 2
+SKETCH_ROLES = {'senders': SENDER, 'receivers': RECEIVER, 'participants': PARTICIPANT}
+
+select_sketches_sql = (
+    "SELECT day, role, registers FROM active_sketch WHERE day IN :days FOR UPDATE"
+)
+
+upsert_sketch_sql = (
+    "INSERT INTO active_sketch (day, role, registers) VALUES (:day, :role, :registers)"
+    " ON DUPLICATE KEY UPDATE registers = VALUES(registers)"
+)
+
+window_sketches_sql = (
+    "SELECT registers FROM active_sketch WHERE day BETWEEN :first_day AND :last_day AND role = :role"
+)
+
+transfers_sql = (
+    "SELECT DATE(e.datetime) AS day, e.from_address_id, e.to_address_id FROM extrinsic e"
+    " WHERE {filter} AND e.block_id BETWEEN :first_block AND :last_block AND e.datetime IS NOT NULL"
+).format(filter=transfer_filter)
+
+
+def hash_ids(address_ids):
+    # 64 bits hashes of integer ids (splitmix64 finalizer), vectorized over the ids
+    hashes = np.asarray(address_ids, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    hashes = (hashes ^ (hashes >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    hashes = (hashes ^ (hashes >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return hashes ^ (hashes >> np.uint64(31))
+
+
+class HyperLogLog:
+    """HyperLogLog sketch of a set of integer ids.
+
+    The first HLL_PRECISION bits of the hash select a register, which keeps the maximum position of the first set
+    bit of the remaining bits. Merging two sketches is the element-wise maximum of their registers, so sketches of
+    overlapping sets and repeated merges of the same sketch do not over-count.
+    """
+
+    def __init__(self, registers=None, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+
+    @classmethod
+    def from_bytes(cls, value, precision=HLL_PRECISION):
+        return cls(np.frombuffer(value, dtype=np.uint8).copy(), precision)
+
+    def to_bytes(self):
+        return self.registers.tobytes()
+
+    def add_many(self, address_ids):
+        if not len(address_ids):
+            return self
+        hashes = hash_ids(address_ids)
+        suffix_bits = 64 - self.precision
+        idx = (hashes >> np.uint64(suffix_bits)).astype(np.int64)
+        # remaining bits below 2^50: exact in float64, frexp gives their bit length
+        remaining = (hashes & np.uint64((1 << suffix_bits) - 1)).astype(np.float64)
+        rank = (suffix_bits + 1 - np.frexp(remaining)[1]).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rank)
+        return self
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        # HyperLogLog estimate, with linear counting for the small cardinalities
+        registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / registers)
+        estimate = alpha * registers ** 2 / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        empty = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * registers and empty:
+            estimate = registers * np.log(registers / empty)
+        return int(round(estimate))
+
+
+def daily_ids(transfers):
+    # {(day, role): [address ids]} of (day, from_address_id, to_address_id) transfers
+    ids = {}
+    for day, from_address_id, to_address_id in transfers:
+        ids.setdefault((day, SENDER), []).append(from_address_id)
+        ids.setdefault((day, RECEIVER), []).append(to_address_id)
+        ids.setdefault((day, PARTICIPANT), []).extend((from_address_id, to_address_id))
+    return ids
+
+
+def daily_sketches(transfers):
+    # {(day, role): HyperLogLog} of (day, from_address_id, to_address_id) transfers
+    return {key: HyperLogLog().add_many(address_ids) for key, address_ids in daily_ids(transfers).items()}
+
+
+def write_sketches(session, sketches):
+    # merge the sketches into the stored sketches of their days
+    if not sketches:
+        return
+    query = text(select_sketches_sql).bindparams(bindparam('days', expanding=True))
+    for row in session.execute(query, {"days": list({day for day, role in sketches})}):
+        if (row.day, row.role) in sketches:
+            sketches[(row.day, row.role)].merge(HyperLogLog.from_bytes(row.registers))
+    session.execute(text(upsert_sketch_sql), [dict(day=day, role=role, registers=sketch.to_bytes())
+                                              for (day, role), sketch in sketches.items()])
+
+
+class ActiveSketches:
+    """Sketches of the days of the ingested blocks, merged into the stored sketches once per day.
+
+    The transfers of the committed blocks are added to in-memory sketches, and the sketches of a day are merged
+    into active_sketch when a block of a later day is committed and at the end of a run (flush), in a transaction
+    of their own, instead of rewriting the day rows with every write batch. Merging is idempotent, the days
+    pending when a run is interrupted are sketched again by build.
+    """
+
+    def __init__(self):
+        # {(day, role): HyperLogLog}
+        self.sketches = {}
+
+    def add_blocks(self, session, decoded_blocks):
+        days = [decoded_block['block']['datetime'].date() for decoded_block in decoded_blocks
+                if decoded_block['block']['datetime'] is not None]
+        transfers = [(decoded_block['block']['datetime'].date(), txn['from_address_id'], txn['to_address_id'])
+                     for decoded_block in decoded_blocks if decoded_block['block']['datetime'] is not None
+                     for txn in decoded_block['extrinsics'] if is_transfer(txn)]
+        for key, address_ids in daily_ids(transfers).items():
+            self.sketches.setdefault(key, HyperLogLog()).add_many(address_ids)
+        if days:
+            latest = max(days + [day for day, role in self.sketches])
+            self.write(session, [key for key in self.sketches if key[0] < latest])
+
+    def flush(self, session):
+        self.write(session, list(self.sketches))
+
+    def write(self, session, keys):
+        if keys:
+            with session.get_bind().begin() as conn:
+                write_sketches(conn, {key: self.sketches[key] for key in keys})
+        for key in keys:
+            del self.sketches[key]
+
+
+def build_active_sketches(engine, first_block, last_block):
+    """Build the sketches of the transfers of [first_block, last_block], one range of FLOW_BUCKET_BLOCKS at a time.
+
+    Every range is read with its own query and merged into the stored sketches in its own db transaction. Merging
+    is idempotent, so a day split across two ranges gets the union of both, and a rebuild over already sketched
+    blocks leaves the sketches unchanged.
+    """
+    for range_first in range(first_block, last_block + 1, FLOW_BUCKET_BLOCKS):
+        range_last = min(range_first + FLOW_BUCKET_BLOCKS - 1, last_block)
+        with engine.begin() as conn:
+            transfers = [(row.day, row.from_address_id, row.to_address_id) for row in conn.execute(
+                text(transfers_sql), {"first_block": range_first, "last_block": range_last})]
+            write_sketches(conn, daily_sketches(transfers))
+        logger.info("Sketched {} transfers until block {}".format(len(transfers), range_last))
+
+
+def distinct_active(conn, first_day, last_day, role=PARTICIPANT):
+    # estimated distinct accounts of a role in the days [first_day, last_day]
+    sketch = HyperLogLog()
+    for row in conn.execute(text(window_sketches_sql), {"first_day": first_day, "last_day": last_day,
+                                                          "role": role}):
+        sketch.merge(HyperLogLog.from_bytes(row.registers))
+    return sketch.count()
+
+
+def monthly_active(conn, first_day, last_day):
+    # {(year, month): {role name: estimated distinct accounts}} of the months of [first_day, last_day]
+    months = {}
+    month = first_day.replace(day=1)
+    while month <= last_day:
+        next_month = (month + timedelta(days=32)).replace(day=1)
+        months[(month.year, month.month)] = {
+            name: distinct_active(conn, max(month, first_day), min(next_month - timedelta(days=1), last_day), role)
+            for name, role in SKETCH_ROLES.items()}
+        month = next_month
+    return months
+
+
+# Main
+if __name__ == '__main__':
+    # active_sketches.py build [first block] [last block]: sketch the ingested transfers
+    # active_sketches.py count <first day> <last day>: distinct active accounts per month, e.g. 2020-06-01 2022-11-30
+    from app.settings import DB_CONNECTION
+
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stdout)],
+                        format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+                        datefmt='%Y-%m-%dT%H:%M:%S', )
+
+    try:
+        start = timer()
+        engine = create_engine(DB_CONNECTION, isolation_level="READ_UNCOMMITTED", pool_pre_ping=True)
+
+        if sys.argv[1] == 'build':
+            first_block = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+            last_block = int(sys.argv[3]) if len(sys.argv) > 3 else None
+            if last_block is None:
+                with engine.connect() as conn:
+                    last_block = conn.execute(text("SELECT MAX(block_id) FROM extrinsic")).scalar() or 0
+            build_active_sketches(engine, first_block, last_block)
+        elif sys.argv[1] == 'count':
+            with engine.connect() as conn:
+                months = monthly_active(conn, date.fromisoformat(sys.argv[2]), date.fromisoformat(sys.argv[3]))
+            for (year, month), counts in months.items():
+                logger.info("{}-{:02d} --- {}".format(year, month, ", ".join(
+                    "{} {}".format(name, count) for name, count in counts.items())))
+
+        logger.info("Active Sketches Total Execution Time (seconds): {}".format(timer() - start))
+
+    except Exception as err:
+        logger.error(traceback.format_exc())
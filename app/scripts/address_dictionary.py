@@ -0,0 +1,159 @@
+"""
+address_dictionary.py
+
+Dictionary of SS58 addresses to compact integer ids (address table).
+
+GNU General Public License Version 3
+"""
+
+import logging
+import sys
+import traceback
+from timeit import default_timer as timer
+
+from sqlalchemy import create_engine
+from sqlalchemy.sql import bindparam, text
+
+from app.scripts.address_normalizer import address_normalizer
+
+logger = logging.getLogger(__name__)
+
+# number of addresses sent in a single IN (...) lookup
+ADDRESS_QUERY_PAGE_SIZE = 1000
+
+select_ids_sql = "SELECT address, id FROM address WHERE address IN :addresses"
+
+insert_address_sql = "INSERT IGNORE INTO address (address, pkey) VALUES (:address, :pkey)"
+
+# backfill of the tables ingested before the address dictionary existed
+backfill_address_sql = (
+    "INSERT IGNORE INTO address (address) SELECT DISTINCT {column} FROM {table}"
+    " WHERE {column} IS NOT NULL AND block_id BETWEEN :first_block AND :last_block"
+)
+
+backfill_ids_sql = (
+    "UPDATE {table} t JOIN address a ON a.address = t.{column} SET t.{column_id} = a.id"
+    " WHERE t.block_id BETWEEN :first_block AND :last_block"
+)
+
+BACKFILL_COLUMNS = [('extrinsic', 'from_address', 'from_address_id'), ('extrinsic', 'to_address', 'to_address_id'),
+                    ('account_info_snapshot', 'account_id', 'address_id')]
+
+# indexes of the address columns, replaced by the indexes of their id columns once these are backfilled
+ADDRESS_INDEXES = [('extrinsic', 'ix_extrinsic_from_address'), ('extrinsic', 'ix_extrinsic_to_address'),
+                   ('account_info_snapshot', 'ix_account_info_snapshot_account_id')]
+
+unmapped_row_sql = "SELECT 1 FROM {table} WHERE {column} IS NOT NULL AND {column_id} IS NULL LIMIT 1"
+
+existing_index_sql = (
+    "SELECT COUNT(*) FROM information_schema.statistics"
+    " WHERE table_schema = DATABASE() AND table_name = :table_name AND index_name = :index_name"
+)
+
+
+class AddressDictionary:
+    """In-memory cache of the address table.
+
+    Ids of new addresses are assigned with INSERT IGNORE in a short transaction of their own, so concurrent
+    writers (e.g. replay workers) agree on the id of an address and ids are never rolled back with a failed block.
+    """
+
+    def __init__(self):
+        self.ids = {}
+
+    def load_ids(self, conn, addresses):
+        query = text(select_ids_sql).bindparams(bindparam('addresses', expanding=True))
+        for page in range(0, len(addresses), ADDRESS_QUERY_PAGE_SIZE):
+            for row in conn.execute(query, {"addresses": addresses[page:page + ADDRESS_QUERY_PAGE_SIZE]}):
+                self.ids[row.address] = row.id
+
+    def lookup_ids(self, session, addresses):
+        # {address: id} of known addresses, without assigning ids to new ones
+        missing = list({address for address in addresses if address is not None and address not in self.ids})
+        if missing:
+            self.load_ids(session, missing)
+        return {address: self.ids[address] for address in addresses if address in self.ids}
+
+    def get_ids(self, session, addresses):
+        # {address: id}, new addresses are added to the dictionary
+        missing = list({address for address in addresses if address is not None and address not in self.ids})
+        if missing:
+            with session.get_bind().begin() as conn:
+                self.load_ids(conn, missing)
+                new = [address for address in missing if address not in self.ids]
+                if new:
+                    # public keys of SS58 addresses, None for addresses stored in another format (e.g. Address20:...)
+                    public_keys = address_normalizer.get_public_keys(new)
+                    conn.execute(text(insert_address_sql), [{"address": address, "pkey": public_keys.get(address)}
+                                                            for address in new])
+                    self.load_ids(conn, new)
+        return {address: self.ids[address] for address in addresses if address is not None}
+
+    def set_ids(self, session, rows, address_columns=('from_address', 'to_address')):
+        # fill the `<column>_id` of row dicts from their address columns
+        ids = self.get_ids(session, [row[column] for row in rows for column in address_columns])
+        for row in rows:
+            for column in address_columns:
+                row[column + '_id'] = ids.get(row[column])
+
+
+def drop_address_indexes(engine):
+    # drop the address column indexes once every row has its address ids, kept while some rows are not backfilled
+    with engine.connect() as conn:
+        for table, column, column_id in BACKFILL_COLUMNS:
+            if conn.execute(text(unmapped_row_sql.format(table=table, column=column, column_id=column_id))).first():
+                logger.info("Rows of {} without {}, address indexes kept".format(table, column_id))
+                return
+        for table, index_name in ADDRESS_INDEXES:
+            if conn.execute(text(existing_index_sql), {"table_name": table, "index_name": index_name}).scalar():
+                conn.execute(text("ALTER TABLE `{}` DROP INDEX `{}`".format(table, index_name)))
+                logger.info("Dropped index {} of table {}".format(index_name, table))
+
+
+# Main
+if __name__ == '__main__':
+    # backfill the address dictionary and the id columns: address_dictionary.py <first block> <last block>
+    from app.settings import DB_CONNECTION
+
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stdout)],
+                        format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+                        datefmt='%Y-%m-%dT%H:%M:%S', )
+
+    try:
+        start = timer()
+        engine = create_engine(DB_CONNECTION, isolation_level="READ_UNCOMMITTED", pool_pre_ping=True)
+
+        first_block = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+        last_block = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+        if last_block is None:
+            with engine.connect() as conn:
+                last_block = conn.execute(text("SELECT MAX(block_id) FROM extrinsic")).scalar() or 0
+
+        # one transaction per range of blocks to keep transactions small
+        step = 100000
+        for block_id in range(first_block, last_block + 1, step):
+            params = {"first_block": block_id, "last_block": min(block_id + step - 1, last_block)}
+            for table, column, column_id in BACKFILL_COLUMNS:
+                with engine.begin() as conn:
+                    conn.execute(text(backfill_address_sql.format(table=table, column=column)), params)
+                    conn.execute(text(backfill_ids_sql.format(table=table, column=column, column_id=column_id)),
+                                 params)
+            logger.info("Backfilled address ids until block {}".format(params["last_block"]))
+
+        # addresses inserted by the backfill have no public key yet
+        with engine.connect() as conn:
+            addresses = [row.address for row in conn.execute(text("SELECT address FROM address WHERE pkey IS NULL"))]
+        for page in range(0, len(addresses), ADDRESS_QUERY_PAGE_SIZE):
+            rows = [{"address": address, "pkey": pkey} for address, pkey in
+                    address_normalizer.get_public_keys(addresses[page:page + ADDRESS_QUERY_PAGE_SIZE]).items()]
+            if rows:
+                with engine.begin() as conn:
+                    conn.execute(text("UPDATE address SET pkey = :pkey WHERE address = :address"), rows)
+
+        drop_address_indexes(engine)
+
+        logger.info("Address Dictionary Total Execution Time (seconds): {}".format(timer() - start))
+
+    except Exception as err:
+        logger.error(traceback.format_exc())
@@ -0,0 +1,101 @@
+"""
+address_normalizer.py
+
+Memoized normalization of raw account payloads (MultiAddress, AccountId, public keys) to canonical SS58 addresses.
+
+GNU General Public License Version 3
+"""
+
+from functools import lru_cache
+
+from substrateinterface.utils.ss58 import ss58_decode, ss58_encode
+
+# distinct values kept in the cache, the few hot addresses (exchanges, treasury) of a block range stay cached
+ADDRESS_CACHE_SIZE = 200000
+
+# prefix of the 20 bytes (Ethereum style) addresses, stored as is
+ADDRESS20_PREFIX = 'Address20:'
+
+
+def is_public_key(value):
+    # 32 bytes hex account id, with or without 0x
+    value = value[2:] if value.startswith('0x') else value
+    if len(value) != 64:
+        return False
+    try:
+        bytes.fromhex(value)
+    except ValueError:
+        return False
+    return True
+
+
+class AddressNormalizer:
+    """Map account payloads to (canonical SS58 address, public key) through a bounded LRU cache.
+
+    Accepts SS58 addresses of any network format, hex public keys with or without 0x and MultiAddress dicts
+    (Id, Address32, Raw, Address20). The canonical address is the SS58 encoding of the public key in the
+    ss58_format of the chain, so the same account always maps to the same string.
+    """
+
+    def __init__(self, ss58_format=0, cache_size=ADDRESS_CACHE_SIZE):
+        self.ss58_format = ss58_format
+        self.parse = lru_cache(maxsize=cache_size)(self._parse)
+
+    def _parse(self, value):
+        # (canonical address, public key hex without 0x), (value, None) for values that are not account ids
+        if value.startswith(ADDRESS20_PREFIX):
+            return value, None
+        if is_public_key(value):
+            public_key = value.replace('0x', '').lower()
+            return ss58_encode(public_key, ss58_format=self.ss58_format), public_key
+        try:
+            public_key = ss58_decode(value)
+        except (ValueError, IndexError):
+            return value, None
+        # account indices decode to less than 32 bytes
+        if len(public_key) != 64:
+            return value, None
+        return ss58_encode(public_key, ss58_format=self.ss58_format), public_key
+
+    def normalize(self, value):
+        # canonical address of a raw payload, None for payloads without an account (e.g. MultiAddress::Index)
+        if value is None:
+            return None
+        if isinstance(value, dict):
+            if 'Id' in value:
+                value = value['Id']
+            elif 'Address20' in value:
+                return ADDRESS20_PREFIX + value['Address20']
+            elif 'Address32' in value:
+                value = value['Address32']
+            elif 'Raw' in value:
+                value = value['Raw']
+                if not is_public_key(value):
+                    return None
+            else:
+                return None
+        if isinstance(value, (bytes, bytearray)):
+            value = bytes(value).hex()
+        return self.parse(value)[0]
+
+    def get_public_key(self, address):
+        # public key hex (without 0x) of an address, None for addresses that are not SS58 encoded account ids
+        if address is None:
+            return None
+        return self.parse(address)[1]
+
+    def is_valid(self, address):
+        return self.get_public_key(address) is not None
+
+    def normalize_many(self, values):
+        # {value: canonical address} of string payloads, each distinct value is parsed once
+        return {value: self.parse(value)[0] for value in set(values) if value is not None}
+
+    def get_public_keys(self, addresses):
+        # {address: public key} of the valid addresses, each distinct address is parsed once
+        public_keys = {address: self.get_public_key(address) for address in set(addresses) if address is not None}
+        return {address: public_key for address, public_key in public_keys.items() if public_key is not None}
+
+
+# shared by the ingest and account scripts, so that they share the parse cache
+address_normalizer = AddressNormalizer(ss58_format=0)
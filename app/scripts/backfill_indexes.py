@@ -0,0 +1,119 @@
+"""
+backfill_indexes.py
+
+Secondary index management of the extrinsic and event tables for bulk backfills.
+
+GNU General Public License Version 3
+"""
+
+import logging
+import sys
+import traceback
+from timeit import default_timer as timer
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.sql import bindparam, text
+
+logger = logging.getLogger(__name__)
+
+# secondary indexes not needed while ingesting, as defined in schema.sql
+# primary keys are kept: they are the clustered index and are used by INSERT IGNORE
+BACKFILL_INDEXES = {
+    'extrinsic': [
+        ('ix_extrinsic_block_id', '(`block_id` ASC) VISIBLE'),
+        ('ix_extrinsic_call_id', '(`call_id` ASC) VISIBLE'),
+        ('ix_extrinsic_extrinsic_idx', '(`extrinsic_idx` ASC) VISIBLE'),
+        ('ix_extrinsic_module_id', '(`module_id` ASC) VISIBLE'),
+        ('ix_extrinsic_signed', '(`signed` ASC) VISIBLE'),
+        ('ix_extrinsic_from_address_id', '(`from_address_id` ASC) VISIBLE'),
+        ('ix_extrinsic_to_address_id', '(`to_address_id` ASC) VISIBLE'),
+    ],
+    'event': [
+        ('ix_event_block_id', '(`block_id` ASC) VISIBLE'),
+        ('ix_event_event_id', '(`event_id` ASC) VISIBLE'),
+        ('ix_event_event_idx', '(`event_idx` ASC) VISIBLE'),
+        ('ix_event_extrinsic_idx', '(`extrinsic_idx` ASC) VISIBLE'),
+        ('ix_event_module_id', '(`module_id` ASC) VISIBLE'),
+        ('ix_event_system', '(`system` ASC) VISIBLE'),
+        ('ix_event_type', '(`type` ASC) VISIBLE'),
+    ],
+}
+
+# session settings of the ingest connections during a backfill
+BACKFILL_SESSION_SQL = "SET SESSION unique_checks = 0, foreign_key_checks = 0"
+
+existing_indexes_sql = (
+    "SELECT DISTINCT index_name FROM information_schema.statistics"
+    " WHERE table_schema = DATABASE() AND table_name = :table_name AND index_name IN :index_names"
+)
+
+
+def get_existing_indexes(conn, table_name):
+    query = text(existing_indexes_sql).bindparams(bindparam('index_names', expanding=True))
+    index_names = [index_name for index_name, definition in BACKFILL_INDEXES[table_name]]
+    return {row[0] for row in conn.execute(query, {"table_name": table_name, "index_names": index_names})}
+
+
+def drop_backfill_indexes(engine):
+    # one ALTER TABLE per table, indexes already dropped are skipped so an interrupted backfill can be restarted
+    with engine.connect() as conn:
+        for table_name in BACKFILL_INDEXES:
+            existing = get_existing_indexes(conn, table_name)
+            if existing:
+                conn.execute(text("ALTER TABLE `{}` {}".format(
+                    table_name, ", ".join("DROP INDEX `{}`".format(index_name) for index_name in sorted(existing)))))
+                logger.info("Dropped {} indexes of table {}".format(len(existing), table_name))
+
+
+def rebuild_backfill_indexes(engine):
+    # all missing indexes of a table are built in a single pass over the table
+    with engine.connect() as conn:
+        for table_name, indexes in BACKFILL_INDEXES.items():
+            existing = get_existing_indexes(conn, table_name)
+            missing = [(index_name, definition) for index_name, definition in indexes if index_name not in existing]
+            if missing:
+                start = timer()
+                conn.execute(text("ALTER TABLE `{}` {}, ALGORITHM=INPLACE, LOCK=NONE".format(
+                    table_name, ", ".join("ADD INDEX `{}` {}".format(index_name, definition)
+                                          for index_name, definition in missing))))
+                logger.info("Rebuilt {} indexes of table {} in {} seconds".format(
+                    len(missing), table_name, timer() - start))
+
+
+def set_backfill_session(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(BACKFILL_SESSION_SQL)
+    cursor.close()
+
+
+def enable_backfill_mode(engine):
+    """Prepare the extrinsic and event tables and the engine connections for a bulk backfill.
+
+    Drops the secondary indexes of BACKFILL_INDEXES and disables unique and foreign key checks on every new
+    connection of the engine. The engine connections are reset, so connections opened afterwards, including
+    those of worker processes, use the backfill settings. rebuild_backfill_indexes restores the indexes.
+    """
+    drop_backfill_indexes(engine)
+    event.listen(engine, 'connect', set_backfill_session)
+    engine.dispose()
+
+
+# Main
+if __name__ == '__main__':
+    # restore the indexes after an interrupted backfill: backfill_indexes.py rebuild
+    from app.settings import DB_CONNECTION
+
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stdout)],
+                        format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+                        datefmt='%Y-%m-%dT%H:%M:%S', )
+
+    try:
+        engine = create_engine(DB_CONNECTION, isolation_level="READ_UNCOMMITTED", pool_pre_ping=True)
+
+        if len(sys.argv) > 1 and sys.argv[1] == 'drop':
+            drop_backfill_indexes(engine)
+        else:
+            rebuild_backfill_indexes(engine)
+
+    except Exception as err:
+        logger.error(traceback.format_exc())
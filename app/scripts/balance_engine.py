@@ -0,0 +1,219 @@
+"""
+balance_engine.py
+
+Event-sourced account balances: balance_checkpoint tables replayed from the ingested balance events, and balances
+as of any block computed as checkpoint plus delta.
+
+Balance totals (free + reserved) are replayed from Balances Transfer, Deposit, Withdraw, DustLost, Slashed and
+ReserveRepatriated, Treasury Deposit and the fees of the extrinsics of the older runtimes. Events not replayed:
+- Balances.BalanceSet: sets the free and reserved balances of an account (root only), it is not a delta
+- Balances Reserved and Unreserved: they move balance between free and reserved, the total is unchanged
+- Balances.Endowed: the credit of a new account comes with its Transfer or Deposit event
+Changes of the older runtimes that emitted no balance event are not replayed either. verify reports the
+BalanceSet events since the first checkpoint, and the accounts whose replayed balance differs from the snapshot.
+
+GNU General Public License Version 3
+"""
+
+import csv
+import logging
+import sys
+import traceback
+from timeit import default_timer as timer
+
+from sqlalchemy import create_engine
+from sqlalchemy.sql import text
+
+logger = logging.getLogger(__name__)
+
+# blocks between two checkpoints, a checkpoint holds the balances after block k * CHECKPOINT_BLOCKS
+CHECKPOINT_BLOCKS = 500000
+
+# signed balance changes of the blocks [first_block, last_block], one row per account and event:
+# - transfers, deposits, withdrawals (fees of the current fee model), dust removal and slashes
+# - reserved balance repatriated to another account (Balances.ReserveRepatriated), debited and credited
+# - fees (and tips) of the extrinsics of the older runtimes without a Balances.Withdraw event
+# - the treasury share of these fees (Treasury.Deposit), when the treasury has no Balances.Deposit for them
+# Balances.Endowed is not a change, it comes with the Transfer or Deposit crediting the new account.
+balance_delta_sql = (
+    "SELECT to_address_id AS address_id, CAST(amount AS DECIMAL(39,0)) AS delta FROM transfer_event"
+    " WHERE block_id BETWEEN :first_block AND :last_block"
+    " UNION ALL "
+    "SELECT from_address_id, -CAST(amount AS DECIMAL(39,0)) FROM transfer_event"
+    " WHERE block_id BETWEEN :first_block AND :last_block"
+    " UNION ALL "
+    "SELECT address_id, IF(event_id IN ('Deposit', 'ReserveRepatriated'), 1, -1) * CAST(amount AS DECIMAL(39,0))"
+    " FROM balance_event WHERE block_id BETWEEN :first_block AND :last_block AND module_id = 'Balances'"
+    " AND event_id IN ('Deposit', 'Withdraw', 'DustLost', 'Slashed', 'ReserveRepatriated')"
+    " UNION ALL "
+    "SELECT from_address_id, -CAST(amount AS DECIMAL(39,0)) FROM balance_event"
+    " WHERE block_id BETWEEN :first_block AND :last_block AND module_id = 'Balances'"
+    " AND event_id = 'ReserveRepatriated'"
+    " UNION ALL "
+    "SELECT t.address_id, CAST(t.amount AS DECIMAL(39,0)) FROM balance_event t"
+    " WHERE t.block_id BETWEEN :first_block AND :last_block AND t.module_id = 'Treasury' AND t.event_id = 'Deposit'"
+    " AND NOT EXISTS ("
+    "SELECT 1 FROM balance_event d WHERE d.block_id = t.block_id AND d.extrinsic_idx <=> t.extrinsic_idx"
+    " AND d.module_id = 'Balances' AND d.event_id = 'Deposit' AND d.address_id = t.address_id)"
+    " UNION ALL "
+    "SELECT e.from_address_id, -CAST(e.fee + COALESCE(e.tip, 0) AS DECIMAL(39,0)) FROM extrinsic e"
+    " WHERE e.block_id BETWEEN :first_block AND :last_block AND e.batch_idx = 0 AND e.signed = 1"
+    " AND e.fee IS NOT NULL AND e.from_address_id IS NOT NULL AND NOT EXISTS ("
+    "SELECT 1 FROM balance_event w WHERE w.block_id = e.block_id AND w.extrinsic_idx = e.extrinsic_idx"
+    " AND w.module_id = 'Balances' AND w.event_id = 'Withdraw')"
+)
+
+# checkpoint balances plus the changes since the checkpoint
+balance_as_of_sql = (
+    "SELECT address_id, SUM(balance) AS balance FROM ("
+    "SELECT address_id, balance FROM balance_checkpoint WHERE block_id = :checkpoint"
+    " UNION ALL "
+    "SELECT address_id, delta FROM ({delta}) d"
+    ") t WHERE address_id IS NOT NULL GROUP BY address_id HAVING SUM(balance) <> 0"
+).format(delta=balance_delta_sql)
+
+insert_checkpoint_sql = (
+    "INSERT INTO balance_checkpoint (block_id, address_id, balance) SELECT :last_block, address_id, balance"
+    " FROM ({as_of}) a"
+).format(as_of=balance_as_of_sql)
+
+# initial checkpoint from a balance snapshot queried from the node, e.g. the genesis balances at block 0
+seed_checkpoint_sql = (
+    "INSERT INTO balance_checkpoint (block_id, address_id, balance)"
+    " SELECT block_id, address_id, balance_total FROM account_info_snapshot"
+    " WHERE block_id = :block_id AND address_id IS NOT NULL AND balance_total > 0"
+)
+
+checkpoints_sql = "SELECT DISTINCT block_id FROM balance_checkpoint ORDER BY block_id"
+
+# events changing balance totals that the replay does not apply, see the module docstring
+UNREPLAYED_EVENTS = [('Balances', 'BalanceSet')]
+
+unreplayed_events_sql = (
+    "SELECT COUNT(*) FROM event WHERE block_id BETWEEN :first_block AND :last_block"
+    " AND module_id = :module_id AND event_id = :event_id"
+)
+
+snapshot_balances_sql = (
+    "SELECT address_id, balance_total FROM account_info_snapshot WHERE block_id = :block_id AND address_id IS NOT NULL"
+)
+
+
+def get_checkpoints(conn):
+    return [row.block_id for row in conn.execute(text(checkpoints_sql))]
+
+
+def get_checkpoint(conn, block_id):
+    # last checkpoint at or before block_id
+    checkpoints = [checkpoint for checkpoint in get_checkpoints(conn) if checkpoint <= block_id]
+    if not checkpoints:
+        raise ValueError("No balance checkpoint at or before block {}, seed one from a snapshot".format(block_id))
+    return checkpoints[-1]
+
+
+def seed_checkpoint(conn, block_id):
+    conn.execute(text("DELETE FROM balance_checkpoint WHERE block_id = :block_id"), {"block_id": block_id})
+    conn.execute(text(seed_checkpoint_sql), {"block_id": block_id})
+
+
+def build_checkpoints(engine, last_block):
+    """Write the missing checkpoints up to last_block, each replayed from the previous one.
+
+    Every checkpoint is written by a single INSERT ... SELECT in its own db transaction, so an interrupted run
+    is resumed from the last complete checkpoint.
+    """
+    with engine.connect() as conn:
+        checkpoints = get_checkpoints(conn)
+    if not checkpoints:
+        raise ValueError("No balance checkpoint, seed one from a snapshot")
+
+    checkpoint = checkpoints[-1]
+    next_checkpoint = (checkpoint // CHECKPOINT_BLOCKS + 1) * CHECKPOINT_BLOCKS
+    while next_checkpoint <= last_block:
+        start = timer()
+        with engine.begin() as conn:
+            conn.execute(text(insert_checkpoint_sql), {"checkpoint": checkpoint, "first_block": checkpoint + 1,
+                                                       "last_block": next_checkpoint})
+        logger.info("Balance checkpoint at block {} in {} seconds".format(next_checkpoint, timer() - start))
+        checkpoint = next_checkpoint
+        next_checkpoint += CHECKPOINT_BLOCKS
+
+
+def balances_as_of(conn, block_id):
+    # {address_id: balance} of the accounts with a non-zero balance after block_id
+    checkpoint = get_checkpoint(conn, block_id)
+    result = conn.execute(text(balance_as_of_sql), {"checkpoint": checkpoint, "first_block": checkpoint + 1,
+                                                    "last_block": block_id})
+    return {row.address_id: int(row.balance) for row in result}
+
+
+def unreplayed_events(conn, block_id):
+    # {(module_id, event_id): count} of the UNREPLAYED_EVENTS after the first checkpoint up to block_id
+    params = {"first_block": get_checkpoints(conn)[0] + 1, "last_block": block_id}
+    return {(module_id, event_id): conn.execute(text(unreplayed_events_sql),
+                                                dict(params, module_id=module_id, event_id=event_id)).scalar()
+            for module_id, event_id in UNREPLAYED_EVENTS}
+
+
+def compare_with_snapshot(conn, block_id):
+    # [(address_id, replayed balance, snapshot balance)] of the accounts whose replayed balance differs
+    balances = balances_as_of(conn, block_id)
+    snapshot = {row.address_id: int(row.balance_total or 0)
+                for row in conn.execute(text(snapshot_balances_sql), {"block_id": block_id})}
+    return [(address_id, balances.get(address_id, 0), snapshot.get(address_id, 0))
+            for address_id in set(balances) | set(snapshot)
+            if balances.get(address_id, 0) != snapshot.get(address_id, 0)]
+
+
+# Main
+if __name__ == '__main__':
+    # balance_engine.py seed <snapshot block>
+    # balance_engine.py checkpoint [last block]
+    # balance_engine.py asof <block> <csv file>
+    # balance_engine.py verify <snapshot block>
+    from app.settings import DB_CONNECTION
+
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stdout)],
+                        format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+                        datefmt='%Y-%m-%dT%H:%M:%S', )
+
+    try:
+        start = timer()
+        engine = create_engine(DB_CONNECTION, isolation_level="READ_UNCOMMITTED", pool_pre_ping=True)
+        command = sys.argv[1]
+
+        if command == 'seed':
+            with engine.begin() as conn:
+                seed_checkpoint(conn, int(sys.argv[2]))
+        elif command == 'checkpoint':
+            if len(sys.argv) > 2:
+                last_block = int(sys.argv[2])
+            else:
+                with engine.connect() as conn:
+                    last_block = conn.execute(text("SELECT MAX(id) FROM block")).scalar() or 0
+            build_checkpoints(engine, last_block)
+        elif command == 'asof':
+            with engine.connect() as conn:
+                balances = balances_as_of(conn, int(sys.argv[2]))
+                addresses = {row.id: row.address for row in conn.execute(text("SELECT id, address FROM address"))}
+            with open(sys.argv[3], 'w', newline='') as outfile:
+                outcsv = csv.writer(outfile)
+                outcsv.writerow(["address_id", "address", "balance"])
+                for address_id, balance in sorted(balances.items(), key=lambda item: -item[1]):
+                    outcsv.writerow([address_id, addresses.get(address_id), balance])
+            logger.info("Saved {} balances".format(len(balances)))
+        elif command == 'verify':
+            with engine.connect() as conn:
+                mismatches = compare_with_snapshot(conn, int(sys.argv[2]))
+                unreplayed = unreplayed_events(conn, int(sys.argv[2]))
+            for (module_id, event_id), count in unreplayed.items():
+                logger.info("{}.{} events not replayed: {}".format(module_id, event_id, count))
+            logger.info("{} accounts differ from the snapshot, total difference {} planck".format(
+                len(mismatches), sum(abs(replayed - snapshot) for address_id, replayed, snapshot in mismatches)))
+            for address_id, replayed, snapshot in sorted(mismatches, key=lambda item: -abs(item[1] - item[2]))[:20]:
+                logger.info("address_id {}: replayed {}, snapshot {}".format(address_id, replayed, snapshot))
+
+        logger.info("Balance Engine Total Execution Time (seconds): {}".format(timer() - start))
+
+    except Exception as err:
+        logger.error(traceback.format_exc())
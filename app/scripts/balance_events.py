@@ -0,0 +1,170 @@
+"""
+balance_events.py
+
+Typed projection of the Balances, Treasury and System account events (transfer_event and balance_event tables).
+
+GNU General Public License Version 3
+"""
+
+import logging
+import sys
+import traceback
+from timeit import default_timer as timer
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import bindparam, text
+from sqlalchemy.types import Integer, JSON, String
+
+from app.scripts.address_dictionary import AddressDictionary
+from app.scripts.address_normalizer import address_normalizer
+
+logger = logging.getLogger(__name__)
+
+# (module_id, event_id) of the single account events of balance_event: position of the account and amount fields
+BALANCE_EVENTS = {
+    ('Balances', 'Withdraw'): (0, 1),
+    ('Balances', 'Deposit'): (0, 1),
+    ('Balances', 'Endowed'): (0, 1),
+    ('Balances', 'DustLost'): (0, 1),
+    ('Balances', 'Slashed'): (0, 1),
+    ('System', 'NewAccount'): (0, None),
+    ('System', 'KilledAccount'): (0, None),
+}
+
+# Balances.ReserveRepatriated(from, to, amount, status): the account and amount fields and the debited account field
+REPATRIATED_EVENT = ('Balances', 'ReserveRepatriated')
+REPATRIATED_FIELDS = (1, 2, 0)
+
+# account of the treasury pallet (PalletId py/trsry), credited by Treasury.Deposit(value) with part of the fees
+TREASURY_ADDRESS = address_normalizer.normalize((b'modl' + b'py/trsry').ljust(32, b'\0'))
+TREASURY_DEPOSIT_EVENT = ('Treasury', 'Deposit')
+
+TRANSFER_EVENT = ('Balances', 'Transfer')
+
+TYPED_EVENTS = {TRANSFER_EVENT, REPATRIATED_EVENT, TREASURY_DEPOSIT_EVENT} | set(BALANCE_EVENTS)
+
+# events read per statement by the backfill
+BACKFILL_CHUNK_SIZE = 10000
+
+backfill_events_sql = (
+    "SELECT block_id, event_idx, extrinsic_idx, module_id, event_id, attributes FROM event"
+    " WHERE block_id BETWEEN :first_block AND :last_block AND module_id IN ('Balances', 'Treasury', 'System')"
+    " AND event_id IN :event_ids"
+)
+
+insert_transfer_sql = (
+    "INSERT IGNORE INTO transfer_event (block_id, event_idx, extrinsic_idx, from_address_id, to_address_id, amount)"
+    " VALUES (:block_id, :event_idx, :extrinsic_idx, :from_address_id, :to_address_id, :amount)"
+)
+
+insert_balance_event_sql = (
+    "INSERT IGNORE INTO balance_event"
+    " (block_id, event_idx, extrinsic_idx, module_id, event_id, address_id, from_address_id, amount)"
+    " VALUES (:block_id, :event_idx, :extrinsic_idx, :module_id, :event_id, :address_id, :from_address_id, :amount)"
+)
+
+
+def get_event_values(attributes):
+    """Return the attribute values of an event as a list, in field order.
+
+    Events decoded before block 7229130 have attributes as a list of {'type': ..., 'value': ...} dicts. Later
+    events have the plain values: a single value for one field events, a list (or a dict of named fields)
+    otherwise.
+    """
+    if attributes is None:
+        return []
+    if isinstance(attributes, dict):
+        return list(attributes.values())
+    if not isinstance(attributes, (list, tuple)):
+        return [attributes]
+    return [attr['value'] if isinstance(attr, dict) and 'type' in attr and 'value' in attr else attr
+            for attr in attributes]
+
+
+def typed_event_rows(events):
+    # (transfer rows, balance event rows) of decoded event rows, with planck amounts and addresses to map to ids
+    transfers = []
+    balance_events = []
+    for event in events:
+        event_type = (event['module_id'], event['event_id'])
+        if event_type not in TYPED_EVENTS:
+            continue
+
+        values = get_event_values(event['attributes'])
+        row = dict(block_id=event['block_id'], event_idx=event['event_idx'], extrinsic_idx=event['extrinsic_idx'])
+        try:
+            if event_type == TRANSFER_EVENT:
+                transfers.append(dict(row, from_address=values[0], to_address=values[1], amount=int(values[2])))
+                continue
+
+            row.update(module_id=event['module_id'], event_id=event['event_id'], from_address=None)
+            if event_type == TREASURY_DEPOSIT_EVENT:
+                balance_events.append(dict(row, address=TREASURY_ADDRESS, amount=int(values[0])))
+            elif event_type == REPATRIATED_EVENT:
+                address_idx, amount_idx, from_idx = REPATRIATED_FIELDS
+                balance_events.append(dict(row, address=values[address_idx], from_address=values[from_idx],
+                                           amount=int(values[amount_idx])))
+            else:
+                address_idx, amount_idx = BALANCE_EVENTS[event_type]
+                balance_events.append(dict(row, address=values[address_idx],
+                                           amount=int(values[amount_idx]) if amount_idx is not None else None))
+        except (IndexError, TypeError, ValueError):
+            logger.error("Unexpected attributes of event {}-{}: {}".format(event['block_id'], event['event_idx'],
+                                                                         event['attributes']))
+    return transfers, balance_events
+
+
+def write_typed_events(session, address_dictionary, transfers, balance_events):
+    # insert typed rows built by typed_event_rows, in the db transaction of the session
+    if transfers:
+        address_dictionary.set_ids(session, transfers)
+        session.execute(text(insert_transfer_sql), transfers)
+
+    if balance_events:
+        address_dictionary.set_ids(session, balance_events, address_columns=('address', 'from_address'))
+        session.execute(text(insert_balance_event_sql), balance_events)
+
+
+# Main
+if __name__ == '__main__':
+    # backfill the typed tables from the event table: balance_events.py <first block> <last block>
+    from app.settings import DB_CONNECTION
+
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stdout)],
+                        format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+                        datefmt='%Y-%m-%dT%H:%M:%S', )
+
+    try:
+        start = timer()
+        engine = create_engine(DB_CONNECTION, isolation_level="READ_UNCOMMITTED", pool_pre_ping=True)
+        session = sessionmaker(bind=engine, autoflush=False, autocommit=False)()
+        address_dictionary = AddressDictionary()
+
+        first_block = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+        last_block = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+        if last_block is None:
+            last_block = session.execute(text("SELECT MAX(block_id) FROM event")).scalar() or 0
+
+        query = text(backfill_events_sql).bindparams(bindparam('event_ids', expanding=True)).columns(
+            block_id=Integer, event_idx=Integer, extrinsic_idx=Integer, module_id=String, event_id=String,
+            attributes=JSON)
+        event_ids = list({event_id for module_id, event_id in TYPED_EVENTS})
+
+        # one transaction per range of blocks to keep transactions small
+        step = 10000
+        for block_id in range(first_block, last_block + 1, step):
+            params = {"first_block": block_id, "last_block": min(block_id + step - 1, last_block),
+                      "event_ids": event_ids}
+            events = [dict(row._mapping) for row in session.execute(query, params)]
+            for chunk in range(0, len(events), BACKFILL_CHUNK_SIZE):
+                write_typed_events(session, address_dictionary,
+                                   *typed_event_rows(events[chunk:chunk + BACKFILL_CHUNK_SIZE]))
+            session.commit()
+            logger.info("Backfilled typed events until block {}".format(params["last_block"]))
+
+        logger.info("Balance Events Total Execution Time (seconds): {}".format(timer() - start))
+
+    except Exception as err:
+        logger.error(traceback.format_exc())
@@ -0,0 +1,283 @@
+"""
+block_archive.py
+
+Local archive of raw SCALE-encoded blocks, to re-decode blocks without querying the substrate node.
+
+GNU General Public License Version 3
+"""
+
+import json
+import os
+import zlib
+from bisect import bisect_right, insort
+
+from scalecodec.base import RuntimeConfigurationObject, ScaleBytes
+from scalecodec.type_registry import load_type_registry_preset
+from substrateinterface.utils.ss58 import ss58_decode, ss58_encode, is_valid_ss58_address
+
+# number of consecutive blocks stored in one partition file
+ARCHIVE_PARTITION_BLOCKS = 100000
+
+
+def fetch_raw_block(substrate, block_number):
+    # header, extrinsics, events and validator set of a block as returned by the node, nothing is decoded
+    block_hash = substrate.get_block_hash(block_number)
+    block_data = substrate.rpc_request('chain_getBlock', [block_hash])['result']['block']
+
+    # extrinsics and events are decoded with the runtime of the parent block
+    runtime_version = substrate.get_block_runtime_version(block_data['header']['parentHash'])
+
+    return {
+        'number': block_number,
+        'hash': block_hash,
+        'header': block_data['header'],
+        'extrinsics': block_data['extrinsics'],
+        'events': substrate.get_storage_by_key(block_hash, substrate.generate_storage_hash('System', 'Events')),
+        'validators': substrate.get_storage_by_key(block_hash,
+                                                   substrate.generate_storage_hash('Session', 'Validators')),
+        'spec_version': runtime_version.get('specVersion'),
+    }
+
+
+def archive_block(substrate, archive, block_number):
+    raw_block = fetch_raw_block(substrate, block_number)
+
+    # metadata is stored once per runtime version
+    if not archive.has_metadata(raw_block['spec_version']):
+        metadata = substrate.get_block_metadata(block_hash=raw_block['header']['parentHash'], decode=False)
+        archive.write_metadata(raw_block['spec_version'], metadata['result'])
+
+    archive.write_block(raw_block)
+    return raw_block
+
+
+class BlockArchive:
+    """Raw blocks stored in zlib-compressed records, partitioned by block range.
+
+    Each partition of ARCHIVE_PARTITION_BLOCKS blocks has an append-only data file with one compressed JSON
+    record per block, and an append-only index file with one `[block, offset, length, validators]` line per
+    block. The validator set is only stored in the index when it differs from the previous block, so blocks of a
+    partition have to be written in ascending order.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.indexes = {}
+        os.makedirs(path, exist_ok=True)
+
+    def partition_path(self, partition, extension):
+        return os.path.join(self.path, 'blocks_{:05d}.{}'.format(partition, extension))
+
+    def metadata_path(self, spec_version):
+        return os.path.join(self.path, 'metadata_{}.dat'.format(spec_version))
+
+    def load_index(self, partition):
+        if partition not in self.indexes:
+            index = {'blocks': {}, 'validator_blocks': [], 'validators': {}}
+            index_path = self.partition_path(partition, 'idx')
+            if os.path.exists(index_path):
+                with open(index_path) as index_file:
+                    for line in index_file:
+                        block_number, offset, length, validators = json.loads(line)
+                        index['blocks'][block_number] = (offset, length)
+                        if validators is not None:
+                            insort(index['validator_blocks'], block_number)
+                            index['validators'][block_number] = validators
+            self.indexes[partition] = index
+        return self.indexes[partition]
+
+    def get_validators(self, index, block_number):
+        idx = bisect_right(index['validator_blocks'], block_number)
+        if idx == 0:
+            return None
+        return index['validators'][index['validator_blocks'][idx - 1]]
+
+    def has_block(self, block_number):
+        return block_number in self.load_index(block_number // ARCHIVE_PARTITION_BLOCKS)['blocks']
+
+    def write_block(self, raw_block):
+        raw_block = dict(raw_block)
+        block_number = raw_block['number']
+        partition = block_number // ARCHIVE_PARTITION_BLOCKS
+        index = self.load_index(partition)
+
+        validators = raw_block.pop('validators')
+        if validators == self.get_validators(index, block_number):
+            validators = None
+        else:
+            insort(index['validator_blocks'], block_number)
+            index['validators'][block_number] = validators
+
+        record = zlib.compress(json.dumps(raw_block).encode())
+        with open(self.partition_path(partition, 'dat'), 'ab') as data_file:
+            offset = data_file.tell()
+            data_file.write(record)
+
+        with open(self.partition_path(partition, 'idx'), 'a') as index_file:
+            index_file.write(json.dumps([block_number, offset, len(record), validators]) + '\n')
+        index['blocks'][block_number] = (offset, len(record))
+
+    def read_block(self, block_number):
+        partition = block_number // ARCHIVE_PARTITION_BLOCKS
+        index = self.load_index(partition)
+        offset, length = index['blocks'][block_number]
+
+        with open(self.partition_path(partition, 'dat'), 'rb') as data_file:
+            data_file.seek(offset)
+            raw_block = json.loads(zlib.decompress(data_file.read(length)))
+
+        raw_block['validators'] = self.get_validators(index, block_number)
+        return raw_block
+
+    def has_metadata(self, spec_version):
+        return os.path.exists(self.metadata_path(spec_version))
+
+    def write_metadata(self, spec_version, metadata):
+        with open(self.metadata_path(spec_version), 'wb') as metadata_file:
+            metadata_file.write(zlib.compress(metadata.encode()))
+
+    def read_metadata(self, spec_version):
+        with open(self.metadata_path(spec_version), 'rb') as metadata_file:
+            return zlib.decompress(metadata_file.read()).decode()
+
+
+class MemoryArchive:
+    """In-memory replacement of BlockArchive, holding the raw blocks handed to a decode worker."""
+
+    def __init__(self):
+        self.blocks = {}
+        self.metadata = {}
+
+    def add_blocks(self, raw_blocks, metadata):
+        self.blocks.update((raw_block['number'], raw_block) for raw_block in raw_blocks)
+        self.metadata.update(metadata)
+
+    def read_block(self, block_number):
+        return self.blocks.pop(block_number)
+
+    def read_metadata(self, spec_version):
+        return self.metadata[spec_version]
+
+
+class ArchiveSubstrate:
+    """Stand-in for SubstrateInterface decoding blocks from a BlockArchive.
+
+    Implements the part of the SubstrateInterface API used by main.process_block, so archived blocks can be
+    re-decoded at disk speed without a connection to the substrate node.
+    """
+
+    def __init__(self, archive, ss58_format=0, type_registry_preset='polkadot', token_decimals=10,
+                 token_symbol='DOT'):
+        self.archive = archive
+        self.ss58_format = ss58_format
+        self.type_registry_preset = type_registry_preset
+        self.token_decimals = token_decimals
+        self.token_symbol = token_symbol
+
+        self.runtimes = {}
+        self.runtime_version = None
+        self.runtime_config = None
+        self.metadata_decoder = None
+        self.raw_block = None
+
+    def close(self):
+        pass
+
+    def init_runtime(self, spec_version):
+        if spec_version == self.runtime_version:
+            return
+
+        # same type registry setup as SubstrateInterface.init_runtime, with the metadata read from the archive
+        if spec_version not in self.runtimes:
+            runtime_config = RuntimeConfigurationObject(ss58_format=self.ss58_format)
+            runtime_config.update_type_registry(load_type_registry_preset('metadata_types'))
+
+            metadata = runtime_config.create_scale_object(
+                'MetadataVersioned', data=ScaleBytes(self.archive.read_metadata(spec_version))
+            )
+            metadata.decode()
+
+            runtime_config.implements_scale_info = metadata.portable_registry is not None
+            if not runtime_config.implements_scale_info:
+                runtime_config.update_type_registry(load_type_registry_preset('default'))
+            runtime_config.update_type_registry(load_type_registry_preset(self.type_registry_preset))
+            if runtime_config.implements_scale_info:
+                runtime_config.add_portable_registry(metadata)
+            runtime_config.set_active_spec_version_id(spec_version)
+
+            self.runtimes[spec_version] = (runtime_config, metadata)
+
+        self.runtime_config, self.metadata_decoder = self.runtimes[spec_version]
+        self.runtime_version = spec_version
+
+    def implements_scaleinfo(self):
+        if self.metadata_decoder:
+            return self.metadata_decoder.portable_registry is not None
+
+    def decode_storage(self, module, storage_function, data):
+        storage_item = self.metadata_decoder.get_metadata_pallet(module).get_storage_function(storage_function)
+        obj = self.runtime_config.create_scale_object(
+            type_string=storage_item.get_value_type_string(),
+            data=ScaleBytes(data),
+            metadata=self.metadata_decoder
+        )
+        obj.decode()
+        return obj
+
+    def get_block(self, block_number, include_author=False):
+        self.raw_block = self.archive.read_block(block_number)
+        self.init_runtime(self.raw_block['spec_version'])
+
+        header = dict(self.raw_block['header'])
+        header['hash'] = self.raw_block['hash']
+        header['number'] = int(header['number'], 16)
+        block_data = {'header': header, 'extrinsics': []}
+
+        extrinsic_cls = self.runtime_config.get_decoder_class('Extrinsic')
+        for extrinsic_data in self.raw_block['extrinsics']:
+            extrinsic = extrinsic_cls(data=ScaleBytes(extrinsic_data), metadata=self.metadata_decoder,
+                                      runtime_config=self.runtime_config)
+            extrinsic.decode()
+            block_data['extrinsics'].append(extrinsic)
+
+        log_digest_cls = self.runtime_config.get_decoder_class('sp_runtime::generic::digest::DigestItem')
+        logs = []
+        for log_data in header['digest']['logs']:
+            log_digest = log_digest_cls(data=ScaleBytes(log_data))
+            log_digest.decode()
+            logs.append(log_digest)
+
+            if include_author and 'PreRuntime' in log_digest.value:
+                if self.implements_scaleinfo():
+                    babe_predigest = self.runtime_config.create_scale_object(
+                        type_string='RawBabePreDigest',
+                        data=ScaleBytes(log_digest.value['PreRuntime'][1])
+                    )
+                    babe_predigest.decode()
+                    rank_validator = babe_predigest[1].value['authority_index']
+                else:
+                    rank_validator = log_digest.value['PreRuntime']['data']['authority_index']
+
+                validator_set = self.decode_storage('Session', 'Validators', self.raw_block['validators'])
+                block_data['author'] = validator_set.elements[rank_validator].value
+
+        header['digest'] = dict(header['digest'], logs=logs)
+        return block_data
+
+    def get_events(self, block_hash):
+        if self.raw_block is None or self.raw_block['hash'] != block_hash or not self.raw_block['events']:
+            return []
+        return self.decode_storage('System', 'Events', self.raw_block['events']).elements
+
+    def get_block_runtime_version(self, block_hash):
+        # only called for the parent of the current block, whose runtime is the decoding runtime
+        return {'specVersion': self.runtime_version}
+
+    def ss58_encode(self, public_key):
+        return ss58_encode(public_key, ss58_format=self.ss58_format)
+
+    def ss58_decode(self, ss58_address):
+        return ss58_decode(ss58_address, valid_ss58_format=self.ss58_format)
+
+    def is_valid_ss58_address(self, value):
+        return is_valid_ss58_address(value, valid_ss58_format=self.ss58_format)
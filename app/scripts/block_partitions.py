@@ -0,0 +1,135 @@
+"""
+block_partitions.py
+
+Range partitioning of the extrinsic and event tables by block_id.
+
+GNU General Public License Version 3
+"""
+
+import logging
+import sys
+import traceback
+from timeit import default_timer as timer
+
+from sqlalchemy import create_engine
+from sqlalchemy.sql import text
+
+logger = logging.getLogger(__name__)
+
+# number of blocks per partition, partition pNNNN holds the blocks [NNNN * PARTITION_BLOCKS, (NNNN + 1) * ...)
+PARTITION_BLOCKS = 1000000
+
+# partitions created ahead of the last ingested block
+PARTITION_HEADROOM = 1
+
+PARTITIONED_TABLES = ['extrinsic', 'event']
+
+# catch-all partition, new partitions are split off it
+MAX_PARTITION = 'pmax'
+
+partitions_sql = (
+    "SELECT partition_name, partition_description FROM information_schema.partitions"
+    " WHERE table_schema = DATABASE() AND table_name = :table_name AND partition_name IS NOT NULL"
+    " ORDER BY partition_ordinal_position"
+)
+
+
+def partition_name(partition_idx):
+    return 'p{:04d}'.format(partition_idx)
+
+
+def partition_definition(partition_idx):
+    return "PARTITION {} VALUES LESS THAN ({})".format(partition_name(partition_idx),
+                                                       (partition_idx + 1) * PARTITION_BLOCKS)
+
+
+def max_partition_definition():
+    return "PARTITION {} VALUES LESS THAN MAXVALUE".format(MAX_PARTITION)
+
+
+def get_partitions(conn, table_name):
+    # [partition_name] of a table in block order, empty if the table is not partitioned
+    return [row.partition_name for row in conn.execute(text(partitions_sql), {"table_name": table_name})]
+
+
+def partition_table(conn, table_name, last_block):
+    # one-time conversion of an existing table, rebuilds the whole table
+    definitions = [partition_definition(idx) for idx in range(last_block // PARTITION_BLOCKS + PARTITION_HEADROOM + 1)]
+    conn.execute(text("ALTER TABLE `{}` PARTITION BY RANGE (`block_id`) ({})".format(
+        table_name, ", ".join(definitions + [max_partition_definition()]))))
+
+
+def ensure_partitions(engine, last_block):
+    """Split new partitions off the catch-all partition up to PARTITION_HEADROOM partitions above last_block.
+
+    Called before ingesting a block range, so rows are written to their own partition and the catch-all partition
+    stays empty, which makes REORGANIZE PARTITION a metadata-only change. Tables that are not partitioned are
+    left unchanged, see partition_table.
+    """
+    last_idx = last_block // PARTITION_BLOCKS + PARTITION_HEADROOM
+    with engine.connect() as conn:
+        for table_name in PARTITIONED_TABLES:
+            partitions = get_partitions(conn, table_name)
+            if not partitions:
+                logger.warning("Table {} is not partitioned".format(table_name))
+                continue
+
+            existing = {int(name[1:]) for name in partitions if name != MAX_PARTITION}
+            first_idx = max(existing) + 1 if existing else 0
+            if first_idx <= last_idx:
+                definitions = [partition_definition(idx) for idx in range(first_idx, last_idx + 1)]
+                conn.execute(text("ALTER TABLE `{}` REORGANIZE PARTITION {} INTO ({})".format(
+                    table_name, MAX_PARTITION, ", ".join(definitions + [max_partition_definition()]))))
+                logger.info("Added partitions {} to {} of table {}".format(
+                    partition_name(first_idx), partition_name(last_idx), table_name))
+
+
+def compact_partition(conn, table_name, partition_idx):
+    # rebuild a partition that is not written anymore, reclaiming the space of page splits of the ingest
+    conn.execute(text("ALTER TABLE `{}` REBUILD PARTITION {}".format(table_name, partition_name(partition_idx))))
+
+
+def archive_partition(conn, table_name, partition_idx):
+    # move the rows of a partition to the standalone table <table>_pNNNN, which can then be dumped and dropped
+    archive_table = '{}_{}'.format(table_name, partition_name(partition_idx))
+    conn.execute(text("CREATE TABLE `{}` LIKE `{}`".format(archive_table, table_name)))
+    conn.execute(text("ALTER TABLE `{}` REMOVE PARTITIONING".format(archive_table)))
+    conn.execute(text("ALTER TABLE `{}` EXCHANGE PARTITION {} WITH TABLE `{}`".format(
+        table_name, partition_name(partition_idx), archive_table)))
+    return archive_table
+
+
+# Main
+if __name__ == '__main__':
+    # block_partitions.py partition|ensure <last block>
+    # block_partitions.py compact|archive <table> <partition index>
+    from app.settings import DB_CONNECTION
+
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stdout)],
+                        format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+                        datefmt='%Y-%m-%dT%H:%M:%S', )
+
+    try:
+        start = timer()
+        engine = create_engine(DB_CONNECTION, isolation_level="READ_UNCOMMITTED", pool_pre_ping=True)
+        command = sys.argv[1]
+
+        if command == 'partition':
+            with engine.connect() as conn:
+                for table_name in PARTITIONED_TABLES:
+                    if not get_partitions(conn, table_name):
+                        partition_table(conn, table_name, int(sys.argv[2]))
+                        logger.info("Partitioned table {}".format(table_name))
+        elif command == 'ensure':
+            ensure_partitions(engine, int(sys.argv[2]))
+        elif command == 'compact':
+            with engine.connect() as conn:
+                compact_partition(conn, sys.argv[2], int(sys.argv[3]))
+        elif command == 'archive':
+            with engine.connect() as conn:
+                logger.info("Archived to table {}".format(archive_partition(conn, sys.argv[2], int(sys.argv[3]))))
+
+        logger.info("Block Partitions Total Execution Time (seconds): {}".format(timer() - start))
+
+    except Exception as err:
+        logger.error(traceback.format_exc())
@@ -0,0 +1,228 @@
+"""
+block_production.py
+
+Block production per validator and session from the author and slot_number columns of the block table: blocks
+produced, production share and missed (empty) slots, rolled up incrementally in the block_production and
+session_production tables.
+
+GNU General Public License Version 3
+"""
+
+import csv
+import logging
+import sys
+import traceback
+from timeit import default_timer as timer
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.sql import text
+
+logger = logging.getLogger(__name__)
+
+# blocks streamed per query
+BLOCK_CHUNK_SIZE = 200000
+
+blocks_sql = (
+    "SELECT id, author, slot_number FROM block WHERE id >= :first_block AND slot_number IS NOT NULL"
+    " ORDER BY id LIMIT :limit"
+)
+
+# slot of the last block before a block, the gap to it counts as missed slots of the resumed session
+previous_slot_sql = (
+    "SELECT slot_number FROM block WHERE id < :first_block AND slot_number IS NOT NULL ORDER BY id DESC LIMIT 1"
+)
+
+sessions_sql = "SELECT id, start_at_block FROM session WHERE start_at_block IS NOT NULL ORDER BY start_at_block"
+
+insert_block_production_sql = (
+    "INSERT INTO block_production (session_id, author, blocks, first_block, last_block)"
+    " VALUES (:session_id, :author, :blocks, :first_block, :last_block)"
+    " ON DUPLICATE KEY UPDATE blocks = VALUES(blocks), first_block = VALUES(first_block),"
+    " last_block = VALUES(last_block)"
+)
+
+insert_session_production_sql = (
+    "INSERT INTO session_production (session_id, first_block, last_block, first_slot, last_slot, blocks, authors,"
+    " missed_slots, max_slot_gap)"
+    " VALUES (:session_id, :first_block, :last_block, :first_slot, :last_slot, :blocks, :authors, :missed_slots,"
+    " :max_slot_gap)"
+    " ON DUPLICATE KEY UPDATE first_block = VALUES(first_block), last_block = VALUES(last_block),"
+    " first_slot = VALUES(first_slot), last_slot = VALUES(last_slot), blocks = VALUES(blocks),"
+    " authors = VALUES(authors), missed_slots = VALUES(missed_slots), max_slot_gap = VALUES(max_slot_gap)"
+)
+
+# per-validator production over a range of sessions, with the share of the blocks of the sessions it produced in
+production_report_sql = (
+    "SELECT p.author, COUNT(*) AS sessions, SUM(p.blocks) AS blocks, SUM(s.blocks) AS session_blocks,"
+    " SUM(p.blocks) / SUM(s.blocks) AS production_share, MIN(p.first_block) AS first_block,"
+    " MAX(p.last_block) AS last_block"
+    " FROM block_production p JOIN session_production s ON s.session_id = p.session_id"
+    " WHERE p.session_id BETWEEN :first_session AND :last_session"
+    " GROUP BY p.author ORDER BY blocks DESC"
+)
+
+
+def get_sessions(conn):
+    # (session ids, first block of each session) sorted by block
+    rows = conn.execute(text(sessions_sql)).fetchall()
+    return (np.array([row.id for row in rows], dtype=np.int64),
+            np.array([row.start_at_block for row in rows], dtype=np.int64))
+
+
+def get_resume_block(conn):
+    # first block of the last rolled up session, recomputed since it may have been incomplete
+    return conn.execute(text(
+        "SELECT MIN(first_block) FROM session_production"
+        " WHERE session_id = (SELECT MAX(session_id) FROM session_production)")).scalar() or 0
+
+
+def session_rollups(session_ids, block_ids, authors, slots, previous_slot=None):
+    """Return ([block_production rows], [session_production rows]) of a chunk of blocks sorted by id.
+
+    Slot gaps are the diff of the sorted slot numbers, every slot between two consecutive blocks is a missed
+    slot of the session of the later block. previous_slot is the slot of the block before the chunk.
+    """
+    gaps = np.diff(np.r_[slots[0] - 1 if previous_slot is None else previous_slot, slots]) - 1
+    gaps = np.maximum(gaps, 0)
+    starts = np.flatnonzero(np.r_[True, session_ids[1:] != session_ids[:-1]])
+    ends = np.r_[starts[1:], len(session_ids)] - 1
+
+    author_names, author_codes = np.unique(authors, return_inverse=True)
+    # (session, author) pairs of the blocks, blocks sorted by id keep each session contiguous
+    pair_keys = session_ids * len(author_names) + author_codes
+    pair_order = np.argsort(pair_keys, kind='stable')
+    sorted_keys = pair_keys[pair_order]
+    pair_starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    pair_counts = np.diff(np.r_[pair_starts, len(sorted_keys)])
+    pair_blocks = block_ids[pair_order]
+    pair_ends = pair_starts + pair_counts - 1
+
+    producers = [dict(session_id=int(key // len(author_names)), author=str(author_names[key % len(author_names)]),
+                      blocks=int(count), first_block=int(first), last_block=int(last))
+                 for key, count, first, last in zip(sorted_keys[pair_starts], pair_counts, pair_blocks[pair_starts],
+                                                    pair_blocks[pair_ends])]
+
+    session_authors = np.bincount(np.searchsorted(session_ids[starts], sorted_keys[pair_starts] // len(author_names)),
+                                  minlength=len(starts))
+    sessions = [dict(session_id=int(session_ids[start]), first_block=int(block_ids[start]),
+                     last_block=int(block_ids[end]), first_slot=int(slots[start]), last_slot=int(slots[end]),
+                     blocks=int(end - start + 1), authors=int(count), missed_slots=int(missed),
+                     max_slot_gap=int(max_gap))
+                for start, end, count, missed, max_gap in zip(starts, ends, session_authors,
+                                                              np.add.reduceat(gaps, starts),
+                                                              np.maximum.reduceat(gaps, starts))]
+    return producers, sessions
+
+
+def merge_rollups(pending, producers, sessions):
+    # add the rows of a chunk to the rows of the sessions continued from the previous chunk
+    pending_producers, pending_sessions = pending
+    for row in producers:
+        key = (row['session_id'], row['author'])
+        if key in pending_producers:
+            merged = pending_producers[key]
+            merged.update(blocks=merged['blocks'] + row['blocks'], last_block=row['last_block'])
+        else:
+            pending_producers[key] = row
+    for row in sessions:
+        merged = pending_sessions.get(row['session_id'])
+        if merged is None:
+            pending_sessions[row['session_id']] = row
+            continue
+        merged.update(last_block=row['last_block'], last_slot=row['last_slot'], blocks=merged['blocks'] + row['blocks'],
+                      missed_slots=merged['missed_slots'] + row['missed_slots'],
+                      max_slot_gap=max(merged['max_slot_gap'], row['max_slot_gap']),
+                      authors=len([key for key in pending_producers if key[0] == row['session_id']]))
+
+
+def write_rollups(conn, pending, session_ids):
+    # write and drop the rows of the given (complete) sessions
+    pending_producers, pending_sessions = pending
+    producers = [pending_producers.pop(key) for key in list(pending_producers) if key[0] in session_ids]
+    sessions = [pending_sessions.pop(session_id) for session_id in session_ids]
+    if producers:
+        conn.execute(text(insert_block_production_sql), producers)
+    if sessions:
+        conn.execute(text(insert_session_production_sql), sessions)
+
+
+def update_production(engine, first_block=None):
+    """Roll up the blocks from first_block, by default from the last rolled up session, in chunks of blocks.
+
+    The sessions completed by a chunk are written in its db transaction, so an interrupted run is resumed from the
+    first block of the last written session.
+    """
+    with engine.connect() as conn:
+        session_ids, session_starts = get_sessions(conn)
+        if first_block is None:
+            first_block = get_resume_block(conn)
+        previous_slot = conn.execute(text(previous_slot_sql), {"first_block": first_block}).scalar()
+    if not len(session_ids):
+        raise ValueError("No sessions, run session_handler.py first")
+
+    pending = ({}, {})
+    previous_slot = None if previous_slot is None else int(previous_slot)
+    while True:
+        start = timer()
+        with engine.begin() as conn:
+            rows = conn.execute(text(blocks_sql), {"first_block": first_block, "limit": BLOCK_CHUNK_SIZE}).fetchall()
+            if not rows:
+                # the last session is written as well, and recomputed by the next run
+                write_rollups(conn, pending, list(pending[1]))
+                break
+            block_ids = np.array([row.id for row in rows], dtype=np.int64)
+            slots = np.array([int(row.slot_number) for row in rows], dtype=np.int64)
+            authors = np.array([row.author or '' for row in rows])
+            block_sessions = np.searchsorted(session_starts, block_ids, side='right') - 1
+            # blocks before the first crawled session are skipped
+            known = block_sessions >= 0
+            if known.any():
+                producers, sessions = session_rollups(session_ids[block_sessions[known]], block_ids[known],
+                                                      authors[known], slots[known],
+                                                      previous_slot if known[0] else None)
+                merge_rollups(pending, producers, sessions)
+                # every session but the last one of the chunk is complete
+                write_rollups(conn, pending, [session_id for session_id in pending[1]
+                                              if session_id != sessions[-1]['session_id']])
+            previous_slot = int(slots[-1])
+            first_block = int(block_ids[-1]) + 1
+        logger.info("Block production until block {} in {} seconds".format(first_block - 1, timer() - start))
+
+
+def production_report(conn, first_session, last_session):
+    return conn.execute(text(production_report_sql), {"first_session": first_session,
+                                                      "last_session": last_session}).fetchall()
+
+
+# Main
+if __name__ == '__main__':
+    # block_production.py [first block]: roll up the new blocks
+    # block_production.py report <csv file> [first session] [last session]
+    from app.settings import DB_CONNECTION
+
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stdout)],
+                        format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+                        datefmt='%Y-%m-%dT%H:%M:%S', )
+
+    try:
+        start = timer()
+        engine = create_engine(DB_CONNECTION, isolation_level="READ_UNCOMMITTED", pool_pre_ping=True)
+
+        if len(sys.argv) > 1 and sys.argv[1] == 'report':
+            with engine.connect() as conn:
+                rows = production_report(conn, int(sys.argv[3]) if len(sys.argv) > 3 else 0,
+                                         int(sys.argv[4]) if len(sys.argv) > 4 else sys.maxsize)
+            with open(sys.argv[2], 'w', newline='') as outfile:
+                outcsv = csv.writer(outfile)
+                outcsv.writerow(["author", "sessions", "blocks", "session_blocks", "production_share", "first_block",
+                                 "last_block"])
+                outcsv.writerows(rows)
+            logger.info("Saved the production of {} validators".format(len(rows)))
+        else:
+            update_production(engine, int(sys.argv[1]) if len(sys.argv) > 1 else None)
+
+        logger.info("Block Production Total Execution Time (seconds): {}".format(timer() - start))
+
+    except Exception as err:
+        logger.error(traceback.format_exc())
@@ -0,0 +1,55 @@
+"""
+csr_graph.py
+
+Compressed sparse row (CSR) adjacency of the transaction graphs, for the array based graph algorithms
+(triangles.py, distances.py).
+
+GNU General Public License Version 3
+"""
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+
+def graph_csr(graph):
+    """Return (nodes, adjacency) of a networkx (Multi)DiGraph.
+
+    adjacency[i, j] is the number of edges from nodes[i] to nodes[j], parallel edges are summed.
+    """
+    nodes = np.array(list(graph.nodes()))
+    index = {node: idx for idx, node in enumerate(nodes.tolist())}
+    sources = np.fromiter((index[source] for source, target in graph.edges()), dtype=np.int64,
+                          count=graph.number_of_edges())
+    targets = np.fromiter((index[target] for source, target in graph.edges()), dtype=np.int64,
+                          count=graph.number_of_edges())
+    return nodes, edges_csr(sources, targets, len(nodes))
+
+
+def edges_csr(sources, targets, node_count):
+    # adjacency of (source, target) node index arrays, duplicate edges summed
+    adjacency = sparse.csr_matrix((np.ones(len(sources), dtype=np.int64), (sources, targets)),
+                                  shape=(node_count, node_count))
+    adjacency.sum_duplicates()
+    return adjacency
+
+
+def undirected_csr(adjacency):
+    # symmetric 0/1 adjacency without self loops: the simple undirected projection, as nx.Graph(digraph)
+    symmetric = (adjacency + adjacency.T).tocsr()
+    symmetric.setdiag(0)
+    symmetric.eliminate_zeros()
+    symmetric.data[:] = 1
+    symmetric.sort_indices()
+    return symmetric
+
+
+def degrees(adjacency):
+    return np.diff(adjacency.indptr)
+
+
+def giant_component(adjacency, connection='weak'):
+    # (node indices, adjacency) of the largest weakly or strongly connected component
+    count, labels = csgraph.connected_components(adjacency, directed=True, connection=connection)
+    nodes = np.flatnonzero(labels == np.argmax(np.bincount(labels)))
+    return nodes, adjacency[nodes][:, nodes].tocsr()
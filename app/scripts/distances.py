@@ -0,0 +1,164 @@
+"""
+distances.py
+
+Distance statistics of the giant components of the transaction graphs with array based BFS over the CSR adjacency
+(csr_graph.py): diameter bounds (iFUB), sampled average shortest path length, effective diameter and average
+degree connectivity.
+
+GNU General Public License Version 3
+"""
+
+import logging
+import sys
+import traceback
+from timeit import default_timer as timer
+
+import networkx as nx
+import numpy as np
+
+from app.scripts.csr_graph import degrees, giant_component, graph_csr, undirected_csr
+
+logger = logging.getLogger(__name__)
+
+# BFS run by diameter_bounds before returning the bounds found so far
+DIAMETER_BFS = 200
+
+# BFS sources sampled for the average shortest path length and the hop plot
+ASPL_SAMPLES = 200
+
+# share of the connected pairs within the effective diameter
+EFFECTIVE_DIAMETER_QUANTILE = 0.9
+
+
+def frontier_neighbours(adjacency, frontier):
+    # neighbours (with repetitions) of the frontier nodes, gathered from the CSR rows in one indexing operation
+    starts = adjacency.indptr[frontier]
+    counts = adjacency.indptr[frontier + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    return adjacency.indices[offsets]
+
+
+def bfs_distances(adjacency, source):
+    # hop distances from source, -1 for the unreachable nodes; level synchronous BFS, one array step per level
+    distances = np.full(adjacency.shape[0], -1, dtype=np.int64)
+    distances[source] = 0
+    frontier = np.array([source], dtype=np.int64)
+    level = 0
+    while len(frontier):
+        level += 1
+        neighbours = frontier_neighbours(adjacency, frontier)
+        frontier = np.unique(neighbours[distances[neighbours] < 0])
+        distances[frontier] = level
+    return distances
+
+
+def diameter_bounds(adjacency, max_bfs=DIAMETER_BFS):
+    """Return (lower, upper) bounds of the diameter of a strongly connected (or symmetric and connected) adjacency.
+
+    iFUB from the highest degree node u: the pairs farther apart than 2 * (i - 1) have an endpoint at distance i or
+    more from or to u, so once the eccentricities of the nodes at distance i are known, the upper bound drops to
+    max(lower, 2 * (i - 1)). Stops with lower == upper, the diameter, or after max_bfs BFS.
+    """
+    reverse = adjacency.T.tocsr()
+    symmetric = (adjacency != reverse).nnz == 0
+    source = int(np.argmax(degrees(adjacency)))
+    forward = bfs_distances(adjacency, source)
+    backward = forward if symmetric else bfs_distances(reverse, source)
+    bfs_count = 1 if symmetric else 2
+
+    lower = int(max(forward.max(), backward.max()))
+    upper = int(forward.max() + backward.max())
+    level = lower
+    while upper > lower and level > 0:
+        # longest paths to the nodes at forward distance `level` and from the nodes at backward distance `level`
+        fringe = [(reverse, node) for node in np.flatnonzero(forward == level)]
+        if not symmetric:
+            fringe += [(adjacency, node) for node in np.flatnonzero(backward == level)]
+        for fringe_adjacency, node in fringe:
+            if bfs_count >= max_bfs:
+                return lower, upper
+            lower = max(lower, int(bfs_distances(fringe_adjacency, node).max()))
+            bfs_count += 1
+        upper = min(upper, max(lower, 2 * (level - 1)))
+        level -= 1
+    return lower, upper
+
+
+def hop_plot(adjacency, samples=ASPL_SAMPLES, seed=None):
+    # counts[h] of the (sampled source, reachable node) pairs at distance h, from BFS of sampled sources
+    rng = np.random.default_rng(seed)
+    counts = np.zeros(1, dtype=np.int64)
+    for source in rng.choice(adjacency.shape[0], min(samples, adjacency.shape[0]), replace=False):
+        distances = bfs_distances(adjacency, source)
+        source_counts = np.bincount(distances[distances > 0])
+        if len(source_counts) > len(counts):
+            counts = np.pad(counts, (0, len(source_counts) - len(counts)))
+        counts[:len(source_counts)] += source_counts
+    return counts
+
+
+def average_path_length(counts):
+    return float(np.dot(np.arange(len(counts)), counts) / counts.sum()) if counts.sum() else 0.0
+
+
+def effective_diameter(counts, quantile=EFFECTIVE_DIAMETER_QUANTILE):
+    # distance within which `quantile` of the connected pairs are, linearly interpolated between hops
+    if not counts.sum():
+        return 0.0
+    cumulative = np.cumsum(counts) / counts.sum()
+    hops = int(np.searchsorted(cumulative, quantile))
+    if hops == 0:
+        return 0.0
+    return float(hops - 1 + (quantile - cumulative[hops - 1]) / (cumulative[hops] - cumulative[hops - 1]))
+
+
+def average_degree_connectivity(adjacency):
+    """Return {k: average degree of the successors of the nodes of degree k} of a directed adjacency.
+
+    Same as nx.average_degree_connectivity of the (Multi)DiGraph with its defaults: degrees are in + out degrees
+    counting parallel edges, the neighbours of a node are its distinct successors and the nodes of degree 0 map to 0.
+    """
+    node_degrees = np.asarray(adjacency.sum(axis=0)).ravel() + np.asarray(adjacency.sum(axis=1)).ravel()
+    neighbour_degrees = (adjacency != 0).astype(np.int64) @ node_degrees
+    sums = np.bincount(node_degrees, weights=neighbour_degrees)
+    norms = np.bincount(node_degrees, weights=node_degrees)
+    return {int(k): float(sums[k] / norms[k]) if norms[k] else 0.0 for k in np.unique(node_degrees)}
+
+
+def distance_stats(adjacency, samples=ASPL_SAMPLES, max_bfs=DIAMETER_BFS, seed=None):
+    # distance statistics of a strongly connected (or symmetric and connected) adjacency
+    lower, upper = diameter_bounds(adjacency, max_bfs)
+    counts = hop_plot(adjacency, samples, seed)
+    return dict(diameter_lower=lower, diameter_upper=upper, average_path_length=average_path_length(counts),
+                effective_diameter=effective_diameter(counts))
+
+
+def giant_distance_stats(adjacency, samples=ASPL_SAMPLES, max_bfs=DIAMETER_BFS, seed=None):
+    # {'wcc': undirected distance statistics of the giant WCC, 'scc': directed statistics of the giant SCC}
+    return {'wcc': distance_stats(undirected_csr(giant_component(adjacency, 'weak')[1]), samples, max_bfs, seed),
+            'scc': distance_stats(giant_component(adjacency, 'strong')[1], samples, max_bfs, seed)}
+
+
+def format_distance_stats(stats):
+    return "Diameter: [{}, {}] || Average Shortest Path Length: {:.3f} || Effective Diameter: {:.3f}".format(
+        stats['diameter_lower'], stats['diameter_upper'], stats['average_path_length'], stats['effective_diameter'])
+
+
+# Main
+if __name__ == '__main__':
+    # distances.py <gpickle file> [samples]: distance statistics of the giant components of a transaction graph
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stdout)],
+                        format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+                        datefmt='%Y-%m-%dT%H:%M:%S', )
+
+    try:
+        start = timer()
+        nodes, adjacency = graph_csr(nx.read_gpickle(sys.argv[1]))
+        stats = giant_distance_stats(adjacency, int(sys.argv[2]) if len(sys.argv) > 2 else ASPL_SAMPLES)
+        logger.info("Giant WCC (undirected) --- {}".format(format_distance_stats(stats['wcc'])))
+        logger.info("Giant SCC --- {}".format(format_distance_stats(stats['scc'])))
+
+        logger.info("Distances Total Execution Time (seconds): {}".format(timer() - start))
+
+    except Exception as err:
+        logger.error(traceback.format_exc())
@@ -20,7 +20,7 @@ import networkx as nx
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, scoped_session
 
-from models.data import Transaction
+from app.models.data import Transaction
 from timeit import default_timer as timer
 import pytz
 
@@ -53,18 +53,20 @@ db_session = scoped_session(session_factory)
 
 def create_graph(transactions):
     # Directed graphs with self loops and parallel edges
-    # weighted edges
+    # weighted edges in planck, nodes are the integer ids of the address table
     di_graph = nx.MultiDiGraph()
     for row in transactions:
         try:
             # date = datetime.fromtimestamp(row.timestamp / 1e3)
             # date = date.strftime("%Y-%m-%d-%H:%M:%S")
             date = row.timestamp
-            di_graph.add_edge(row.from_address, row.to_address, weight=float(row.value), date=date, fee=float(row.fee))
+            di_graph.add_edge(row.from_address_id, row.to_address_id, weight=int(row.value), date=date,
+                              fee=int(row.fee))
         except Exception as err:
             datetime = row.datetime
             dt_utc = datetime.astimezone(pytz.UTC).strftime("%Y-%m-%d-%H:%M:%S")
-            di_graph.add_edge(row.from_address, row.to_address, weight=float(row.value), date=dt_utc, fee=float(row.fee))
+            di_graph.add_edge(row.from_address_id, row.to_address_id, weight=int(row.value), date=dt_utc,
+                              fee=int(row.fee))
             logger.error("Error at transaction id {}-{}".format(row.block_id, row.extrinsic_idx))
     return di_graph
 
@@ -99,16 +101,18 @@ if __name__ == '__main__':
         # Conditions for a proper balance transfer
 
         # excluding self-loop and zero transfer -- comment out filter condition as required
-        signed_transactions = db_session.query(Transaction).filter(Transaction.signed == 1, Transaction.success == 1,
-                                                                   Transaction.module_id == 'Balances',
-                                                                   Transaction.call_id.in_(
-                                                                       ['transfer', 'transfer_keep_alive',
-                                                                        'transfer_all']),
-                                                                   Transaction.to_address.is_not(None),
-                                                                   Transaction.from_address.is_not(None),
-                                                                   Transaction.from_address != Transaction.to_address,
-                                                                   Transaction.block_id <= 12532600,
-                                                                   Transaction.value > 0)
+        signed_transactions = db_session.query(Transaction.block_id, Transaction.extrinsic_idx,
+                                               Transaction.from_address_id, Transaction.to_address_id,
+                                               Transaction.value, Transaction.fee, Transaction.timestamp,
+                                               Transaction.datetime) \
+            .filter(Transaction.signed == 1, Transaction.success == 1,
+                    Transaction.module_id == 'Balances',
+                    Transaction.call_id.in_(['transfer', 'transfer_keep_alive', 'transfer_all']),
+                    Transaction.to_address_id.is_not(None),
+                    Transaction.from_address_id.is_not(None),
+                    Transaction.from_address_id != Transaction.to_address_id,
+                    Transaction.block_id <= 12532600,
+                    Transaction.value > 0)
 
         count = signed_transactions.count()
         logger.info("SUCCESSFUL Balances Transfer (only) Count={}".format(count))
@@ -0,0 +1,305 @@
+"""
+heavy_hitters.py
+
+Top senders and receivers of every month by transfer count and by transferred value, tracked with Space-Saving
+counters over the time ordered transfers and persisted in the heavy_hitter table.
+
+GNU General Public License Version 3
+"""
+
+import heapq
+import logging
+import sys
+import traceback
+from datetime import date
+from timeit import default_timer as timer
+
+from sqlalchemy import create_engine
+from sqlalchemy.sql import bindparam, text
+
+from app.scripts.account_flow import FLOW_BUCKET_BLOCKS, transfer_filter
+from app.scripts.volume_rollup import is_transfer
+
+logger = logging.getLogger(__name__)
+
+# counters per window and metric: any account with more than 1 / HEAVY_HITTER_COUNTERS of the window total is kept
+HEAVY_HITTER_COUNTERS = 1000
+
+# accounts reported per window and metric
+TOP_K = 20
+
+# blocks ingested between two writes of the pending transfers into the stored counters (~1 hour of blocks)
+FLUSH_BLOCKS = 600
+
+# metric: (address column, weighted by the transfer value)
+METRICS = {
+    'sent_count': ('from_address_id', False),
+    'received_count': ('to_address_id', False),
+    'sent_value': ('from_address_id', True),
+    'received_value': ('to_address_id', True),
+}
+
+select_counters_sql = (
+    "SELECT window_start, metric, address_id, estimate, error FROM heavy_hitter"
+    " WHERE window_start IN :window_starts FOR UPDATE"
+)
+
+delete_counters_sql = "DELETE FROM heavy_hitter WHERE window_start IN :window_starts"
+
+insert_counters_sql = (
+    "INSERT INTO heavy_hitter (window_start, metric, address_id, estimate, error)"
+    " VALUES (:window_start, :metric, :address_id, :estimate, :error)"
+)
+
+upsert_counters_sql = (
+    insert_counters_sql + " ON DUPLICATE KEY UPDATE estimate = VALUES(estimate), error = VALUES(error)"
+)
+
+delete_counter_sql = (
+    "DELETE FROM heavy_hitter WHERE window_start = :window_start AND metric = :metric AND address_id = :address_id"
+)
+
+top_accounts_sql = (
+    "SELECT h.address_id, a.address, h.estimate, h.error FROM heavy_hitter h"
+    " LEFT JOIN address a ON a.id = h.address_id"
+    " WHERE h.window_start = :window_start AND h.metric = :metric ORDER BY h.estimate DESC LIMIT :k"
+)
+
+transfers_sql = (
+    "SELECT e.datetime, e.from_address_id, e.to_address_id, e.value FROM extrinsic e"
+    " WHERE {filter} AND e.block_id BETWEEN :first_block AND :last_block AND e.datetime IS NOT NULL"
+    " ORDER BY e.block_id"
+).format(filter=transfer_filter)
+
+
+class SpaceSaving:
+    """Space-Saving heavy hitters of a weighted stream with a bounded number of counters.
+
+    An item without a counter replaces the item with the smallest estimate and inherits it as its error, so the
+    true weight of a tracked item is in [estimate - error, estimate] and every item heavier than
+    total / capacity is tracked.
+    """
+
+    def __init__(self, capacity=HEAVY_HITTER_COUNTERS):
+        self.capacity = capacity
+        # item: [estimate, error]
+        self.counters = {}
+        # (estimate, item) entries, the outdated ones are skipped when popping the minimum
+        self.heap = []
+
+    def add(self, item, weight=1):
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += weight
+        elif len(self.counters) < self.capacity:
+            counter = self.counters[item] = [weight, 0]
+        else:
+            minimum, evicted = self.pop_min()
+            del self.counters[evicted]
+            counter = self.counters[item] = [minimum + weight, minimum]
+
+        heapq.heappush(self.heap, (counter[0], item))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(estimate, key) for key, (estimate, error) in self.counters.items()]
+            heapq.heapify(self.heap)
+
+    def pop_min(self):
+        while True:
+            estimate, item = heapq.heappop(self.heap)
+            counter = self.counters.get(item)
+            if counter is not None and counter[0] == estimate:
+                return estimate, item
+
+    def load(self, item, estimate, error):
+        self.counters[item] = [estimate, error]
+        heapq.heappush(self.heap, (estimate, item))
+
+    def top(self, k=TOP_K):
+        # [(item, estimate, error)] by decreasing estimate
+        return [(item, estimate, error) for item, (estimate, error) in
+                sorted(self.counters.items(), key=lambda counter: -counter[1][0])[:k]]
+
+
+def get_window_start(value):
+    # first day of the month of a datetime
+    return date(value.year, value.month, 1)
+
+
+def metric_weights(transfers):
+    # (window_start, metric, address_id, weight) of (datetime, from_address_id, to_address_id, value) transfers
+    for transfer_datetime, from_address_id, to_address_id, value in transfers:
+        window_start = get_window_start(transfer_datetime)
+        addresses = {'from_address_id': from_address_id, 'to_address_id': to_address_id}
+        for metric, (column, weighted) in METRICS.items():
+            if not weighted:
+                yield window_start, metric, addresses[column], 1
+            elif value:
+                yield window_start, metric, addresses[column], int(value)
+
+
+def track_transfers(trackers, transfers):
+    # add (datetime, from_address_id, to_address_id, value) transfers to {(window_start, metric): SpaceSaving}
+    for window_start, metric, address_id, weight in metric_weights(transfers):
+        tracker = trackers.get((window_start, metric))
+        if tracker is None:
+            tracker = trackers[(window_start, metric)] = SpaceSaving()
+        tracker.add(address_id, weight)
+    return trackers
+
+
+def load_trackers(session, window_starts):
+    # {(window_start, metric): SpaceSaving} of the stored counters of the windows
+    trackers = {}
+    query = text(select_counters_sql).bindparams(bindparam('window_starts', expanding=True))
+    for row in session.execute(query, {"window_starts": window_starts}):
+        tracker = trackers.get((row.window_start, row.metric))
+        if tracker is None:
+            tracker = trackers[(row.window_start, row.metric)] = SpaceSaving()
+        tracker.load(row.address_id, int(row.estimate), int(row.error))
+    return trackers
+
+
+def write_trackers(session, trackers):
+    # replace the stored counters of the windows of the trackers
+    window_starts = list({window_start for window_start, metric in trackers})
+    if not window_starts:
+        return
+    session.execute(text(delete_counters_sql).bindparams(bindparam('window_starts', expanding=True)),
+                    {"window_starts": window_starts})
+    rows = [dict(window_start=window_start, metric=metric, address_id=address_id, estimate=estimate, error=error)
+            for (window_start, metric), tracker in trackers.items()
+            for address_id, (estimate, error) in tracker.counters.items()]
+    if rows:
+        session.execute(text(insert_counters_sql), rows)
+
+
+def write_changed_counters(session, trackers, loaded):
+    # upsert the counters changed since {(window_start, metric): {address_id: (estimate, error)}} and delete the
+    # evicted ones
+    rows = []
+    evicted = []
+    for (window_start, metric), tracker in trackers.items():
+        before = loaded.get((window_start, metric), {})
+        rows.extend(dict(window_start=window_start, metric=metric, address_id=address_id, estimate=estimate,
+                         error=error)
+                    for address_id, (estimate, error) in tracker.counters.items()
+                    if before.get(address_id) != (estimate, error))
+        evicted.extend(dict(window_start=window_start, metric=metric, address_id=address_id)
+                       for address_id in before if address_id not in tracker.counters)
+    if evicted:
+        session.execute(text(delete_counter_sql), evicted)
+    if rows:
+        session.execute(text(upsert_counters_sql), rows)
+
+
+class HeavyHitterTransfers:
+    """Per-account transfer counts and values of the ingested blocks, added to the stored counters in batches.
+
+    The weights of the committed blocks are summed in memory and added to the counters every FLUSH_BLOCKS blocks
+    and at the end of a run (flush); adding the summed weight of an account is a weighted Space-Saving update, so
+    the error bounds hold. A flush loads the counters of its windows FOR UPDATE in a transaction of its own, so
+    concurrent writers (e.g. replay workers) serialize on the windows, and writes back only the changed counters.
+    Transfers after the last flush of an interrupted run are missing until the month is rebuilt (build).
+    """
+
+    def __init__(self, flush_blocks=FLUSH_BLOCKS):
+        self.flush_blocks = flush_blocks
+        # {(window_start, metric): {address_id: weight}}
+        self.weights = {}
+        self.blocks = 0
+
+    def add_blocks(self, session, decoded_blocks):
+        transfers = [(decoded_block['block']['datetime'], txn['from_address_id'], txn['to_address_id'], txn['value'])
+                     for decoded_block in decoded_blocks if decoded_block['block']['datetime'] is not None
+                     for txn in decoded_block['extrinsics'] if is_transfer(txn)]
+        for window_start, metric, address_id, weight in metric_weights(transfers):
+            weights = self.weights.setdefault((window_start, metric), {})
+            weights[address_id] = weights.get(address_id, 0) + weight
+        self.blocks += len(decoded_blocks)
+        if self.blocks >= self.flush_blocks:
+            self.flush(session)
+
+    def flush(self, session):
+        if self.weights:
+            with session.get_bind().begin() as conn:
+                trackers = load_trackers(conn, list({window_start for window_start, metric in self.weights}))
+                loaded = {key: {address_id: tuple(counter) for address_id, counter in tracker.counters.items()}
+                          for key, tracker in trackers.items()}
+                for key, weights in self.weights.items():
+                    tracker = trackers.get(key)
+                    if tracker is None:
+                        tracker = trackers[key] = SpaceSaving()
+                    for address_id, weight in weights.items():
+                        tracker.add(address_id, weight)
+                write_changed_counters(conn, trackers, loaded)
+        self.weights = {}
+        self.blocks = 0
+
+
+def build_heavy_hitters(engine, first_block, last_block):
+    """Recompute the counters of the windows of [first_block, last_block] in one pass over extrinsic in block order.
+
+    The transfers are read one range of FLOW_BUCKET_BLOCKS blocks per query, and the counters of a window are
+    written when the next window starts, so at most one window of counters and one range of transfers are held in
+    memory. The stored counters of the built windows are replaced, the range should cover whole months.
+    """
+    window_start = None
+    trackers = {}
+    for range_first in range(first_block, last_block + 1, FLOW_BUCKET_BLOCKS):
+        with engine.connect() as conn:
+            rows = conn.execute(text(transfers_sql), {"first_block": range_first,
+                                                      "last_block": min(range_first + FLOW_BUCKET_BLOCKS - 1,
+                                                                        last_block)}).fetchall()
+        for row in rows:
+            if get_window_start(row.datetime) != window_start and trackers:
+                with engine.begin() as write_conn:
+                    write_trackers(write_conn, trackers)
+                logger.info("Heavy hitters of {}".format(window_start))
+                trackers = {}
+            window_start = get_window_start(row.datetime)
+            track_transfers(trackers, [(row.datetime, row.from_address_id, row.to_address_id, row.value)])
+    if trackers:
+        with engine.begin() as write_conn:
+            write_trackers(write_conn, trackers)
+        logger.info("Heavy hitters of {}".format(window_start))
+
+
+def top_accounts(conn, window_start, metric, k=TOP_K):
+    return conn.execute(text(top_accounts_sql), {"window_start": window_start, "metric": metric, "k": k}).fetchall()
+
+
+# Main
+if __name__ == '__main__':
+    # heavy_hitters.py build [first block] [last block]: recompute the counters of the ingested transfers
+    # heavy_hitters.py top <month, e.g. 2021-06> [k]
+    from app.settings import DB_CONNECTION
+
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stdout)],
+                        format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+                        datefmt='%Y-%m-%dT%H:%M:%S', )
+
+    try:
+        start = timer()
+        engine = create_engine(DB_CONNECTION, isolation_level="READ_UNCOMMITTED", pool_pre_ping=True)
+
+        if sys.argv[1] == 'build':
+            first_block = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+            last_block = int(sys.argv[3]) if len(sys.argv) > 3 else None
+            if last_block is None:
+                with engine.connect() as conn:
+                    last_block = conn.execute(text("SELECT MAX(block_id) FROM extrinsic")).scalar() or 0
+            build_heavy_hitters(engine, first_block, last_block)
+        elif sys.argv[1] == 'top':
+            window_start = date.fromisoformat(sys.argv[2] + '-01')
+            with engine.connect() as conn:
+                for metric in METRICS:
+                    logger.info("{} {}:".format(window_start.strftime("%Y-%m"), metric))
+                    for row in top_accounts(conn, window_start, metric, int(sys.argv[3]) if len(sys.argv) > 3
+                                            else TOP_K):
+                        logger.info("\t{} {}: {} (+/- {})".format(row.address_id, row.address, row.estimate,
+                                                                   row.error))
+
+        logger.info("Heavy Hitters Total Execution Time (seconds): {}".format(timer() - start))
+
+    except Exception as err:
+        logger.error(traceback.format_exc())
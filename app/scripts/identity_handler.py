@@ -14,6 +14,7 @@ import getopt
 import logging
 import sys
 import traceback
+from bisect import bisect_right
 from logging.handlers import RotatingFileHandler
 from timeit import default_timer as timer
 
@@ -23,7 +24,8 @@ from sqlalchemy.sql import text
 
 from substrateinterface import SubstrateInterface
 
-from data import AccountInfoSnapshot
+from app.models.data import AccountInfoSnapshot, Event, IdentityCache
+from app.scripts.storage_query import query_multi
 
 DB_NAME = "polkadot_analysis"
 DB_HOST = "localhost"
@@ -51,6 +53,100 @@ logger = logging.getLogger()
 EXTERNAL_URL = "wss://rpc.polkadot.io"
 INTERNAL_URL = "ws://172.20.135.65:9944"
 
+# number of distinct accounts resolved per cache lookup and storage request
+IDENTITY_BATCH_SIZE = 500
+
+
+def get_event_account(attributes):
+    # handle post-7229130 changes to event attributes
+    if type(attributes) is list:
+        attributes = attributes[0]['value'] if type(attributes[0]) is dict else attributes[0]
+    return attributes if type(attributes) is str else None
+
+
+def load_identity_change_blocks():
+    # sorted blocks of the Identity events (IdentitySet, IdentityCleared, JudgementGiven, ...) of each account
+    change_blocks = {}
+    identity_events = db_session.query(Event.block_id, Event.attributes).filter(Event.module_id == 'Identity') \
+        .order_by(Event.block_id.asc())
+    for event in identity_events:
+        account_id = get_event_account(event.attributes)
+        if account_id:
+            change_blocks.setdefault(account_id, []).append(event.block_id)
+    return change_blocks
+
+
+def get_validity_range(change_blocks, block_id):
+    # block range around block_id in which the identity of the account cannot have changed
+    idx = bisect_right(change_blocks, block_id)
+    valid_from_block = change_blocks[idx - 1] if idx > 0 else 0
+    valid_to_block = change_blocks[idx] - 1 if idx < len(change_blocks) else None
+    return valid_from_block, valid_to_block
+
+
+def resolve_identities(substrate, account_ids, block_id, block_hash, identity_change_blocks):
+    # returns {account_id: identity_display} at block_id, querying storage only for accounts whose identity
+    # is not cached for the validity range of block_id
+    ranges = {account_id: get_validity_range(identity_change_blocks.get(account_id, []), block_id)
+              for account_id in account_ids}
+
+    cached = IdentityCache.query(db_session).filter(IdentityCache.account_id.in_(account_ids)).all()
+    cached = {(entry.account_id, entry.valid_from_block): entry for entry in cached}
+
+    identities = {}
+    missing = []
+    for account_id in account_ids:
+        entry = cached.get((account_id, ranges[account_id][0]))
+        if entry:
+            identities[account_id] = entry.identity_display
+        else:
+            missing.append(account_id)
+
+    if missing:
+        results = query_multi(substrate, 'Identity', 'IdentityOf', [[account_id] for account_id in missing],
+                              block_hash)
+        cache_entries = []
+        for account_id, identity in zip(missing, results):
+            identity = identity or {}
+            identities[account_id] = identity.get('info')
+            cache_entries.append({
+                'account_id': account_id,
+                'valid_from_block': ranges[account_id][0],
+                'valid_to_block': ranges[account_id][1],
+                'identity_display': identity.get('info'),
+                'identity_judgement': identity.get('judgements'),
+            })
+        db_session.bulk_insert_mappings(IdentityCache, cache_entries)
+
+    logger.info("Resolved {} identities at block#{}: {} cached, {} queried".format(
+        len(account_ids), block_id, len(account_ids) - len(missing), len(missing)))
+    return identities
+
+
+def enrich_snapshot_identities(substrate, block_id, identity_change_blocks):
+    block_hash = substrate.get_block_hash(block_id)
+
+    with engine.connect().execution_options(autocommit=True) as conn:
+        sql = '''SELECT DISTINCT account_id FROM account_info_snapshot where block_id = :block_id and
+        (is_nominator = 1 or is_validator = 1 or is_council = 1); '''
+        account_ids = [row['account_id'] for row in conn.execute(text(sql), {"block_id": block_id})]
+
+    try:
+        for i in range(0, len(account_ids), IDENTITY_BATCH_SIZE):
+            identities = resolve_identities(substrate, account_ids[i:i + IDENTITY_BATCH_SIZE], block_id,
+                                            block_hash, identity_change_blocks)
+            db_session.bulk_update_mappings(AccountInfoSnapshot, [
+                {'block_id': block_id, 'account_id': account_id, 'identity_display': identity_display}
+                for account_id, identity_display in identities.items() if identity_display
+            ])
+        db_session.commit()
+        logger.info("Saving identities for {} accounts, block#{}".format(len(account_ids), block_id))
+    except Exception as err:
+        # clear the db session
+        db_session.rollback()
+        logger.error(traceback.format_exc())
+
+
 # Main
 if __name__ == '__main__':
 
@@ -82,32 +178,11 @@ if __name__ == '__main__':
             start = timer()
 
             # last block used for analysis
-            block_id = 11320000
-            block_hash = substrate.get_block_hash(block_id)
-
-            with engine.connect().execution_options(autocommit=True) as conn:
-                sql = '''SELECT * FROM account_info_snapshot where is_nominator = 1 or is_validator = 1 or is_council 
-                = 1; '''
-                result = conn.execute(text(sql)).fetchall()
-
-                for row in result:
-                    account_id = row['account_id']
-                    identity = substrate.query(module='Identity', storage_function='IdentityOf',
-                                               params=[account_id], block_hash=block_hash)
-
-                    if identity.value:
-                        identity_display = identity.value.get('info')
-
-                        try:
-                            AccountInfoSnapshot.query(db_session).filter_by(block_id=block_id, account_id=account_id) \
-                                .update({AccountInfoSnapshot.identity_display: identity_display, },
-                                        synchronize_session='fetch')
-                            logger.info("Saving identity for {}, block#{}".format(account_id, block_id))
-                            db_session.commit()
-                        except Exception as err:
-                            # clear the db session
-                            db_session.rollback()
-                            logger.error(traceback.format_exc())
+            block_ids = [11320000]
+            identity_change_blocks = load_identity_change_blocks()
+
+            for block_id in block_ids:
+                enrich_snapshot_identities(substrate, block_id, identity_change_blocks)
 
         logger.info("Block Processing Total Execution Time (seconds): {}".format(timer() - start))
         print("End of Execution....")
@@ -15,8 +15,11 @@ import getopt
 import logging
 import sys
 import traceback
+from collections import deque
 from datetime import datetime
+from hashlib import blake2b
 from logging.handlers import RotatingFileHandler
+from multiprocessing import Pool
 from timeit import default_timer as timer
 
 from scalecodec.base import ScaleBytes
@@ -26,6 +29,19 @@ from sqlalchemy.sql import text
 from substrateinterface import SubstrateInterface
 
 from app.models.data import Block, Transaction, Account, Event
+from app.scripts.account_flow import update_account_flow
+from app.scripts.account_state import account_state_changes, apply_account_states
+from app.scripts.active_sketches import ActiveSketches
+from app.scripts.address_dictionary import AddressDictionary
+from app.scripts.address_normalizer import address_normalizer
+from app.scripts.backfill_indexes import enable_backfill_mode, rebuild_backfill_indexes
+from app.scripts.balance_events import get_event_values, typed_event_rows, write_typed_events
+from app.scripts.block_archive import ArchiveSubstrate, BlockArchive, MemoryArchive, archive_block, \
+    fetch_raw_block
+from app.scripts.block_partitions import ensure_partitions
+from app.scripts.heavy_hitters import HeavyHitterTransfers
+from app.scripts.volume_rollup import VolumePeriods, update_volume_rollups
+from app.settings import TOKEN_DECIMALS
 
 DB_NAME = "polkadot_analysis"
 DB_HOST = "localhost"
@@ -58,6 +74,37 @@ INTERNAL_URL = "ws://172.22.254.48:9944"
 # INTERNAL_URL = "ws://localhost:9944"
 # DEFAULT_URL = "ws://192.168.3.38:9999"
 
+# blocks replayed by a worker process in one task (divides ARCHIVE_PARTITION_BLOCKS)
+REPLAY_CHUNK_BLOCKS = 10000
+# blocks fetched from the node and decoded by a worker process in one task
+DECODE_CHUNK_BLOCKS = 100
+
+address_dictionary = AddressDictionary()
+heavy_hitter_transfers = HeavyHitterTransfers()
+volume_periods = VolumePeriods()
+active_sketches = ActiveSketches()
+
+# entropy prefix of the accounts derived by the Utility and Multisig pallets
+DERIVED_ACCOUNT_PREFIX = b'modlpy/utilisuba'
+
+# event reporting the dispatch result of the call nested in a call, emitted after the events of the nested call
+RESULT_EVENTS = {
+    ('Proxy', 'proxy'): 'ProxyExecuted',
+    ('Proxy', 'proxy_announced'): 'ProxyExecuted',
+    ('Multisig', 'as_multi'): 'MultisigExecuted',
+    ('Sudo', 'sudo'): 'Sudid',
+    ('Sudo', 'sudo_unchecked_weight'): 'Sudid',
+    ('Sudo', 'sudo_as'): 'SudoAsDone',
+    ('Utility', 'dispatch_as'): 'DispatchedAs',
+}
+
+# Utility batches and the events reporting the dispatch of their calls
+BATCH_CALLS = ('batch', 'batch_all', 'force_batch')
+BATCH_EVENTS = ('BatchInterrupted', 'BatchCompleted', 'BatchCompletedWithErrors', 'ItemCompleted', 'ItemFailed')
+
+DISPATCH_EVENTS = {(module_id, event_id) for (module_id, call_id), event_id in RESULT_EVENTS.items()} | \
+                  {('Utility', event_id) for event_id in BATCH_EVENTS}
+
 
 class BlockAlreadyAdded(Exception):
     pass
@@ -95,9 +142,9 @@ def validate_count(block_count):
 
 def create_account(address, block):
     account_info = substrate.query(module='System', storage_function='Account',
-                                   params=[address], block_hash=block.hash)
+                                   params=[address], block_hash=block['hash'])
     identity = substrate.query(module='Identity', storage_function='IdentityOf',
-                               params=[address], block_hash=block.hash)
+                               params=[address], block_hash=block['hash'])
 
     identity_display = None
     identity_judgement = None
@@ -108,22 +155,20 @@ def create_account(address, block):
 
     # returns list of validators at that session of the block
     session = substrate.query(module='Session', storage_function='Validators',
-                              block_hash=block.hash)
+                              block_hash=block['hash'])
     if session.value:
         is_validator = address in session.value
 
-    token_decimals = substrate.token_decimals if block.id >= 1248328 else 12
-
     account = Account.query(db_session).filter_by(address=address).first()
     if not account:
         account = Account(
             address=address,
-            pkey_hex=substrate.ss58_decode(address),
-            balance_free=account_info['data']['free'].value / 10 ** token_decimals,
-            balance_reserved=account_info['data']['reserved'].value / 10 ** token_decimals,
+            pkey_hex=address_normalizer.get_public_key(address),
+            balance_free=account_info['data']['free'].value,
+            balance_reserved=account_info['data']['reserved'].value,
             nonce=account_info['nonce'].value,
-            created_at_block=block.id,
-            updated_at_block=block.id,
+            created_at_block=block['id'],
+            updated_at_block=block['id'],
             identity_display=identity_display,
             identity_judgement=identity_judgement,
             is_validator=is_validator
@@ -134,10 +179,10 @@ def create_account(address, block):
         print("Previous Records for account {} exists in DB".format(address))
         Account.query(db_session).filter_by(
             address=address
-        ).update({Account.balance_free: account_info['data']['free'].value / 10 ** token_decimals,
-                  Account.balance_reserved: account_info['data']['reserved'].value / 10 ** token_decimals,
+        ).update({Account.balance_free: account_info['data']['free'].value,
+                  Account.balance_reserved: account_info['data']['reserved'].value,
                   Account.nonce: account_info['nonce'].value,
-                  Account.updated_at_block: block.id,
+                  Account.updated_at_block: block['id'],
                   Account.identity_judgement: identity_judgement,
                   Account.identity_display: identity_display,
                   Account.is_validator: is_validator},
@@ -145,74 +190,200 @@ def create_account(address, block):
         print("Updated Account {}...".format(address))
 
 
-def process_single_txn(extrinsic_success, extrinsic_idx, extrinsic, block, calls, batch=False, batch_idx=0):
-    transaction = Transaction(
-        block_id=block.id,
+def get_extrinsic_fee(extrinsic_events):
+    # fee in planck of a signed extrinsic from its events, returns (fee, old_fees)
+    withdraw = [e for e in extrinsic_events if e['module_id'] == 'Balances' and e['event_id'] == 'Withdraw']
+    if withdraw:
+        return int(get_event_values(withdraw[0]['attributes'])[1]), False
+
+    # Balances.Deposit(who, amount) to the block author and Treasury.Deposit(value)
+    fee = 0
+    for e in extrinsic_events:
+        if e['module_id'] == 'Balances' and e['event_id'] == 'Deposit':
+            fee += int(get_event_values(e['attributes'])[1])
+        elif e['module_id'] == 'Treasury' and e['event_id'] == 'Deposit':
+            fee += int(get_event_values(e['attributes'])[0])
+
+    return fee, True
+
+
+def get_public_key(address):
+    return bytes.fromhex(address_normalizer.get_public_key(address))
+
+
+def derive_multisig_account(signatories, threshold):
+    # pallet_multisig multi_account_id: hash of the prefix, the sorted signatories and the threshold
+    who = sorted(get_public_key(signatory) for signatory in signatories)
+    length = substrate.runtime_config.create_scale_object('Compact<u32>').encode(len(who)).data
+    entropy = DERIVED_ACCOUNT_PREFIX + bytes(length) + b''.join(who) + int(threshold).to_bytes(2, 'little')
+    return address_normalizer.normalize(blake2b(entropy, digest_size=32).digest())
+
+
+def derive_sub_account(address, index):
+    # pallet_utility derivative_account_id of Utility.as_derivative
+    entropy = DERIVED_ACCOUNT_PREFIX + get_public_key(address) + int(index).to_bytes(2, 'little')
+    return address_normalizer.normalize(blake2b(entropy, digest_size=32).digest())
+
+
+def get_call_origin(call, origin):
+    # account dispatching the calls nested in `call` when `call` is dispatched by `origin`, None if unknown
+    args = {arg['name']: arg['value'] for arg in call['call_args']}
+    try:
+        if call['call_module'] == 'Proxy' and 'real' in args:
+            return address_normalizer.normalize(args['real'])
+        elif call['call_module'] == 'Sudo':
+            # sudo_as dispatches as `who`, the other Sudo calls as Root
+            return address_normalizer.normalize(args['who']) if 'who' in args else None
+        elif origin is None:
+            return None
+        elif call['call_module'] == 'Multisig' and 'other_signatories' in args:
+            return derive_multisig_account(args['other_signatories'] + [origin], args.get('threshold', 1))
+        elif call['call_module'] == 'Utility' and call['call_function'] == 'as_derivative':
+            return derive_sub_account(origin, args['index'])
+    except Exception:
+        logger.error(traceback.format_exc())
+        return None
+    return origin
+
+
+def is_call(value):
+    return isinstance(value, dict) and 'call_module' in value and 'call_function' in value and 'call_args' in value
+
+
+def get_nested_calls(arg):
+    # calls held by a call argument: Call, Vec<Call> or the opaque call of the Multisig calls of older runtimes
+    value = arg['value']
+    if is_call(value):
+        return [value]
+    if isinstance(value, list) and value and all(is_call(item) for item in value):
+        return value
+    if arg['name'] == 'call' and isinstance(value, str) and value.startswith('0x'):
+        try:
+            opaque_call = substrate.runtime_config.create_scale_object('Call', data=ScaleBytes(value),
+                                                                       metadata=substrate.metadata_decoder)
+            opaque_call.decode()
+            return [opaque_call.value]
+        except Exception:
+            logger.warning("Undecodable opaque call {}".format(value[:66]))
+    return []
+
+
+def walk_calls(call, origin, path=()):
+    """Yield (call, origin, path) for every call nested in `call`, depth first, in a single pass.
+
+    Covers the Utility batches, Proxy, Multisig and Sudo calls and any nesting of them. `origin` is the account
+    dispatching the nested call, `path` its 1-based position in each enclosing call, e.g. (2, 1) for the call
+    proxied by the second call of a batch.
+    """
+    nested_calls = [nested_call for arg in call['call_args'] for nested_call in get_nested_calls(arg)]
+    if not nested_calls:
+        return
+
+    nested_origin = get_call_origin(call, origin)
+    for idx, nested_call in enumerate(nested_calls, start=1):
+        yield nested_call, nested_origin, path + (idx,)
+        yield from walk_calls(nested_call, nested_origin, path + (idx,))
+
+
+def dispatch_ok(result):
+    # DispatchResult of an event: {'Ok': ...} or {'Err': ...}, 'Ok' or 'Err', a bool in the oldest runtimes
+    if isinstance(result, dict):
+        return 'Err' not in result
+    return result not in ('Err', False)
+
+
+def pop_event(events, module_id, *event_ids):
+    # last of the remaining dispatch result events if it is one of event_ids, removed from the list
+    if events and events[-1]['module_id'] == module_id and events[-1]['event_id'] in event_ids:
+        return events.pop()
+    return None
+
+
+def set_dispatch_results(calls, path, events, results, dispatched):
+    """Fill results {path: dispatched successfully} for the calls nested in calls[path], dispatched or not.
+
+    `events` are the DISPATCH_EVENTS of the extrinsic in emission order, consumed from the end: a call emits its
+    result event after the events of the calls it dispatched, and the events of a failed dispatch are reverted
+    with it, so going through the call tree from the last nested call backwards meets the result of a call
+    before the results of its own nested calls. The calls after a Utility.BatchInterrupted, the interrupting
+    one included, the calls of a failed proxied / sudo call and those of a Multisig approval that did not reach
+    the threshold (no MultisigExecuted) are not dispatched successfully.
+    """
+    call = calls[path]
+    count = 0
+    while path + (count + 1,) in calls:
+        count += 1
+    if not count:
+        return
+
+    if not dispatched:
+        nested_results = [False] * count
+    elif call['call_module'] == 'Utility' and call['call_function'] in BATCH_CALLS:
+        pop_event(events, 'Utility', 'BatchCompleted', 'BatchCompletedWithErrors')
+        interrupted = pop_event(events, 'Utility', 'BatchInterrupted')
+        # 0-based index of the failed call, the calls before it were dispatched
+        executed = int(get_event_values(interrupted['attributes'])[0]) if interrupted else count
+        nested_results = None
+    elif (call['call_module'], call['call_function']) in RESULT_EVENTS:
+        event = pop_event(events, call['call_module'], RESULT_EVENTS[(call['call_module'], call['call_function'])])
+        nested_results = [event is not None and dispatch_ok(get_event_values(event['attributes'])[-1])] * count
+    else:
+        # e.g. Utility.as_derivative: the nested call fails with the call
+        nested_results = [True] * count
+
+    for idx in range(count, 0, -1):
+        if nested_results is not None:
+            ok = nested_results[idx - 1]
+        elif idx > executed:
+            ok = False
+        else:
+            # force_batch reports every call, batch and batch_all their completed calls in newer runtimes
+            ok = pop_event(events, 'Utility', 'ItemFailed') is None
+            if ok:
+                pop_event(events, 'Utility', 'ItemCompleted')
+        results[path + (idx,)] = ok
+        set_dispatch_results(calls, path + (idx,), events, results, ok)
+
+
+def process_single_txn(extrinsic_success, extrinsic_idx, extrinsic, block, call, origin=None, fee=None,
+                       batch_idx=0, call_path=None):
+    transaction = dict(
+        block_id=block['id'],
         extrinsic_idx=extrinsic_idx,
         batch_idx=batch_idx,
+        call_path=call_path,
         extrinsic_length=extrinsic.value['extrinsic_length'],
         extrinsic_hash=extrinsic.value['extrinsic_hash'],
         signed=extrinsic.signed,
-        module_id=extrinsic.value['call']['call_module'],
-        call_id=extrinsic.value["call"]["call_function"],
+        from_address=origin,
+        to_address=None,
+        value=None,
+        signature=None,
+        tip=None,
+        fee=fee,
+        nonce=None,
+        module_id=call['call_module'],
+        call_id=call['call_function'],
         success=int(extrinsic_success),
         spec_version_id=extrinsic.runtime_config.active_spec_version_id,
-        # debug_info=calls,
-        datetime=block.datetime,
-        timestamp=block.timestamp
+        # debug_info=call['call_args'],
+        datetime=block['datetime'],
+        timestamp=block['timestamp']
     )
 
-    if batch:
-        transaction.module_id = calls['call_module']
-        transaction.call_id = calls['call_function']
-        transaction.extrinsic_hash = calls['call_hash']
-        # transaction.debug_info = calls['call_args']
-        transaction.extrinsic_length = 0  # the total length is included in the batch extrinsic
-        calls = calls['call_args']
+    if call_path is not None:
+        transaction['extrinsic_hash'] = call.get('call_hash')
+        transaction['extrinsic_length'] = 0  # the total length is included in the outer extrinsic
 
     addresses = []
-    token_decimals = substrate.token_decimals if block.id >= 1248328 else 12
-    old_fees = False
 
     # signed extrinsic
     if extrinsic.signed:
-        # get transaction fee
-        event = Event.query(db_session).filter_by(block_id=block.id, extrinsic_idx=extrinsic_idx,
-                                                  module_id='Balances', event_id='Withdraw').first()
-        if event:
-            transaction.fee = event.attributes[1] / 10 ** token_decimals
-        else:
-            old_fees = True
-            transaction.fee = 0
-            event_list = Event.query(db_session).filter_by(block_id=block.id, extrinsic_idx=extrinsic_idx,
-                                                           module_id='Balances', event_id='Deposit').all()
-            if event_list and len(event_list) > 0:
-                for e in event_list:
-                    for attr in e.attributes:
-                        # handle post-7229130 changes to event attributes
-                        if type(attr) is not dict:
-                            transaction.fee += (e.attributes[1] / 10 ** token_decimals)
-                            break
-                        elif attr['type'] == 'Balance':
-                            transaction.fee += (attr['value'] / 10 ** token_decimals)
-
-            event_list = Event.query(db_session).filter_by(block_id=block.id, extrinsic_idx=extrinsic_idx,
-                                                           module_id='Treasury', event_id='Deposit').all()
-            if event_list and len(event_list) > 0:
-                for e in event_list:
-                    # handle post-7229130 changes to event attributes
-                    if type(e.attributes) is list:
-                        for attr in e.attributes:
-                            if attr['type'] == 'Balance':
-                                transaction.fee += (attr['value'] / 10 ** token_decimals)
-                    else:
-                        transaction.fee += (e.attributes / 10 ** token_decimals)
-
-        for param in calls:
+        for param in call['call_args']:
             if 'Balance' in param['type']:
-                # handle redomination
+                # amounts are kept in planck, which the redenomination at block 1248328 did not change
                 try:
-                    transaction.value = param['value'] / 10 ** token_decimals
+                    transaction['value'] = int(param['value'])
                 except TypeError:
                     logger.error(traceback.format_exc())  # do nothing
                 except Exception:
@@ -222,87 +393,97 @@ def process_single_txn(extrinsic_success, extrinsic_idx, extrinsic, block, calls
                 # https://docs.substrate.io/rustdocs/latest/sp_runtime/enum.MultiAddress.html
                 # starting from block #4001911
                 try:
-                    if type(param['value']) is dict:
-                        if 'Id' in param['value']:
-                            transaction.to_address = param['value']['Id']
-                        elif 'Address20' in param['value']:
-                            transaction.to_address = 'Address20:' + param['value']['Address20']
-                        elif 'Address32' in param['value']:
-                            transaction.to_address = substrate.ss58_encode(param['value']['Address32'])
-                        elif 'Raw' in param['value']:
-                            transaction.to_address = substrate.ss58_encode(param['value']['Raw'])
-                    else:
-                        transaction.to_address = param['value'].replace('0x', '')
-
-                    if substrate.is_valid_ss58_address(transaction.to_address):
-                        addresses.append(transaction.to_address)
+                    transaction['to_address'] = address_normalizer.normalize(param['value'])
+
+                    if address_normalizer.is_valid(transaction['to_address']):
+                        addresses.append(transaction['to_address'])
                 except Exception: # to catch exceptions such as substrate errors (Invalid length for address)
                     logger.error(traceback.format_exc())
 
         if 'address' in extrinsic:
-            transaction.from_address = extrinsic.value['address'].replace('0x', '')
-            transaction.signature = list(extrinsic.value['signature'].values())[0]
-            transaction.tip = extrinsic.value['tip'] / 10 ** token_decimals
-            transaction.nonce = extrinsic.value['nonce']
-            addresses.append(transaction.from_address)
+            transaction['signature'] = list(extrinsic.value['signature'].values())[0]
+            # the tip is paid once, by the outer extrinsic
+            transaction['tip'] = int(extrinsic.value['tip']) if call_path is None else 0
+            transaction['nonce'] = extrinsic.value['nonce']
 
-            # subtract tips (if withdraw event is not there):
-            if old_fees:  # check if also applicable to new fees if withdraw includes the fees as well
-                transaction.fee = transaction.fee - transaction.tip
+        if transaction['from_address'] is not None:
+            addresses.append(transaction['from_address'])
 
         # TODO handle Balances-transfer_all separately
         # NOTE:::: the value of the transaction is part of its corresponding Balances-Transfer event
-        # some of these transfer_all do not have an event available, this is because the transaction had either failed
-        # or the sender is including his own address as the destination !!!
 
-        if transaction.value is not None and \
-                transaction.value > 0 and transaction.to_address is not None:
+        if transaction['value'] is not None and \
+                transaction['value'] > 0 and transaction['to_address'] is not None:
             logger.info(">>{} {} from {} -> {}: Value {}".format(
-                transaction.module_id, transaction.call_id,
-                transaction.from_address, transaction.to_address,
-                '{} {}'.format(transaction.value, substrate.token_symbol)
+                transaction['module_id'], transaction['call_id'],
+                transaction['from_address'], transaction['to_address'],
+                '{} {}'.format(transaction['value'] / 10 ** TOKEN_DECIMALS, substrate.token_symbol)
             ))
 
     # unsigned
     else:
-        for param in extrinsic.value["call"]['call_args']:
+        for param in call['call_args']:
             if param['name'] == 'now':
-                block.timestamp = param['value']
-                block.datetime = datetime.fromtimestamp(block.timestamp / 1e3)
-                logger.info(">> Datetime: " + block.datetime.strftime("%d/%m/%Y, %H:%M:%S"))
+                block['timestamp'] = param['value']
+                block['datetime'] = datetime.fromtimestamp(block['timestamp'] / 1e3)
+                logger.info(">> Datetime: " + block['datetime'].strftime("%d/%m/%Y, %H:%M:%S"))
 
-    transaction.save(db_session)
-    return addresses
+    return transaction, addresses
 
 
-def create_transaction(extrinsic, block, extrinsic_success, extrinsic_idx):
+def create_transaction(extrinsic, block, extrinsic_success, extrinsic_idx, extrinsic_events):
+    # one row for the extrinsic and one per nested call, e.g. the transfers of a batch or of a proxied call
+    origin = None
+    fee = None
     if extrinsic.signed:
-        block.count_extrinsics_signed += 1
-    else:
-        block.count_extrinsics_unsigned += 1
-
-    call_args = extrinsic.value["call"]['call_args']
-    addresses = process_single_txn(extrinsic_success, extrinsic_idx, extrinsic, block, call_args)
-
-    if extrinsic.value['call']['call_module'] == 'Utility':
-        logger.info("Utility Extrinsic {}...".format(extrinsic.value["call"]["call_function"]))
-        # handling batch transactions
-        for call in call_args:
-            if 'Vec<Call>' in call['type'] or call['name'] == 'calls':
-                batch_calls = call['value']
-                batch_idx = 1
-                for batch_call in batch_calls:
-                    addresses = process_single_txn(extrinsic_success, extrinsic_idx, extrinsic, block, batch_call,
-                                                   batch=True, batch_idx=batch_idx)
-                    batch_idx += 1
-
-    return block, addresses
-
-
-def process_block(block_number):
-    if Block.query(db_session).filter_by(id=block_number).count() > 0:
-        raise BlockAlreadyAdded(block_number)  # skip if block already exists
+        block['count_extrinsics_signed'] += 1
 
+        # the fee is computed once per extrinsic from its events, decoded with the block, and stored on the
+        # outer row only
+        fee, old_fees = get_extrinsic_fee(extrinsic_events)
+        if 'address' in extrinsic:
+            origin = address_normalizer.normalize(extrinsic.value['address'])
+            # subtract tips (if withdraw event is not there):
+            if old_fees:  # check if also applicable to new fees if withdraw includes the fees as well
+                fee = fee - int(extrinsic.value['tip'])
+    else:
+        block['count_extrinsics_unsigned'] += 1
+
+    call = extrinsic.value['call']
+    transaction, addresses = process_single_txn(extrinsic_success, extrinsic_idx, extrinsic, block, call, origin,
+                                                fee)
+    transactions = [transaction]
+
+    # success of every nested call from the dispatch result events of the extrinsic
+    nested_calls = list(walk_calls(call, origin))
+    calls = {(): call}
+    calls.update((path, nested_call) for nested_call, nested_origin, path in nested_calls)
+    results = {}
+    dispatch_events = [e for e in extrinsic_events if (e['module_id'], e['event_id']) in DISPATCH_EVENTS]
+    set_dispatch_results(calls, (), dispatch_events, results, extrinsic_success)
+
+    # batch_idx numbers the nested calls in depth first order, call_path keeps their position in the call tree
+    for batch_idx, (nested_call, nested_origin, path) in enumerate(nested_calls, start=1):
+        transaction, nested_addresses = process_single_txn(
+            results[path], extrinsic_idx, extrinsic, block, nested_call, nested_origin,
+            0 if extrinsic.signed else None, batch_idx=batch_idx, call_path='.'.join(str(idx) for idx in path))
+        transactions.append(transaction)
+        addresses.extend(nested_addresses)
+
+    if len(transactions) > 1:
+        logger.info("{} {} Extrinsic with {} nested calls...".format(call['call_module'], call['call_function'],
+                                                                    len(transactions) - 1))
+
+    return block, addresses, transactions
+
+
+def decode_block(block_number):
+    """Decode a block to plain row dicts, without accessing the database.
+
+    Returns a dict with the `block` row, the `events`, `extrinsics`, `transfer_events` and `balance_events` rows
+    and the `account_states` changes, as written by write_blocks. Only uses the global `substrate`, so it also
+    runs in decode worker processes.
+    """
     block = substrate.get_block(block_number=block_number, include_author=True)
     block_hash = block['header']['hash']
     logger.info(">>> Processing block {} hash '{}' author: {}".format(block_number, block_hash, block['author']))
@@ -312,11 +493,8 @@ def process_block(block_number):
     extrinsics_data = block.pop('extrinsics')
     block_events = substrate.get_events(block_hash=block_hash)
 
-    if Block.query(db_session).filter_by(hash=block_hash).count() > 0:
-        raise BlockAlreadyAdded(block_hash)  # skip if block already exists
-
     # new block to be added
-    block = Block(
+    block = dict(
         id=block_id,
         parent_id=block_id - 1,
         hash=block_hash,
@@ -334,6 +512,10 @@ def process_block(block_number):
         count_accounts_reaped=0,
         count_sessions_new=0,
         count_log=len(digest_logs),
+        datetime=None,
+        timestamp=None,
+        slot_number=None,
+        authority_index=None,
         spec_version_id=substrate.runtime_version
     )
 
@@ -348,8 +530,8 @@ def process_block(block_number):
                         data=ScaleBytes(log_data.value['PreRuntime'][1])
                     )
                     babe_predigest.decode()
-                    block.authority_index = babe_predigest[1].value['authority_index']
-                    block.slot_number = babe_predigest[1].value['slot_number']
+                    block['authority_index'] = babe_predigest[1].value['authority_index']
+                    block['slot_number'] = babe_predigest[1].value['slot_number']
                     log_data.value['PreRuntime'] = ('BABE', babe_predigest.value)
 
                 elif 'Seal' in log_data and log_data.value['Seal'][0] == f"0x{b'BABE'.hex()}":
@@ -359,8 +541,8 @@ def process_block(block_number):
             else:
                 if 'PreRuntime' in log_data:
                     # Determine block producer
-                    block.authority_index = int(log_data.value['PreRuntime']['data']['authority_index'])
-                    block.slot_number = log_data.value['PreRuntime']['data']['slot_number']
+                    block['authority_index'] = int(log_data.value['PreRuntime']['data']['authority_index'])
+                    block['slot_number'] = log_data.value['PreRuntime']['data']['slot_number']
 
             logs.append(log_data.value)
 
@@ -368,91 +550,273 @@ def process_block(block_number):
         # errors due to new way of handling logs as scale_info, new runtime types
         print(e)  # do nothing
 
-    block.logs = logs
+    block['logs'] = logs
 
     # ==== Get block events from Substrate ==================
     extrinsic_success_idx = {}
+    events = []
+    extrinsic_events = {}
 
     # Events ###
     event_idx = 0
-    parent_spec_version = substrate.get_block_runtime_version(block.parent_hash).get('specVersion', 0)
+    parent_spec_version = substrate.get_block_runtime_version(block['parent_hash']).get('specVersion', 0)
     for event in block_events:
-        if Event.query(db_session).filter_by(block_id=block_id, extrinsic_idx=event.value['extrinsic_idx'],
-                                             event_idx=event_idx).count() > 0:
-            print("Event {} for block {}-extrinsic {} already exists".format(event_idx, block_id,
-                                                                             event.value['extrinsic_idx']))
-        else:
+        model = dict(
+            block_id=block_id,
+            event_idx=event_idx,
+            phase=event.value['phase'],
+            extrinsic_idx=event.value['extrinsic_idx'],
+            type=event.value['event_index'],
+            spec_version_id=parent_spec_version,
+            module_id=event.value['module_id'],
+            event_id=event.value['event_id'],
+            system=int(event.value['module_id'] == 'System'),
+            attributes=event.value['attributes']
+        )
+
+        # Process event
+        if event.value['module_id'] == 'System':
+            # Store result of extrinsic
+            if event.value['event_id'] == 'ExtrinsicSuccess':
+                extrinsic_success_idx[event.value['extrinsic_idx']] = True
+                block['count_extrinsics_success'] += 1
+
+            if event.value['event_id'] == 'ExtrinsicFailed':
+                extrinsic_success_idx[event.value['extrinsic_idx']] = False
+                block['count_extrinsics_error'] += 1
+
+            if event.value['event_id'] == 'NewAccount':
+                block['count_accounts_new'] += 1
+
+            if event.value['event_id'] == 'KilledAccount':
+                block['count_accounts_reaped'] += 1
+
+        # TODO handle other events to figure out information about governance,
+        #  staking and sessions (incl. validators and nominators)
+        if event.value['module_id'] == 'Session' and event.value['event_id'] == 'NewSession':
+            block['count_sessions_new'] += 1
 
-            model = Event(
-                block_id=block_id,
-                event_idx=event_idx,
-                phase=event.value['phase'],
-                extrinsic_idx=event.value['extrinsic_idx'],
-                type=event.value['event_index'],
-                spec_version_id=parent_spec_version,
-                module_id=event.value['module_id'],
-                event_id=event.value['event_id'],
-                system=int(event.value['module_id'] == 'System'),
-                attributes=event.value['attributes']
-            )
-
-            # Process event
-            if event.value['module_id'] == 'System':
-                # Store result of extrinsic
-                if event.value['event_id'] == 'ExtrinsicSuccess':
-                    extrinsic_success_idx[event.value['extrinsic_idx']] = True
-                    block.count_extrinsics_success += 1
-
-                if event.value['event_id'] == 'ExtrinsicFailed':
-                    extrinsic_success_idx[event.value['extrinsic_idx']] = False
-                    block.count_extrinsics_error += 1
-
-                if event.value['event_id'] == 'NewAccount':
-                    block.count_accounts_new += 1
-
-                if event.value['event_id'] == 'KilledAccount':
-
-                    # handle post-block 7229130 errors TypeError: string indices must be integers TODO find better
-                    #  way to get a decoded version of events and extrinsics based on the runtime version
-                    if type(event.value['attributes']) is str:
-                        addr = event.value['attributes']
-                    else:
-                        addr = event.value['attributes'][0]['value']
-
-                    Account.query(db_session).filter_by(
-                        address=addr
-                    ).update({Account.is_reaped: True}, synchronize_session='fetch')
-                    block.count_accounts_reaped += 1
-                    logger.info("Updated Killed Account {}...".format(addr))
-
-            # TODO handle other events to figure out information about governance,
-            #  staking and sessions (incl. validators and nominators)
-            if event.value['module_id'] == 'Session' and event.value['event_id'] == 'NewSession':
-                block.count_sessions_new += 1
-
-            model.save(db_session)
+        events.append(model)
+        extrinsic_events.setdefault(model['extrinsic_idx'], []).append(model)
         event_idx += 1
 
     extrinsic_idx = 0
-    address_list = set()
+    block_transactions = []
     for extrinsic in extrinsics_data:
-        if Transaction.query(db_session).filter_by(block_id=block_id, extrinsic_idx=extrinsic_idx).count() > 0:
-            print("Transaction {} for block {} already exists".format(extrinsic_idx, block_id))
-        else:
-            extrinsic_success = extrinsic_success_idx.get(extrinsic_idx, False)
-            (block, addresses) = create_transaction(extrinsic, block, extrinsic_success, extrinsic_idx)
-            address_list.update(addresses)
+        extrinsic_success = extrinsic_success_idx.get(extrinsic_idx, False)
+        (block, addresses, transactions) = create_transaction(extrinsic, block, extrinsic_success, extrinsic_idx,
+                                                              extrinsic_events.get(extrinsic_idx, []))
+        block_transactions.extend(transactions)
         extrinsic_idx += 1
 
+    transfer_events, balance_events = typed_event_rows(events)
+
+    return {'block': block, 'events': events, 'extrinsics': block_transactions,
+            'account_states': account_state_changes(events), 'transfer_events': transfer_events,
+            'balance_events': balance_events}
+
+
+def write_blocks(decoded_blocks):
+    # bulk insert decoded blocks in a single db transaction
+    if not decoded_blocks:
+        return
+
+    # integer ids of the sender and receiver addresses
+    address_dictionary.set_ids(db_session, [txn for decoded_block in decoded_blocks
+                                            for txn in decoded_block['extrinsics']])
+
+    for table, key in ((Event.__table__, 'events'), (Transaction.__table__, 'extrinsics')):
+        rows = [row for decoded_block in decoded_blocks for row in decoded_block[key]]
+        if rows:
+            db_session.execute(table.insert().prefix_with('IGNORE'), rows)
+
+    # typed projection of the balance events
+    write_typed_events(db_session, address_dictionary,
+                       [row for decoded_block in decoded_blocks for row in decoded_block['transfer_events']],
+                       [row for decoded_block in decoded_blocks for row in decoded_block['balance_events']])
+
+    # reaped and re-created accounts, with their history rows
+    account_states = [change for decoded_block in decoded_blocks for change in decoded_block['account_states']]
+    if account_states:
+        logger.info("Updated {} Reaped/New Accounts...".format(apply_account_states(db_session, account_states)))
+
+    # maintain the per-account transfer rollup in the same db transaction as the blocks
+    update_account_flow(db_session, [txn for decoded_block in decoded_blocks for txn in decoded_block['extrinsics']])
+
+    # block volume rollups, the hour and day rows are recomputed once their period is closed
+    update_volume_rollups(db_session, decoded_blocks)
+
     # handle accounts creation/update
     # for address in address_list:
     #     create_account(address, block)
     # create_account(block.author, block)  # create account for validator/block author
 
-    block.save(db_session)
+    db_session.execute(Block.__table__.insert().prefix_with('IGNORE'),
+                       [decoded_block['block'] for decoded_block in decoded_blocks])
     # commit the db session
     db_session.commit()
 
+    # hour and day volume rows of the closed periods
+    volume_periods.add_blocks(db_session, decoded_blocks)
+
+    # daily HyperLogLog sketches of the active accounts, merged into the stored sketches once their day is over
+    active_sketches.add_blocks(db_session, decoded_blocks)
+
+    # Space-Saving counters of the top senders and receivers of the month, written every FLUSH_BLOCKS blocks
+    heavy_hitter_transfers.add_blocks(db_session, decoded_blocks)
+
+
+def flush_rollups():
+    # write the rollups kept in memory between write batches, at the end of a run
+    volume_periods.flush(db_session)
+    active_sketches.flush(db_session)
+    heavy_hitter_transfers.flush(db_session)
+
+
+def process_block(block_number):
+    if Block.query(db_session).filter_by(id=block_number).count() > 0:
+        raise BlockAlreadyAdded(block_number)  # skip if block already exists
+
+    decoded_block = decode_block(block_number)
+
+    if Block.query(db_session).filter_by(hash=decoded_block['block']['hash']).count() > 0:
+        raise BlockAlreadyAdded(decoded_block['block']['hash'])  # skip if block already exists
+
+    write_blocks([decoded_block])
+
+
+def process_blocks(first_index, last_index):
+    try:
+        for i in range(first_index, last_index + 1):
+            try:
+                process_block(i)
+            except BlockAlreadyAdded:
+                print("Block Already Added, Skipping Block...")
+            except Exception as err:
+                # clear the db session
+                db_session.rollback()
+                logger.error(traceback.format_exc())
+    finally:
+        flush_rollups()
+
+
+def archive_blocks(archive_path, first_index, last_index):
+    # fetch raw blocks from the node to the local archive, without decoding them
+    archive = BlockArchive(archive_path)
+    for i in range(first_index, last_index + 1):
+        if archive.has_block(i):
+            continue
+        try:
+            archive_block(substrate, archive, i)
+        except Exception as err:
+            logger.error(traceback.format_exc())
+
+        if i % 1000 == 0:
+            logger.info(">>> Archived block {}".format(i))
+
+
+def init_replay_worker(archive_path):
+    global substrate
+    substrate = ArchiveSubstrate(BlockArchive(archive_path))
+    # db connections can not be shared with the parent process
+    engine.dispose()
+
+
+def replay_blocks(block_range):
+    process_blocks(*block_range)
+    db_session.remove()
+    return block_range
+
+
+def replay_archive(archive_path, first_index, last_index, processes):
+    # decode archived blocks in parallel, the substrate node is not queried
+    # chunks are aligned on REPLAY_CHUNK_BLOCKS, so they never span two archive partitions
+    block_ranges = []
+    i = first_index
+    while i <= last_index:
+        chunk_end = min((i // REPLAY_CHUNK_BLOCKS + 1) * REPLAY_CHUNK_BLOCKS - 1, last_index)
+        block_ranges.append((i, chunk_end))
+        i = chunk_end + 1
+
+    with Pool(processes, initializer=init_replay_worker, initargs=(archive_path,)) as pool:
+        for first_block, last_block in pool.imap_unordered(replay_blocks, block_ranges):
+            logger.info(">>> Replayed blocks {} to {}".format(first_block, last_block))
+
+
+def init_decode_worker():
+    global substrate
+    substrate = ArchiveSubstrate(MemoryArchive())
+
+
+def decode_raw_blocks(raw_blocks, runtime_metadata):
+    # decode stage, runs in a worker process: raw blocks to row dicts
+    substrate.archive.add_blocks(raw_blocks, runtime_metadata)
+    decoded_blocks = []
+    for raw_block in raw_blocks:
+        try:
+            decoded_blocks.append(decode_block(raw_block['number']))
+        except Exception as err:
+            logger.error(traceback.format_exc())
+    return decoded_blocks
+
+
+def fetch_raw_blocks(first_index, last_index, runtime_metadata):
+    # fetch stage: chunks of raw blocks not in the db yet, metadata of new runtimes is added to runtime_metadata
+    existing = {row.id for row in db_session.query(Block.id).filter(Block.id.between(first_index, last_index))}
+    raw_blocks = []
+    for i in range(first_index, last_index + 1):
+        if i in existing:
+            continue
+        try:
+            raw_block = fetch_raw_block(substrate, i)
+            if raw_block['spec_version'] not in runtime_metadata:
+                runtime_metadata[raw_block['spec_version']] = substrate.get_block_metadata(
+                    block_hash=raw_block['header']['parentHash'], decode=False)['result']
+        except Exception as err:
+            logger.error(traceback.format_exc())
+            continue
+
+        raw_blocks.append(raw_block)
+        if len(raw_blocks) == DECODE_CHUNK_BLOCKS:
+            yield raw_blocks
+            raw_blocks = []
+
+    if raw_blocks:
+        yield raw_blocks
+
+
+def write_decoded_blocks(decoded_blocks):
+    # write stage
+    try:
+        write_blocks(decoded_blocks)
+        if decoded_blocks:
+            logger.info(">>> Written blocks until {}".format(decoded_blocks[-1]['block']['id']))
+    except Exception as err:
+        # clear the db session
+        db_session.rollback()
+        logger.error(traceback.format_exc())
+
+
+def ingest_blocks(first_index, last_index, processes):
+    # fetch raw blocks from the node, decode them in a process pool and write the decoded rows in bulk
+    runtime_metadata = {}
+    pending = deque()
+    try:
+        with Pool(processes, initializer=init_decode_worker) as pool:
+            for raw_blocks in fetch_raw_blocks(first_index, last_index, runtime_metadata):
+                spec_versions = {raw_block['spec_version'] for raw_block in raw_blocks}
+                pending.append(pool.apply_async(decode_raw_blocks, (
+                    raw_blocks, {spec_version: runtime_metadata[spec_version] for spec_version in spec_versions})))
+
+                # bound the number of chunks in flight, write decoded chunks in block order
+                while len(pending) > 2 * processes or (pending and pending[0].ready()):
+                    write_decoded_blocks(pending.popleft().get())
+
+            while pending:
+                write_decoded_blocks(pending.popleft().get())
+    finally:
+        flush_rollups()
+
 
 # Main
 if __name__ == '__main__':
@@ -460,19 +824,32 @@ if __name__ == '__main__':
 
         argv = sys.argv[1:]
         url = None
+        archive_path = None
+        replay_path = None
+        processes = 1
+        backfill = False
+        usage = 'main.py -u <url> [-p <processes>] [-b] [-a <archive dir>] [-r <archive dir>]'
 
         try:
-            opts, args = getopt.getopt(argv, "h:u", ["url="])
+            opts, args = getopt.getopt(argv, "hu:a:r:p:b", ["url=", "archive=", "replay=", "processes=", "backfill"])
         except getopt.GetoptError:
-            print('main.py -u <url>')
+            print(usage)
             sys.exit(2)
 
         for opt, arg in opts:
             if opt == '-h':
-                print('main.py -u <url>')
+                print(usage)
                 sys.exit()
             elif opt in ("-u", "--url"):
                 url = arg
+            elif opt in ("-a", "--archive"):
+                archive_path = arg  # only fetch raw blocks to the archive
+            elif opt in ("-r", "--replay"):
+                replay_path = arg  # decode blocks from the archive instead of the node
+            elif opt in ("-p", "--processes"):
+                processes = int(arg)  # decode worker processes
+            elif opt in ("-b", "--backfill"):
+                backfill = True  # drop secondary indexes during ingest and rebuild them at the end
 
         clear = input("Clear DB?")
 
@@ -490,6 +867,26 @@ if __name__ == '__main__':
         first_index = validate_index(input('Enter first block index [default=highest block]: '))
         count = validate_count(input('Enter block count [default=1]: '))
 
+        if backfill and not archive_path:
+            enable_backfill_mode(engine)
+
+        if not archive_path:
+            # partitions of the ingested range are created before any row is written
+            ensure_partitions(engine, first_index + count - 1)
+
+        if replay_path:
+            start = timer()
+            substrate = ArchiveSubstrate(BlockArchive(replay_path))
+            if processes > 1:
+                replay_archive(replay_path, first_index, first_index + count - 1, processes)
+            else:
+                process_blocks(first_index, first_index + count - 1)
+            if backfill:
+                db_session.remove()
+                rebuild_backfill_indexes(engine)
+            logger.info("Block Replay Total Execution Time (seconds): {}".format(timer() - start))
+            sys.exit(0)
+
         if not url:
             url = INTERNAL_URL
 
@@ -517,15 +914,16 @@ if __name__ == '__main__':
             #         db_session.rollback()
             #         logger.error(traceback.format_exc())
 
-            for i in range(first_index, first_index + count):
-                try:
-                    process_block(i)
-                except BlockAlreadyAdded:
-                    print("Block Already Added, Skipping Block...")
-                except Exception as err:
-                    # clear the db session
-                    db_session.rollback()
-                    logger.error(traceback.format_exc())
+            if archive_path:
+                archive_blocks(archive_path, first_index, first_index + count - 1)
+            elif processes > 1:
+                ingest_blocks(first_index, first_index + count - 1, processes)
+            else:
+                process_blocks(first_index, first_index + count - 1)
+
+            if backfill and not archive_path:
+                db_session.remove()
+                rebuild_backfill_indexes(engine)
 
             logger.info("Block Processing Total Execution Time (seconds): {}".format(timer() - start))
 
@@ -19,6 +19,10 @@ from random import sample
 from datetime import datetime
 from dateutil.rrule import rrule, MONTHLY
 
+from app.scripts.csr_graph import giant_component, graph_csr, undirected_csr
+from app.scripts.distances import average_degree_connectivity, distance_stats, format_distance_stats
+from app.scripts.triangles import triangle_stats
+
 # create and configure logger
 filename = "../../logs2/xnetworkx_analysis_aug24.log"
 logging.basicConfig(level=logging.INFO,
@@ -51,11 +55,11 @@ def create_graph(transactions):
         try:
             date = datetime.fromtimestamp(row.timestamp / 1e3)
             date = date.strftime("%Y-%m-%d-%H")
-            di_graph.add_edge(row.from_address, row.to_address, weight=float(row.value), date=date)
+            di_graph.add_edge(row.from_address, row.to_address, weight=int(row.value), date=date)
         except Exception as err:
             datetime = row.datetime
             dt_utc = datetime.astimezone(pytz.UTC).strftime("%Y-%m-%d-%H")
-            di_graph.add_edge(row.from_address, row.to_address, weight=float(row.value), date=dt_utc)
+            di_graph.add_edge(row.from_address, row.to_address, weight=int(row.value), date=dt_utc)
             # logger.error("Error at transaction id {}-{}".format(row.block_id, row.extrinsic_idx))
     return di_graph
 
@@ -221,6 +225,11 @@ def loop_months(graph):
             logger.info('\tAssortativity: {}'.format(nx.degree_assortativity_coefficient(subgraph)))
             logger.info('\tPearson: {}'.format(nx.degree_pearson_correlation_coefficient(subgraph)))
 
+            nodes, adjacency = graph_csr(subgraph)
+            triangles = triangle_stats(undirected_csr(adjacency))
+            logger.info("\tTriangles: {} || Transitivity: {} || Average Clustering: {}".format(
+                triangles['triangles'], triangles['transitivity'], triangles['average_clustering']))
+
             logger.info('\tStrongly connected components:')
             logger.info("\t\tNumber of SCC components: {}".format(nx.number_strongly_connected_components(subgraph)))
             sccs = nx.strongly_connected_components(subgraph)
@@ -231,13 +240,16 @@ def loop_months(graph):
             compute_centrality(giant_comp_graph)
             logger.info('\t\t\tNumber of nodes: {}'.format(giant_comp_graph.number_of_nodes()))
             logger.info('\t\t\tNumber of edges: {}'.format(giant_comp_graph.number_of_edges()))
+            giant_scc = giant_component(adjacency, 'strong')[1]
+            logger.info('\t\t\t{}'.format(format_distance_stats(distance_stats(giant_scc))))
 
             indegree = dict(giant_comp_graph.in_degree())
             outdegree = dict(giant_comp_graph.out_degree())
             degree = dict(giant_comp_graph.degree())
 
             logger.info("\t\t\tMost important node is: In-Degree {} || Out-Degree: {} || Total Degree:  {}".
-                        format(max(indegree), max(outdegree), max(degree)))
+                        format(max(indegree, key=indegree.get), max(outdegree, key=outdegree.get),
+                               max(degree, key=degree.get)))
 
             logger.info('\tWeakly connected components:')
             logger.info("\t\tNumber of WCC components: {}".format(nx.number_weakly_connected_components(subgraph)))
@@ -249,13 +261,16 @@ def loop_months(graph):
             compute_centrality(giant_comp_graph)
             logger.info('\t\t\tNumber of nodes: {}'.format(giant_comp_graph.number_of_nodes()))
             logger.info('\t\t\tNumber of edges: {}'.format(giant_comp_graph.number_of_edges()))
+            giant_wcc = undirected_csr(giant_component(adjacency, 'weak')[1])
+            logger.info('\t\t\tUndirected {}'.format(format_distance_stats(distance_stats(giant_wcc))))
 
             indegree = dict(giant_comp_graph.in_degree())
             outdegree = dict(giant_comp_graph.out_degree())
             degree = dict(giant_comp_graph.degree())
 
             logger.info("\t\t\tMost important node is: In-Degree {} || Out-Degree: {} || Total Degree:  {}".
-                        format(max(indegree), max(outdegree), max(degree)))
+                        format(max(indegree, key=indegree.get), max(outdegree, key=outdegree.get),
+                               max(degree, key=degree.get)))
 
             # plot_centrality(subgraph, month)
 
@@ -344,10 +359,14 @@ if __name__ == '__main__':
         # logger.info('\t#SCC: {}'.format(nx.number_strongly_connected_components(digraph)))
         # logger.info('\t#WCC: {}'.format(nx.number_weakly_connected_components(digraph)))
 
-        # Found infinite path length because the graph is not connected
-        # logger.info("\tUndirected Graph Diameter: {}".format(nx.diameter(graph)))
+        # distances within the giant components, the graph is not connected
+        nodes, adjacency = graph_csr(digraph)
+        giant_wcc = undirected_csr(giant_component(adjacency, 'weak')[1])
+        logger.info("\tUndirected Giant WCC {}".format(format_distance_stats(distance_stats(giant_wcc))))
+        giant_scc = giant_component(adjacency, 'strong')[1]
+        logger.info("\tGiant SCC {}".format(format_distance_stats(distance_stats(giant_scc))))
 
-        # logger.info("\tAverage Degree Connectivity: {}".format(nx.average_degree_connectivity(digraph)))
+        logger.info("\tAverage Degree Connectivity: {}".format(average_degree_connectivity(adjacency)))
 
         # The degree centrality for a node v is the fraction of nodes it is connected to.
         # logger.info('\tDegree Centrality:')
@@ -370,10 +389,10 @@ if __name__ == '__main__':
 
 
         # undirected graph
-        # graph = nx.Graph(digraph)
-        # logger.info("\t\tTransitivity: {}".format(nx.transitivity(graph)))
-        # logger.info("\t\tTriangles: {}".format(nx.triangles(graph)))
-        # logger.info("\tAverage Clustering: {}".format(nx.average_clustering(graph)))
+        triangles = triangle_stats(undirected_csr(adjacency))
+        logger.info("\t\tTransitivity: {}".format(triangles['transitivity']))
+        logger.info("\t\tTriangles: {}".format(triangles['triangles']))
+        logger.info("\tAverage Clustering: {}".format(triangles['average_clustering']))
 
         # giant_scc_comp = digraph.subgraph(max(nx.strongly_connected_components(digraph), key=len))
         # giant_wcc_comp = digraph.subgraph(max(nx.weakly_connected_components(digraph), key=len))
@@ -17,11 +17,14 @@ from logging.handlers import RotatingFileHandler
 from timeit import default_timer as timer
 
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.orm import sessionmaker, scoped_session, aliased
 
 from app.models.data import AccountInfoSnapshot
+from app.scripts.account_flow import cumulative_account_flow
+from app.settings import TOKEN_DECIMALS
 import csv
-from sqlalchemy.sql import func, text
+from collections import defaultdict
+from sqlalchemy.sql import case, func
 
 DB_NAME = "polkadot_analysis"
 DB_HOST = "localhost"
@@ -46,12 +49,42 @@ logging.basicConfig(level=logging.INFO,
                     datefmt='%Y-%m-%dT%H:%M:%S', )
 logger = logging.getLogger()
 
-sql = (
-    "SELECT :account_id as account_id, COUNT(*) AS in_degree,  COALESCE(SUM(value), 0.00) as weight"
-    " FROM extrinsic"
-    " where module_id = 'Balances' and success = 1 and to_address=:account_id and block_id <= :block_id and "
-    "from_address != to_address; "
-)
+def snapshot_stats(block_ids):
+    # total, active and average balance of every snapshot in one grouped pass
+    active = AccountInfoSnapshot.balance_total > 0
+    query = db_session.query(AccountInfoSnapshot.block_id,
+                             func.count().label('total_accounts'),
+                             func.sum(case((active, 1), else_=0)).label('total_active'),
+                             func.avg(case((active, AccountInfoSnapshot.balance_total))).label('average')) \
+        .filter(AccountInfoSnapshot.block_id.in_(block_ids)) \
+        .group_by(AccountInfoSnapshot.block_id)
+    return {row.block_id: row for row in query}
+
+
+def top_k_records(block_ids, k):
+    # top k balances of every snapshot in one windowed query
+    balance_rank = func.row_number().over(partition_by=AccountInfoSnapshot.block_id,
+                                          order_by=AccountInfoSnapshot.balance_total.desc()).label('balance_rank')
+    ranked = db_session.query(AccountInfoSnapshot, balance_rank) \
+        .filter(AccountInfoSnapshot.block_id.in_(block_ids)).subquery()
+    ranked_snapshot = aliased(AccountInfoSnapshot, ranked)
+    query = db_session.query(ranked_snapshot).filter(ranked.c.balance_rank <= k) \
+        .order_by(ranked.c.block_id, ranked.c.balance_rank)
+
+    top_records = defaultdict(list)
+    for record in query:
+        top_records[record.block_id].append(record)
+    return top_records
+
+
+def cumulative_in_degree(block_ids, account_ids):
+    # {account_id: [[in_degree, weight] up to each block of sorted(block_ids)]} from the account_flow rollup,
+    # excluding self-loops
+    flow = cumulative_account_flow(db_session, account_ids, block_ids)
+    return {account_id: [[totals['incoming_count'] - totals['self_loop_count'],
+                          totals['incoming_sum'] - totals['self_loop_sum']] for totals in account_flow]
+            for account_id, account_flow in flow.items()}
+
 
 # Main
 if __name__ == '__main__':
@@ -64,14 +97,14 @@ if __name__ == '__main__':
                      9171661, 9573880, 10019762, 10448617, 10883304, 11307029]
         k = 100
 
-        for block_id in block_ids:
-            # query non zero balance totals
-            query = AccountInfoSnapshot.query(db_session).filter_by(block_id=block_id)
-            total_accounts = query.count()
-            total_active = query.filter(AccountInfoSnapshot.balance_total > 0).count()
-            top_records = query.order_by(AccountInfoSnapshot.balance_total.desc()).limit(k).all()
+        stats = snapshot_stats(block_ids)
+        top_records = top_k_records(block_ids, k)
+        account_ids = set(e.account_id for records in top_records.values() for e in records)
+        in_degree = cumulative_in_degree(block_ids, account_ids)
+        snapshot_idx = {block_id: idx for idx, block_id in enumerate(sorted(block_ids))}
 
-            if len(top_records) > 0:
+        for block_id in block_ids:
+            if len(top_records[block_id]) > 0:
                 with open('../../accounts/account_info_snapshot_{}_top{}.csv'.format(block_id, k), 'w',
                           newline='') as outfile:
                     outcsv = csv.writer(outfile)
@@ -79,29 +112,23 @@ if __name__ == '__main__':
                     [outcsv.writerow([getattr(curr, column.name) for column in AccountInfoSnapshot.__mapper__.columns])
                      for
                      curr in
-                     top_records]
+                     top_records[block_id]]
                     logger.info("Saved file for top {} Block#{}".format(k, block_id))
 
-                account_ids = []
-                for e in top_records:
-                    account_ids.append(e.account_id)
-
                 # cumulative in-degree
                 with open('../../accounts/account_info_snapshot_{}_top{}_indegree.csv'.format(block_id, k), 'w',
                           newline='') as outfile:
                     outcsv = csv.writer(outfile)
                     outcsv.writerow(["account_id", "in_degree", "weight"])
-                    for account_id in account_ids:
-                        query = db_session.execute(text(sql),
-                                                   {"block_id": block_id, "account_id": account_id}).fetchall()
-                        outcsv.writerows(query)
+                    for e in top_records[block_id]:
+                        outcsv.writerow([e.account_id] + in_degree[e.account_id][snapshot_idx[block_id]])
                     logger.info("Saved file for indegree top {} Block#{}".format(k, block_id))
 
-                average = db_session.query(func.avg(AccountInfoSnapshot.balance_total)).filter(
-                    AccountInfoSnapshot.block_id == block_id, AccountInfoSnapshot.balance_total > 0).first()[0]
-                logger.info("Block#{} --- Total Average: {}".format(block_id, average))
-                logger.info("Total Active Account # {}".format(total_active))
-                logger.info("Total Inactive Accounts #{}".format(total_accounts - total_active))
+                logger.info("Block#{} --- Total Average (DOT): {}".format(
+                    block_id, stats[block_id].average / 10 ** TOKEN_DECIMALS))
+                logger.info("Total Active Account # {}".format(stats[block_id].total_active))
+                logger.info("Total Inactive Accounts #{}".format(stats[block_id].total_accounts -
+                                                                 stats[block_id].total_active))
 
         logger.info("Block Processing Total Execution Time (seconds): {}".format(timer() - start))
         print("End of Execution....")
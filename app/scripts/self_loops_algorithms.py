@@ -21,6 +21,7 @@ from logging.handlers import RotatingFileHandler
 
 import csv
 from data import Block
+from app.scripts.account_flow import account_flow_totals
 import datetime
 
 from pandas import *
@@ -92,7 +93,7 @@ self_loops_sql = (
     "block b "
     "join extrinsic e on e.block_id = b.id "
     "where e.module_id = '{0}' and e.success = 1 and b.timestamp between {1} and {2} "
-    "and e.from_address = '{3}' and e.to_address = e.from_address;"
+    "and e.from_address_id = (select id from address where address = '{3}') and e.to_address_id = e.from_address_id;"
 )
 
 zero_dots_sql = (
@@ -100,7 +101,7 @@ zero_dots_sql = (
     "e.fee as fee from block b "
     "join extrinsic e on e.block_id = b.id "
     "where e.module_id = '{0}' and e.success = 1 and b.timestamp between {1} and {2} "
-    "and e.from_address = '{3}' and e.value = 0;"
+    "and e.from_address_id = (select id from address where address = '{3}') and e.value = 0;"
 )
 
 incoming_txns_sql = (
@@ -108,7 +109,7 @@ incoming_txns_sql = (
     "e.value as value, e.fee as fee from block b "
     "join extrinsic e on e.block_id = b.id "
     "where e.module_id = '{0}' and e.success = 1 and b.timestamp between {1} and {2} "
-    "and e.to_address = '{3}';"
+    "and e.to_address_id = (select id from address where address = '{3}');"
 )
 
 outgoing_txns_sql = (
@@ -116,19 +117,9 @@ outgoing_txns_sql = (
     "e.value as value, e.fee as fee from block b "
     "join extrinsic e on e.block_id = b.id "
     "where e.module_id = '{0}' and e.success = 1 and b.timestamp between {1} and {2} "
-    "and e.from_address = '{3}';"
+    "and e.from_address_id = (select id from address where address = '{3}');"
 )
 
-sql2 = (
-    "SELECT :address as address, SUM(IF(to_address = :address, 1, 0)) AS incoming_count, "
-    "SUM(IF(to_address = :address, value, 0)) AS incoming_sum, "
-    "SUM(IF(from_address = :address, 1, 0)) AS outgoing_count, "
-    "SUM(IF(from_address = :address, value, 0)) AS outgoing_sum"
-    " FROM extrinsic"
-    " where module_id = 'Balances' and success = 1;"
-)
-
-
 def account_totals(start_date, end_date, address):
     if start_date == 0:
         first_block = db_session.query(Block).filter_by(id=1205128).first()
@@ -205,11 +196,13 @@ if __name__ == '__main__':
 
         with open('distinct_self_loops_account_totals.csv', 'a', newline='') as outfile:
             outcsv = csv.writer(outfile)
+            # incoming/outgoing count and sum per address from the account_flow rollup
+            totals = account_flow_totals(db_session, address_list)
             for address in address_list:
-                result = db_session.execute(text(sql2), {"address": address}).fetchall()
+                result = [address, totals[address]['incoming_count'], totals[address]['incoming_sum'],
+                          totals[address]['outgoing_count'], totals[address]['outgoing_sum']]
                 logger.info("Printing Line: {}".format(result))
-                # outcsv.writerow(result.keys())
-                outcsv.writerows(result)
+                outcsv.writerow(result)
 
     except Exception as err:
         db_session.remove()  # close db connection
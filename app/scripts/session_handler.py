@@ -22,8 +22,9 @@ from substrateinterface import SubstrateInterface
 
 from substrateinterface.exceptions import StorageFunctionNotFound
 
-# from models.data import Event
+from app.models.data import Event
 from app.models.session import Session, SessionValidator, SessionNominator
+from app.scripts.stake_analytics import update_stake_metrics
 
 DB_NAME = "polkadot_analysis"
 DB_HOST = "localhost"
@@ -53,6 +54,97 @@ INTERNAL_URL = "ws://172.20.23.176:9944"
 # INTERNAL_URL = "ws://localhost:9944"
 DEFAULT_URL = "ws://192.168.3.38:9999"
 
+# expected number of blocks per session on Polkadot (4 hours of 6 second blocks)
+SESSION_LENGTH = 2400
+
+
+def get_session_index(attributes):
+    # handle post-7229130 changes to event attributes
+    if type(attributes) is list:
+        return attributes[0]['value'] if type(attributes[0]) is dict else attributes[0]
+    return attributes
+
+
+def get_session_blocks_from_events(first_block, last_block):
+    # Session.NewSession events already ingested by main.py, ordered by block
+    new_session_list = Event.query(db_session).filter(Event.module_id == 'Session',
+                                                      Event.event_id == 'NewSession',
+                                                      Event.block_id.between(first_block, last_block)) \
+        .order_by(Event.block_id.asc()).all()
+    return [(session_event.block_id, get_session_index(session_event.attributes))
+            for session_event in new_session_list]
+
+
+def get_current_session_index(substrate, block_id):
+    current_index = substrate.query(module="Session", storage_function="CurrentIndex",
+                                    block_hash=substrate.get_block_hash(block_id))
+    return current_index.value
+
+
+def find_session_block(substrate, session_id, low, high):
+    # binary search for the first block in [low, high] whose Session.CurrentIndex reached session_id,
+    # i.e. the block emitting the Session.NewSession event
+    while low < high:
+        middle = (low + high) // 2
+        if get_current_session_index(substrate, middle) >= session_id:
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+def get_session_blocks_from_storage(substrate, first_block, last_block):
+    # fallback for block ranges missing from the event table: O(log n) storage queries per session boundary
+    # instead of get_block + get_events on every single block
+    session_blocks = []
+    if first_block > last_block:
+        return session_blocks
+
+    # start from the parent block so that a session starting at first_block is also found
+    low = first_block - 1
+    session_id = get_current_session_index(substrate, low)
+    last_session_id = get_current_session_index(substrate, last_block)
+    while session_id < last_session_id:
+        session_id += 1
+        # sessions have a fixed length, so the next boundary is usually within the next two sessions
+        high = min(low + 2 * SESSION_LENGTH, last_block)
+        if get_current_session_index(substrate, high) < session_id:
+            high = last_block
+        low = find_session_block(substrate, session_id, low + 1, high)
+        session_blocks.append((low, session_id))
+    return session_blocks
+
+
+def get_missing_session_blocks(substrate, first_block, last_block):
+    storage_blocks = get_session_blocks_from_storage(substrate, first_block, last_block)
+    logger.info("Found {} sessions from storage between blocks {} and {}".format(
+        len(storage_blocks), first_block, last_block))
+    return storage_blocks
+
+
+def get_session_blocks(substrate, first_block, last_block):
+    # use the ingested events and query storage for the sessions they miss: ingestion can leave holes (failed
+    # blocks are skipped, replay workers finish out of order), so the event sessions are only trusted while their
+    # indexes are consecutive, and every jump is searched in storage between the neighbouring session blocks
+    event_blocks = get_session_blocks_from_events(first_block, last_block)
+    logger.info("Found {} sessions in event table until block {}".format(len(event_blocks), last_block))
+
+    session_blocks = []
+    previous_block = first_block - 1
+    previous_session = get_current_session_index(substrate, previous_block)
+    for block_id, session_id in event_blocks:
+        if session_id > previous_session + 1:
+            session_blocks += get_missing_session_blocks(substrate, previous_block + 1, block_id - 1)
+        session_blocks.append((block_id, session_id))
+        previous_block, previous_session = block_id, session_id
+
+    # sessions after the last ingested one, e.g. blocks not ingested yet
+    if get_current_session_index(substrate, last_block) > previous_session:
+        session_blocks += get_missing_session_blocks(substrate, previous_block + 1, last_block)
+
+    return session_blocks
+
+
 # Main
 if __name__ == '__main__':
     try:
@@ -88,35 +180,21 @@ if __name__ == '__main__':
                 # last_session_block = 9726401
                 last_session_block = substrate.get_block_number(substrate.get_chain_head())
 
-                # new_session_list = Event.query(db_session).filter_by(module_id="Session", event_id="NewSession").all()
-                # for rank_event, session_event in enumerate(new_session_list):
-                for block_id in range(first_session_block, last_session_block):
-                    # block_id = session_event.block_id
-                    # block_hash = substrate.get_block_hash(session_event.block_id)
-                    # attributes = session_id
-                    session_id = None
-                    block = substrate.get_block(block_number=block_id)
-                    block_hash = block['header']['hash']
-                    block_events = substrate.get_events(block_hash=block_hash)
-
-                    for event in block_events:
-                        if event.value['module_id'] == 'Session' and event.value['event_id'] == 'NewSession':
-                            attributes = event.value['attributes']
-                            if type(attributes) is list:
-                                session_id = attributes[0]['value']
-                            else:
-                                session_id = attributes
-                        else:
-                            continue
+                session_blocks = get_session_blocks(substrate, first_session_block, last_session_block)
 
-                    if session_id and Session.query(db_session).filter_by(id=session_id).count() > 0:
+                for rank_event, (block_id, session_id) in enumerate(session_blocks):
+                    if Session.query(db_session).filter_by(id=session_id).count() > 0:
                         logger.info("Session {} already added".format(session_id))
                         continue
 
-                    if not session_id:
-                        continue
+                    block_hash = substrate.get_block_hash(block_id)
+
+                    # the session ends with the block emitting the next Session.NewSession event
+                    if rank_event + 1 < len(session_blocks):
+                        end_at_block = session_blocks[rank_event + 1][0]
+                    else:
+                        end_at_block = block_id + SESSION_LENGTH
 
-                    token_decimals = substrate.token_decimals if block_id >= 1248328 else 12
                     nominators = []
                     logger.info("Processing Session Id {}, Block Id {}".format(session_id, block_id))
 
@@ -196,7 +274,7 @@ if __name__ == '__main__':
                             exposure = {}
 
                         if exposure['total']:
-                            bonded_nominators = (exposure['total'] - exposure['own']) / 10 ** token_decimals
+                            bonded_nominators = exposure['total'] - exposure['own']
                         else:
                             bonded_nominators = None
 
@@ -216,10 +294,9 @@ if __name__ == '__main__':
                             session_id=session_id,
                             controller_key=validator_controller,
                             stash_key=validator_stash,
-                            bonded_total=exposure.get('total') / 10 ** token_decimals,
-                            bonded_active=validator_ledger[
-                                              'active'] / 10 ** token_decimals if validator_ledger else None,
-                            bonded_own=exposure['own'] / 10 ** token_decimals,
+                            bonded_total=exposure.get('total'),
+                            bonded_active=validator_ledger['active'] if validator_ledger else None,
+                            bonded_own=exposure['own'],
                             bonded_nominators=bonded_nominators,  # value bonded by nominators
                             # validator_session=validator_session, # session key
                             rank=rank_nr,
@@ -240,7 +317,7 @@ if __name__ == '__main__':
                                 rank_validator=rank_nr,
                                 rank_nominator=rank_nominator,
                                 stash_key=nominator_stash,
-                                bonded=nominator_info.get('value') / 10 ** token_decimals,
+                                bonded=nominator_info.get('value'),
                             )
                             session_nominator.save(db_session)
 
@@ -249,7 +326,7 @@ if __name__ == '__main__':
                         id=session_id,
                         start_at_block=block_id + 1,
                         created_at_block=block_id,
-                        end_at_block=block_id + 2400,
+                        end_at_block=end_at_block,
                         created_at_event=1,
                         count_validators=len(validators),
                         count_nominators=len(set(nominators)),  # set of unique nominators
@@ -270,6 +347,9 @@ if __name__ == '__main__':
                 db_session.rollback()
                 logger.error(traceback.format_exc())
 
+        # stake metrics of the sessions crawled by this run
+        update_stake_metrics(engine)
+
         logger.info("Block Processing Total Execution Time (seconds): {}".format(timer() - start))
         print("End of Execution....")
 
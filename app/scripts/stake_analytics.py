@@ -0,0 +1,226 @@
+"""
+stake_analytics.py
+
+Stake concentration of every session from the session_validator and session_nominator tables: Nakamoto
+coefficients, stake Gini, nominator overlap between validators and commission distribution, persisted in the
+stake_concentration table.
+
+GNU General Public License Version 3
+"""
+
+import logging
+import sys
+import traceback
+from timeit import default_timer as timer
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.sql import text
+
+logger = logging.getLogger(__name__)
+
+# sessions loaded and computed per chunk
+SESSION_CHUNK_SIZE = 100
+
+# shares of the total stake for the Nakamoto coefficients: minimum number of validators holding more than the share
+NAKAMOTO_THRESHOLDS = {'nakamoto_33': 1 / 3, 'nakamoto_50': 1 / 2}
+
+# commission stored in percent by session_handler.py
+FULL_COMMISSION = 100
+
+STAKE_COLUMNS = ['validator_count', 'stake_total', 'stake_min', 'stake_max', 'stake_gini'] + \
+                list(NAKAMOTO_THRESHOLDS) + \
+                ['own_stake_share', 'commission_mean', 'commission_median', 'commission_zero_share',
+                 'commission_full_share', 'nominator_count', 'nominator_exposures', 'multi_validator_nominator_share',
+                 'validator_pair_overlap', 'mean_pair_jaccard']
+
+validators_sql = (
+    "SELECT session_id, bonded_total, bonded_own, commission FROM session_validator"
+    " WHERE session_id BETWEEN :first_session AND :last_session"
+)
+
+nominators_sql = (
+    "SELECT session_id, rank_validator, stash_key FROM session_nominator"
+    " WHERE session_id BETWEEN :first_session AND :last_session ORDER BY session_id"
+)
+
+insert_stake_sql = (
+    "INSERT INTO stake_concentration (session_id, {columns}) VALUES (:session_id, {values})"
+    " ON DUPLICATE KEY UPDATE {updates}"
+).format(columns=", ".join(STAKE_COLUMNS),
+         values=", ".join(":" + column for column in STAKE_COLUMNS),
+         updates=", ".join("{0} = VALUES({0})".format(column) for column in STAKE_COLUMNS))
+
+
+def group_starts(keys):
+    # index of the first row of each group of a sorted key array
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+
+def load_columns(conn, query, params, columns):
+    # {column: array} of a result set
+    rows = conn.execute(text(query), params).fetchall()
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    return {column: np.array(column_values) for column, column_values in zip(columns, values)}
+
+
+def validator_metrics(session_ids, stakes, own, commission):
+    """Return {session_id: {column: value}} of the validator stake and commission columns.
+
+    Every metric is computed for all sessions of the chunk at once, with np.add.reduceat over the rows sorted by
+    session and stake.
+    """
+    order = np.lexsort((stakes, session_ids))
+    session_ids, stakes, own = session_ids[order], stakes[order], own[order]
+    starts = group_starts(session_ids)
+    counts = np.diff(np.r_[starts, len(session_ids)])
+    group = np.repeat(np.arange(len(starts)), counts)
+
+    totals = np.add.reduceat(stakes, starts)
+    safe_totals = np.where(totals > 0, totals, 1)
+    # G = 2 * sum(i * x_i) / (n * sum(x)) - (n + 1) / n with x sorted ascending and i = 1..n within the session
+    ranks = np.arange(len(stakes)) - starts[group] + 1
+    gini = 2 * np.add.reduceat(ranks * stakes, starts) / (counts * safe_totals) - (counts + 1) / counts
+
+    # ascending cumulative stake within the session: the richest validators hold the total minus the others
+    cumulative = np.cumsum(stakes) - np.repeat(np.cumsum(totals) - totals, counts)
+    nakamoto = {column: counts - np.add.reduceat(cumulative < (1 - threshold) * totals[group], starts)
+                for column, threshold in NAKAMOTO_THRESHOLDS.items()}
+
+    sorted_commission = commission[order]
+    sorted_commission = sorted_commission[np.lexsort((sorted_commission, session_ids))]
+    columns = dict(
+        validator_count=counts,
+        stake_total=totals,
+        stake_min=stakes[starts],
+        stake_max=stakes[starts + counts - 1],
+        stake_gini=gini,
+        own_stake_share=np.add.reduceat(own, starts) / safe_totals,
+        commission_mean=np.add.reduceat(sorted_commission, starts) / counts,
+        commission_median=(sorted_commission[starts + (counts - 1) // 2] + sorted_commission[starts + counts // 2]) / 2,
+        commission_zero_share=np.add.reduceat(sorted_commission == 0, starts) / counts,
+        commission_full_share=np.add.reduceat(sorted_commission >= FULL_COMMISSION, starts) / counts,
+        **nakamoto)
+
+    metrics = {}
+    for idx, session_id in enumerate(session_ids[starts]):
+        session_metrics = {column: values[idx].item() for column, values in columns.items()}
+        for column in ['validator_count', 'stake_total', 'stake_min', 'stake_max'] + list(NAKAMOTO_THRESHOLDS):
+            session_metrics[column] = int(round(session_metrics[column]))
+        if totals[idx] == 0:
+            session_metrics.update(stake_gini=None, own_stake_share=None)
+        metrics[int(session_id)] = session_metrics
+    return metrics
+
+
+def nominator_overlap(validator_count, rank_validators, nominator_ids):
+    """Return the nominator overlap columns of a session.
+
+    The validator x nominator incidence matrix B gives the number of nominators shared by every pair of validators
+    as B @ B.T in a single matrix product.
+    """
+    nominators, nominator_idx = np.unique(nominator_ids, return_inverse=True)
+    incidence = np.zeros((max(validator_count, int(rank_validators.max()) + 1), len(nominators)), dtype=np.float32)
+    incidence[rank_validators, nominator_idx] = 1
+
+    validators_per_nominator = incidence.sum(axis=0)
+    shared = incidence @ incidence.T
+    degrees = np.diag(shared)
+    pairs = np.triu_indices(len(degrees), k=1)
+    shared_pairs = shared[pairs]
+    union = degrees[pairs[0]] + degrees[pairs[1]] - shared_pairs
+    jaccard = np.divide(shared_pairs, union, out=np.zeros_like(shared_pairs), where=union > 0)
+
+    return dict(
+        nominator_count=len(nominators),
+        nominator_exposures=len(nominator_ids),
+        multi_validator_nominator_share=float(np.mean(validators_per_nominator > 1)),
+        validator_pair_overlap=float(np.mean(shared_pairs > 0)) if len(shared_pairs) else None,
+        mean_pair_jaccard=float(np.mean(jaccard)) if len(jaccard) else None)
+
+
+def stake_metrics(conn, first_session, last_session):
+    # {session_id: {column: value}} of the sessions with validators in [first_session, last_session]
+    params = {"first_session": first_session, "last_session": last_session}
+    validators = load_columns(conn, validators_sql, params, ['session_id', 'bonded_total', 'bonded_own', 'commission'])
+    if not len(validators['session_id']):
+        return {}
+
+    metrics = validator_metrics(
+        validators['session_id'].astype(np.int64),
+        np.array([value or 0 for value in validators['bonded_total']], dtype=np.float64),
+        np.array([value or 0 for value in validators['bonded_own']], dtype=np.float64),
+        np.array([float(value or 0) for value in validators['commission']], dtype=np.float64))
+    # exact planck total, minimum and maximum, the float64 values above are only used for the ratios
+    stakes = {}
+    for session_id, bonded_total in zip(validators['session_id'], validators['bonded_total']):
+        stakes.setdefault(int(session_id), []).append(int(bonded_total or 0))
+    for session_id, session_stakes in stakes.items():
+        metrics[session_id].update(stake_total=sum(session_stakes), stake_min=min(session_stakes),
+                                   stake_max=max(session_stakes))
+
+    nominators = load_columns(conn, nominators_sql, params, ['session_id', 'rank_validator', 'stash_key'])
+    empty = dict.fromkeys(['nominator_count', 'nominator_exposures', 'multi_validator_nominator_share',
+                           'validator_pair_overlap', 'mean_pair_jaccard'])
+    for session_metrics in metrics.values():
+        session_metrics.update(empty)
+
+    if len(nominators['session_id']):
+        session_ids = nominators['session_id'].astype(np.int64)
+        # integer ids of the nominator stashes of the chunk
+        nominator_ids = np.unique(nominators['stash_key'].astype(str), return_inverse=True)[1]
+        rank_validators = nominators['rank_validator'].astype(np.int64)
+        starts = group_starts(session_ids)
+        for start, end in zip(starts, np.r_[starts[1:], len(session_ids)]):
+            session_id = int(session_ids[start])
+            if session_id in metrics:
+                metrics[session_id].update(nominator_overlap(metrics[session_id]['validator_count'],
+                                                             rank_validators[start:end], nominator_ids[start:end]))
+    return metrics
+
+
+def update_stake_metrics(engine, first_session=None, last_session=None):
+    """Compute and persist the metrics of the sessions [first_session, last_session] in chunks.
+
+    By default, the sessions crawled since the last update: from the session after the last one of
+    stake_concentration to the last one of session_validator.
+    """
+    with engine.connect() as conn:
+        if first_session is None:
+            first_session = (conn.execute(text("SELECT MAX(session_id) FROM stake_concentration")).scalar() or -1) + 1
+        if last_session is None:
+            last_session = conn.execute(text("SELECT MAX(session_id) FROM session_validator")).scalar()
+    if last_session is None or first_session > last_session:
+        logger.info("No new sessions")
+        return
+
+    for chunk in range(first_session, last_session + 1, SESSION_CHUNK_SIZE):
+        chunk_last = min(chunk + SESSION_CHUNK_SIZE - 1, last_session)
+        with engine.begin() as conn:
+            metrics = stake_metrics(conn, chunk, chunk_last)
+            if metrics:
+                conn.execute(text(insert_stake_sql), [dict(session_metrics, session_id=session_id)
+                                                      for session_id, session_metrics in metrics.items()])
+        logger.info("Stake metrics of {} sessions until session {}".format(len(metrics), chunk_last))
+
+
+# Main
+if __name__ == '__main__':
+    # stake_analytics.py [first session] [last session], new sessions only by default
+    from app.settings import DB_CONNECTION
+
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stdout)],
+                        format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+                        datefmt='%Y-%m-%dT%H:%M:%S', )
+
+    try:
+        start = timer()
+        engine = create_engine(DB_CONNECTION, isolation_level="READ_UNCOMMITTED", pool_pre_ping=True)
+
+        update_stake_metrics(engine, int(sys.argv[1]) if len(sys.argv) > 1 else None,
+                             int(sys.argv[2]) if len(sys.argv) > 2 else None)
+
+        logger.info("Stake Analytics Total Execution Time (seconds): {}".format(timer() - start))
+
+    except Exception as err:
+        logger.error(traceback.format_exc())
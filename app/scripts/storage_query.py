@@ -0,0 +1,68 @@
+"""
+storage_query.py
+
+Batched storage queries against the substrate API.
+
+GNU General Public License Version 3
+"""
+
+from substrateinterface.exceptions import StorageFunctionNotFound, SubstrateRequestException
+
+# number of storage keys sent in a single state_queryStorageAt request
+QUERY_MULTI_PAGE_SIZE = 500
+
+
+def query_multi(substrate, module, storage_function, params_list, block_hash):
+    """Query a storage map for many keys at once.
+
+    Same result as calling `substrate.query(module, storage_function, params, block_hash)` for each entry of
+    `params_list`, but the storage keys are sent to the node in pages of QUERY_MULTI_PAGE_SIZE keys per
+    `state_queryStorageAt` request. Returns the decoded values in the order of `params_list`, None for keys
+    without a stored value.
+    """
+    substrate.init_runtime(block_hash=block_hash)
+
+    metadata_module = substrate.get_metadata_module(module, block_hash=block_hash)
+    storage_item = substrate.get_metadata_storage_function(module, storage_function, block_hash=block_hash)
+
+    if not metadata_module or not storage_item:
+        raise StorageFunctionNotFound('Storage function "{}.{}" not found'.format(module, storage_function))
+
+    value_type = storage_item.get_value_type_string()
+    param_types = storage_item.get_params_type_string()
+    hashers = storage_item.get_param_hashers()
+
+    storage_keys = []
+    for params in params_list:
+        encoded_params = []
+        for idx, param in enumerate(params):
+            param = substrate.convert_storage_parameter(param_types[idx], param)
+            param_obj = substrate.runtime_config.create_scale_object(type_string=param_types[idx])
+            encoded_params.append(param_obj.encode(param))
+
+        storage_keys.append(substrate.generate_storage_hash(
+            storage_module=metadata_module.value['storage']['prefix'],
+            storage_function=storage_function,
+            params=encoded_params,
+            hashers=hashers
+        ))
+
+    changes = {}
+    for page in range(0, len(storage_keys), QUERY_MULTI_PAGE_SIZE):
+        response = substrate.rpc_request("state_queryStorageAt",
+                                         [storage_keys[page:page + QUERY_MULTI_PAGE_SIZE], block_hash])
+        if 'error' in response:
+            raise SubstrateRequestException(response['error']['message'])
+
+        for result_group in response['result']:
+            for storage_key, data in result_group['changes']:
+                changes[storage_key] = data
+
+    results = []
+    for storage_key in storage_keys:
+        data = changes.get(storage_key)
+        if data is None:
+            results.append(None)
+        else:
+            results.append(substrate.decode_scale(type_string=value_type, scale_bytes=data, block_hash=block_hash))
+    return results
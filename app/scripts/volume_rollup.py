@@ -0,0 +1,262 @@
+"""
+volume_rollup.py
+
+Transaction volume rollups per block, hour and day (volume_block, volume_hour and volume_day tables), maintained
+during ingestion.
+
+GNU General Public License Version 3
+"""
+
+import logging
+import sys
+import traceback
+from datetime import timedelta
+from timeit import default_timer as timer
+
+from sqlalchemy import create_engine
+from sqlalchemy.sql import text
+
+from app.scripts.account_flow import FLOW_BUCKET_BLOCKS, transfer_filter
+
+logger = logging.getLogger(__name__)
+
+# additive columns, the hour and day rows are the sums of their block rows
+VOLUME_COLUMNS = ['transfer_count', 'transfer_sum', 'fee_sum', 'signed_count', 'accounts_new', 'accounts_reaped']
+
+# distinct accounts of the transfers, counted from the active_account_hour rows for hours and days
+ACTIVE_COLUMNS = ['sender_count', 'receiver_count', 'active_count']
+
+# role of an account in the transfers of an active_account_hour row
+SENDER = 0
+RECEIVER = 1
+
+insert_block_volume_sql = (
+    "INSERT INTO volume_block (block_id, datetime, {columns}) VALUES (:block_id, :datetime, {values})"
+    " ON DUPLICATE KEY UPDATE datetime = VALUES(datetime), {updates}"
+).format(columns=", ".join(VOLUME_COLUMNS + ACTIVE_COLUMNS),
+         values=", ".join(":" + column for column in VOLUME_COLUMNS + ACTIVE_COLUMNS),
+         updates=", ".join("{0} = VALUES({0})".format(column) for column in VOLUME_COLUMNS + ACTIVE_COLUMNS))
+
+insert_active_account_sql = (
+    "INSERT IGNORE INTO active_account_hour (hour, role, address_id) VALUES (:hour, :role, :address_id)"
+)
+
+# distinct senders, receivers and both of the active_account_hour rows in [:first_hour, :next_hour)
+active_counts_sql = (
+    "(SELECT COUNT(DISTINCT address_id) FROM active_account_hour"
+    " WHERE hour >= :{first} AND hour < :{next} AND role = {sender}),"
+    " (SELECT COUNT(DISTINCT address_id) FROM active_account_hour"
+    " WHERE hour >= :{first} AND hour < :{next} AND role = {receiver}),"
+    " (SELECT COUNT(DISTINCT address_id) FROM active_account_hour WHERE hour >= :{first} AND hour < :{next})"
+)
+
+refresh_hour_sql = (
+    "INSERT INTO volume_hour (hour, {columns}) SELECT :hour, {sums}, {active} FROM volume_block"
+    " WHERE datetime >= :hour AND datetime < :next_hour"
+    " ON DUPLICATE KEY UPDATE {updates}"
+).format(columns=", ".join(VOLUME_COLUMNS + ACTIVE_COLUMNS),
+         sums=", ".join("COALESCE(SUM({0}), 0)".format(column) for column in VOLUME_COLUMNS),
+         active=active_counts_sql.format(first='hour', next='next_hour', sender=SENDER, receiver=RECEIVER),
+         updates=", ".join("{0} = VALUES({0})".format(column) for column in VOLUME_COLUMNS + ACTIVE_COLUMNS))
+
+refresh_day_sql = (
+    "INSERT INTO volume_day (day, {columns}) SELECT :day, {sums}, {active} FROM volume_hour"
+    " WHERE hour >= :day AND hour < :next_day"
+    " ON DUPLICATE KEY UPDATE {updates}"
+).format(columns=", ".join(VOLUME_COLUMNS + ACTIVE_COLUMNS),
+         sums=", ".join("COALESCE(SUM({0}), 0)".format(column) for column in VOLUME_COLUMNS),
+         active=active_counts_sql.format(first='day', next='next_day', sender=SENDER, receiver=RECEIVER),
+         updates=", ".join("{0} = VALUES({0})".format(column) for column in VOLUME_COLUMNS + ACTIVE_COLUMNS))
+
+# block rows recomputed from the ingested tables, for blocks ingested before the rollups existed
+rebuild_block_volume_sql = (
+    "INSERT INTO volume_block (block_id, datetime, {columns})"
+    " SELECT b.id, b.datetime, COALESCE(t.transfer_count, 0), COALESCE(t.transfer_sum, 0), COALESCE(f.fee_sum, 0),"
+    " b.count_extrinsics_signed, b.count_accounts_new, b.count_accounts_reaped, COALESCE(t.sender_count, 0),"
+    " COALESCE(t.receiver_count, 0), COALESCE(a.active_count, 0)"
+    " FROM block b"
+    " LEFT JOIN (SELECT e.block_id, COUNT(*) AS transfer_count, SUM(COALESCE(e.value, 0)) AS transfer_sum,"
+    " COUNT(DISTINCT e.from_address_id) AS sender_count, COUNT(DISTINCT e.to_address_id) AS receiver_count"
+    " FROM extrinsic e WHERE {filter} AND e.block_id BETWEEN :first_block AND :last_block GROUP BY e.block_id) t"
+    " ON t.block_id = b.id"
+    " LEFT JOIN (SELECT e.block_id, SUM(e.fee) AS fee_sum FROM extrinsic e"
+    " WHERE e.block_id BETWEEN :first_block AND :last_block AND e.fee IS NOT NULL GROUP BY e.block_id) f"
+    " ON f.block_id = b.id"
+    " LEFT JOIN (SELECT block_id, COUNT(DISTINCT address_id) AS active_count FROM ("
+    "SELECT e.block_id, e.from_address_id AS address_id FROM extrinsic e"
+    " WHERE {filter} AND e.block_id BETWEEN :first_block AND :last_block"
+    " UNION ALL "
+    "SELECT e.block_id, e.to_address_id FROM extrinsic e"
+    " WHERE {filter} AND e.block_id BETWEEN :first_block AND :last_block) p GROUP BY block_id) a"
+    " ON a.block_id = b.id"
+    " WHERE b.id BETWEEN :first_block AND :last_block"
+    " ON DUPLICATE KEY UPDATE datetime = VALUES(datetime), {updates}"
+).format(columns=", ".join(VOLUME_COLUMNS + ACTIVE_COLUMNS), filter=transfer_filter,
+         updates=", ".join("{0} = VALUES({0})".format(column) for column in VOLUME_COLUMNS + ACTIVE_COLUMNS))
+
+rebuild_active_account_sql = (
+    "INSERT IGNORE INTO active_account_hour (hour, role, address_id)"
+    " SELECT DISTINCT DATE_ADD(DATE(e.datetime), INTERVAL HOUR(e.datetime) HOUR), {sender}, e.from_address_id"
+    " FROM extrinsic e WHERE {filter} AND e.block_id BETWEEN :first_block AND :last_block"
+    " AND e.datetime IS NOT NULL"
+    " UNION "
+    "SELECT DISTINCT DATE_ADD(DATE(e.datetime), INTERVAL HOUR(e.datetime) HOUR), {receiver}, e.to_address_id"
+    " FROM extrinsic e WHERE {filter} AND e.block_id BETWEEN :first_block AND :last_block"
+    " AND e.datetime IS NOT NULL"
+).format(filter=transfer_filter, sender=SENDER, receiver=RECEIVER)
+
+block_datetimes_sql = (
+    "SELECT MIN(datetime) AS first_datetime, MAX(datetime) AS last_datetime FROM block"
+    " WHERE id BETWEEN :first_block AND :last_block"
+)
+
+
+def is_transfer(txn):
+    # successful balance transfer, as selected by account_flow.transfer_filter
+    return txn['module_id'] == 'Balances' and txn['success'] and txn['from_address_id'] is not None \
+        and txn['to_address_id'] is not None
+
+
+def get_hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def volume_rows(decoded_blocks):
+    # ([volume_block rows], {(hour, role, address_id)}) of decoded blocks whose extrinsics have address ids
+    block_rows = []
+    active = set()
+    for decoded_block in decoded_blocks:
+        block = decoded_block['block']
+        transfers = [txn for txn in decoded_block['extrinsics'] if is_transfer(txn)]
+        senders = {txn['from_address_id'] for txn in transfers}
+        receivers = {txn['to_address_id'] for txn in transfers}
+        block_rows.append(dict(
+            block_id=block['id'],
+            datetime=block['datetime'],
+            transfer_count=len(transfers),
+            transfer_sum=sum(txn['value'] or 0 for txn in transfers),
+            fee_sum=sum(txn['fee'] or 0 for txn in decoded_block['extrinsics']),
+            signed_count=block['count_extrinsics_signed'],
+            accounts_new=block['count_accounts_new'],
+            accounts_reaped=block['count_accounts_reaped'],
+            sender_count=len(senders),
+            receiver_count=len(receivers),
+            active_count=len(senders | receivers)))
+
+        if block['datetime'] is not None:
+            hour = get_hour(block['datetime'])
+            active.update((hour, SENDER, address_id) for address_id in senders)
+            active.update((hour, RECEIVER, address_id) for address_id in receivers)
+    return block_rows, active
+
+
+def refresh_periods(session, hours, days=None):
+    # recompute the hour rows, then the day rows (by default those of the hours), from the block and
+    # active_account_hour rows
+    hours = sorted(set(hours))
+    days = sorted({hour.replace(hour=0) for hour in hours} if days is None else set(days))
+    if hours:
+        session.execute(text(refresh_hour_sql), [{"hour": hour, "next_hour": hour + timedelta(hours=1)}
+                                                 for hour in hours])
+    if days:
+        session.execute(text(refresh_day_sql), [{"day": day, "next_day": day + timedelta(days=1)} for day in days])
+
+
+def update_volume_rollups(session, decoded_blocks):
+    """Incremental maintenance of the block rows, executed in the same db transaction as the ingested blocks.
+
+    The hour and day rows are recomputed from the block rows by VolumePeriods, so re-ingesting a block does not
+    count it twice.
+    """
+    block_rows, active = volume_rows(decoded_blocks)
+    if not block_rows:
+        return
+    session.execute(text(insert_block_volume_sql), block_rows)
+    if active:
+        session.execute(text(insert_active_account_sql), [dict(hour=hour, role=role, address_id=address_id)
+                                                          for hour, role, address_id in active])
+
+
+class VolumePeriods:
+    """Hours and days of the ingested blocks whose volume_hour and volume_day rows are not recomputed yet.
+
+    The distinct account counts of a period scan all its active_account_hour rows, so the rows of an hour (a day)
+    are recomputed once, when a block of a later hour (day) is committed, and at the end of a run (flush),
+    instead of with every write batch. Each refresh runs in a transaction of its own. The periods pending when a
+    run is interrupted are recomputed by volume_rollup.py.
+    """
+
+    def __init__(self):
+        self.hours = set()
+        self.days = set()
+
+    def add_blocks(self, session, decoded_blocks):
+        hours = {get_hour(decoded_block['block']['datetime']) for decoded_block in decoded_blocks
+                 if decoded_block['block']['datetime'] is not None}
+        if not hours:
+            return
+        self.hours.update(hours)
+        self.days.update(hour.replace(hour=0) for hour in hours)
+        latest = max(self.hours)
+        self.refresh(session, [hour for hour in self.hours if hour < latest],
+                     [day for day in self.days if day < latest.replace(hour=0)])
+
+    def flush(self, session):
+        self.refresh(session, list(self.hours), list(self.days))
+
+    def refresh(self, session, hours, days):
+        if hours or days:
+            with session.get_bind().begin() as conn:
+                refresh_periods(conn, hours, days)
+        self.hours.difference_update(hours)
+        self.days.difference_update(days)
+
+
+def rebuild_volume_rollups(conn, first_block, last_block):
+    # recompute the rollups of [first_block, last_block] from the block and extrinsic tables
+    params = {"first_block": first_block, "last_block": last_block}
+    conn.execute(text(rebuild_block_volume_sql), params)
+    conn.execute(text(rebuild_active_account_sql), params)
+    row = conn.execute(text(block_datetimes_sql), params).fetchone()
+    if row.first_datetime is None:
+        return
+    hour = get_hour(row.first_datetime)
+    hours = []
+    while hour <= row.last_datetime:
+        hours.append(hour)
+        hour += timedelta(hours=1)
+    refresh_periods(conn, hours)
+
+
+# Main
+if __name__ == '__main__':
+    # backfill the rollups for blocks ingested before the tables existed: volume_rollup.py [first block] [last block]
+    # (address ids of the extrinsic table are backfilled first by address_dictionary.py)
+    from app.settings import DB_CONNECTION
+
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stdout)],
+                        format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+                        datefmt='%Y-%m-%dT%H:%M:%S', )
+
+    try:
+        start = timer()
+        engine = create_engine(DB_CONNECTION, isolation_level="READ_UNCOMMITTED", pool_pre_ping=True)
+
+        first_block = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+        last_block = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+        if last_block is None:
+            with engine.connect() as conn:
+                last_block = conn.execute(text("SELECT MAX(id) FROM block")).scalar() or 0
+
+        # one transaction per day of blocks to keep transactions small
+        step = FLOW_BUCKET_BLOCKS
+        for block_id in range(first_block, last_block + 1, step):
+            with engine.begin() as conn:
+                rebuild_volume_rollups(conn, block_id, min(block_id + step - 1, last_block))
+            logger.info("Rebuilt volume rollups until block {}".format(min(block_id + step - 1, last_block)))
+
+        logger.info("Volume Rollup Total Execution Time (seconds): {}".format(timer() - start))
+
+    except Exception as err:
+        logger.error(traceback.format_exc())
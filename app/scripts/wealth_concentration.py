@@ -0,0 +1,195 @@
+"""
+wealth_concentration.py
+
+Wealth concentration of the account balances per snapshot: Gini coefficient, Lorenz curve, Nakamoto coefficients
+and top-k shares, persisted in the wealth_concentration and lorenz_point tables.
+
+GNU General Public License Version 3
+"""
+
+import logging
+import sys
+import traceback
+from collections import defaultdict
+from timeit import default_timer as timer
+
+import matplotlib.pyplot as plt
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.sql import bindparam, text
+
+from app.scripts.balance_engine import balances_as_of
+
+logger = logging.getLogger(__name__)
+
+# shares of the total balance for the Nakamoto coefficients: minimum number of accounts holding more than the share
+NAKAMOTO_THRESHOLDS = {'nakamoto_33': 1 / 3, 'nakamoto_50': 1 / 2, 'nakamoto_67': 2 / 3}
+
+# share of the total balance held by the k richest accounts
+TOP_K = {'top_10_share': 10, 'top_100_share': 100, 'top_1000_share': 1000, 'top_10000_share': 10000}
+
+# population shares of the stored Lorenz curve points
+LORENZ_POINTS = [idx / 100 for idx in range(101)]
+
+CONCENTRATION_COLUMNS = ['account_count', 'balance_total', 'gini'] + list(NAKAMOTO_THRESHOLDS) + list(TOP_K)
+
+# snapshot rows fetched per keyset page
+BALANCE_PAGE_SIZE = 100000
+
+# page of the non-zero balances of a snapshot, after the account of the previous page
+snapshot_balances_sql = (
+    "SELECT account_id, balance_total FROM account_info_snapshot WHERE block_id = :block_id"
+    " AND account_id > :after_account AND balance_total > 0 ORDER BY account_id LIMIT :limit"
+)
+
+insert_concentration_sql = (
+    "INSERT INTO wealth_concentration (block_id, {columns}) VALUES (:block_id, {values})"
+    " ON DUPLICATE KEY UPDATE {updates}"
+).format(columns=", ".join(CONCENTRATION_COLUMNS),
+         values=", ".join(":" + column for column in CONCENTRATION_COLUMNS),
+         updates=", ".join("{0} = VALUES({0})".format(column) for column in CONCENTRATION_COLUMNS))
+
+insert_lorenz_sql = (
+    "INSERT INTO lorenz_point (block_id, population_share, wealth_share)"
+    " VALUES (:block_id, :population_share, :wealth_share)"
+)
+
+
+def load_balances(conn, block_id, replay=False):
+    # (float64 array, exact planck total) of the non-zero balances of a snapshot, or replayed from the balance
+    # events (see balance_engine.py)
+    if replay:
+        balances = [balance for balance in balances_as_of(conn, block_id).values() if balance > 0]
+        return np.array(balances, dtype=np.float64), sum(balances)
+    # keyset pages over the primary key, the mysqlconnector dialect buffers whole result sets
+    pages = []
+    total = 0
+    page = {"block_id": block_id, "after_account": '', "limit": BALANCE_PAGE_SIZE}
+    while True:
+        rows = conn.execute(text(snapshot_balances_sql), page).fetchall()
+        pages.append(np.fromiter((row.balance_total for row in rows), dtype=np.float64, count=len(rows)))
+        total += sum(int(row.balance_total) for row in rows)
+        if len(rows) < BALANCE_PAGE_SIZE:
+            return np.concatenate(pages), total
+        page["after_account"] = rows[-1].account_id
+
+
+def concentration(balances, balance_total):
+    """Return ({column: value}, [(population share, wealth share)]) of an array of non-zero balances.
+
+    The balances are sorted once; every metric is read from the ascending cumulative sum. balance_total is the
+    exact planck sum of the balances, the float64 sums are only used for the shares.
+    """
+    balances = np.sort(balances)
+    count = len(balances)
+    metrics = dict.fromkeys(CONCENTRATION_COLUMNS)
+    metrics['account_count'] = count
+    if count == 0:
+        return metrics, []
+
+    cumulative = np.cumsum(balances)
+    total = cumulative[-1]
+    metrics['balance_total'] = balance_total
+
+    # G = 2 * sum(i * x_i) / (n * sum(x)) - (n + 1) / n with x sorted ascending and i = 1..n
+    ranks = np.arange(1, count + 1, dtype=np.float64)
+    metrics['gini'] = float(2 * np.dot(ranks, balances) / (count * total) - (count + 1) / count)
+
+    # wealth held by the richest accounts: total minus the ascending cumulative sum of the others
+    for column, threshold in NAKAMOTO_THRESHOLDS.items():
+        poorest = np.searchsorted(cumulative, total * (1 - threshold), side='left')
+        metrics[column] = int(count - poorest)
+    for column, k in TOP_K.items():
+        metrics[column] = float((total - (cumulative[-k - 1] if k < count else 0)) / total)
+
+    lorenz = []
+    for share in LORENZ_POINTS:
+        accounts = int(round(share * count))
+        lorenz.append((share, float(cumulative[accounts - 1] / total) if accounts > 0 else 0.0))
+    return metrics, lorenz
+
+
+def write_concentration(conn, block_id, metrics, lorenz):
+    conn.execute(text(insert_concentration_sql), dict(metrics, block_id=block_id))
+    conn.execute(text("DELETE FROM lorenz_point WHERE block_id = :block_id"), {"block_id": block_id})
+    if lorenz:
+        conn.execute(text(insert_lorenz_sql), [{"block_id": block_id, "population_share": share,
+                                                "wealth_share": wealth_share} for share, wealth_share in lorenz])
+
+
+def update_concentration(engine, block_ids, replay=False):
+    # compute and persist the metrics of every block, one db transaction per block
+    for block_id in block_ids:
+        with engine.begin() as conn:
+            metrics, lorenz = concentration(*load_balances(conn, block_id, replay))
+            write_concentration(conn, block_id, metrics, lorenz)
+        logger.info("Block#{} --- Gini {}, Nakamoto (1/3) {}, top 100 share {}".format(
+            block_id, metrics['gini'], metrics['nakamoto_33'], metrics['top_100_share']))
+
+
+def load_concentration(conn, block_ids):
+    # ({block_id: {column: value}}, {block_id: [(population share, wealth share)]}) of the persisted metrics
+    params = {"block_ids": block_ids}
+    metrics = {row.block_id: dict(row._mapping) for row in conn.execute(
+        text("SELECT * FROM wealth_concentration WHERE block_id IN :block_ids")
+        .bindparams(bindparam('block_ids', expanding=True)), params)}
+    lorenz = defaultdict(list)
+    for row in conn.execute(text(
+            "SELECT block_id, population_share, wealth_share FROM lorenz_point WHERE block_id IN :block_ids"
+            " ORDER BY block_id, population_share").bindparams(bindparam('block_ids', expanding=True)), params):
+        lorenz[row.block_id].append((float(row.population_share), row.wealth_share))
+    return metrics, lorenz
+
+
+def plot_concentration(block_ids, metrics, lorenz):
+    fig, (gini_ax, lorenz_ax) = plt.subplots(1, 2, figsize=(18, 8))
+    positions = range(len(block_ids))
+    gini_ax.plot(positions, [metrics[block_id]['gini'] for block_id in block_ids], marker='o', label='Gini')
+    for column in TOP_K:
+        gini_ax.plot(positions, [metrics[block_id][column] for block_id in block_ids], marker='.', label=column)
+    gini_ax.set_xticks(positions)
+    gini_ax.set_xticklabels([str(block_id) for block_id in block_ids], rotation=90)
+    gini_ax.set_xlabel('Snapshot block')
+    gini_ax.set_title('Wealth Concentration')
+    gini_ax.legend()
+
+    colors = plt.cm.viridis([idx / max(1, len(block_ids) - 1) for idx in range(len(block_ids))])
+    for color, block_id in zip(colors, block_ids):
+        lorenz_ax.plot(*zip(*lorenz[block_id]), color=color, label=str(block_id))
+    lorenz_ax.plot([0, 1], [0, 1], color='grey', linestyle='--')
+    lorenz_ax.set_xlabel('Share of accounts')
+    lorenz_ax.set_ylabel('Share of total balance')
+    lorenz_ax.set_title('Lorenz Curves')
+    lorenz_ax.legend(fontsize='x-small', ncol=2)
+
+    plt.tight_layout()
+    plt.show()
+
+
+# Main
+if __name__ == '__main__':
+    # wealth_concentration.py [replay] [plot]: metrics of the snapshot blocks, from the balance events with replay
+    from app.settings import DB_CONNECTION
+
+    logging.basicConfig(level=logging.INFO, handlers=[logging.StreamHandler(sys.stdout)],
+                        format="[%(asctime)s] %(levelname)s [%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+                        datefmt='%Y-%m-%dT%H:%M:%S', )
+
+    try:
+        start = timer()
+        engine = create_engine(DB_CONNECTION, isolation_level="READ_UNCOMMITTED", pool_pre_ping=True)
+
+        block_ids = [1293957, 1739297, 2168299, 2612529, 3042945, 3487164, 3932501, 4332719, 4778061, 5206293,
+                     5650640, 6082432, 6527621, 6973768, 7405900, 7847525, 8279239, 8725455,
+                     9171661, 9573880, 10019762, 10448617, 10883304, 11307029]
+
+        update_concentration(engine, block_ids, replay='replay' in sys.argv[1:])
+
+        if 'plot' in sys.argv[1:]:
+            with engine.connect() as conn:
+                plot_concentration(block_ids, *load_concentration(conn, block_ids))
+
+        logger.info("Wealth Concentration Total Execution Time (seconds): {}".format(timer() - start))
+
+    except Exception as err:
+        logger.error(traceback.format_exc())
@@ -23,4 +23,7 @@ DB_CONNECTION = os.environ.get("DB_CONNECTION", "mysql+mysqlconnector://{}:{}@{}
 ))
 
 SUBSTRATE_RPC_URL = os.environ.get("SUBSTRATE_RPC_URL", "http://substrate-node:9933/")
-SUBSTRATE_ADDRESS_TYPE = int(os.environ.get("SUBSTRATE_ADDRESS_TYPE", 42))
\ No newline at end of file
+SUBSTRATE_ADDRESS_TYPE = int(os.environ.get("SUBSTRATE_ADDRESS_TYPE", 42))
+
+# amounts are stored in planck, the smallest unit, and divided by 10 ** TOKEN_DECIMALS for display in DOT
+TOKEN_DECIMALS = int(os.environ.get("TOKEN_DECIMALS", 10))
@@ -24,8 +24,8 @@ CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`account` (
   `address` VARCHAR(66) NOT NULL,
   `pkey_hex` VARCHAR(120) NULL DEFAULT NULL,
   `nonce` INT NOT NULL,
-  `balance_free` DECIMAL(65,10) NULL DEFAULT NULL,
-  `balance_reserved` DECIMAL(65,10) NULL DEFAULT NULL,
+  `balance_free` DECIMAL(39,0) NULL DEFAULT NULL,
+  `balance_reserved` DECIMAL(39,0) NULL DEFAULT NULL,
   `is_reaped` TINYINT(1) NULL DEFAULT NULL,
   `is_validator` TINYINT(1) NULL DEFAULT NULL,
   `is_nominator` TINYINT(1) NULL DEFAULT NULL,
@@ -51,8 +51,8 @@ COLLATE = utf8mb4_0900_ai_ci;
 CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`account_history` (
   `id` INT NOT NULL AUTO_INCREMENT,
   `address` VARCHAR(66) NOT NULL,
-  `balance_free` DECIMAL(65,10) NULL DEFAULT NULL,
-  `balance_reserved` DECIMAL(65,10) NULL DEFAULT NULL,
+  `balance_free` DECIMAL(39,0) NULL DEFAULT NULL,
+  `balance_reserved` DECIMAL(39,0) NULL DEFAULT NULL,
   `is_reaped` TINYINT(1) NULL DEFAULT NULL,
   `is_validator` TINYINT(1) NULL DEFAULT NULL,
   `is_nominator` TINYINT(1) NULL DEFAULT NULL,
@@ -64,7 +64,7 @@ CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`account_history` (
   INDEX `ix_account_is_validator` (`is_validator` ASC) VISIBLE,
   INDEX `ix_account_history_address` (`address` ASC) INVISIBLE,
   INDEX `ix_account_history_updated_at_block` (`updated_at_block` ASC) VISIBLE)
-ENGINE = MyISAM
+ENGINE = InnoDB
 AUTO_INCREMENT = 2735
 DEFAULT CHARACTER SET = utf8mb4
 COLLATE = utf8mb4_0900_ai_ci;
@@ -129,7 +129,10 @@ CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`event` (
   INDEX `ix_event_type` (`type` ASC) VISIBLE)
 ENGINE = InnoDB
 DEFAULT CHARACTER SET = utf8mb4
-COLLATE = utf8mb4_0900_ai_ci;
+COLLATE = utf8mb4_0900_ai_ci
+PARTITION BY RANGE (`block_id`)
+(PARTITION p0000 VALUES LESS THAN (1000000),
+ PARTITION pmax VALUES LESS THAN MAXVALUE);
 
 
 -- -----------------------------------------------------
@@ -139,15 +142,18 @@ CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`extrinsic` (
   `block_id` INT NOT NULL,
   `extrinsic_idx` INT NOT NULL,
   `batch_idx` INT NOT NULL DEFAULT '0',
+  `call_path` VARCHAR(64) NULL DEFAULT NULL,
   `extrinsic_length` VARCHAR(10) NULL DEFAULT NULL,
   `extrinsic_hash` VARCHAR(66) NULL DEFAULT NULL,
   `signed` SMALLINT NOT NULL,
   `from_address` VARCHAR(64) NULL DEFAULT NULL,
   `to_address` VARCHAR(64) NULL DEFAULT NULL,
+  `from_address_id` INT NULL DEFAULT NULL,
+  `to_address_id` INT NULL DEFAULT NULL,
   `signature` VARCHAR(150) NULL DEFAULT NULL,
-  `value` DECIMAL(65,10) NULL DEFAULT NULL,
-  `tip` DECIMAL(65,10) NULL DEFAULT NULL,
-  `fee` DECIMAL(65,10) NULL DEFAULT NULL,
+  `value` DECIMAL(39,0) NULL DEFAULT NULL,
+  `tip` DECIMAL(39,0) NULL DEFAULT NULL,
+  `fee` DECIMAL(39,0) NULL DEFAULT NULL,
   `nonce` INT NULL DEFAULT NULL,
   `module_id` VARCHAR(64) NULL DEFAULT NULL,
   `call_id` VARCHAR(64) NULL DEFAULT NULL,
@@ -157,44 +163,353 @@ CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`extrinsic` (
   `timestamp` BIGINT NULL DEFAULT NULL,
   `datetime` DATETIME NULL DEFAULT NULL,
   PRIMARY KEY (`block_id`, `extrinsic_idx`, `batch_idx`),
-  INDEX `ix_extrinsic_from_address` (`from_address` ASC) INVISIBLE,
   INDEX `ix_extrinsic_block_id` (`block_id` ASC) VISIBLE,
   INDEX `ix_extrinsic_call_id` (`call_id` ASC) VISIBLE,
   INDEX `ix_extrinsic_extrinsic_idx` (`extrinsic_idx` ASC) VISIBLE,
   INDEX `ix_extrinsic_module_id` (`module_id` ASC) VISIBLE,
   INDEX `ix_extrinsic_signed` (`signed` ASC) VISIBLE,
-  INDEX `ix_extrinsic_to_address` (`to_address` ASC) VISIBLE)
+  INDEX `ix_extrinsic_from_address_id` (`from_address_id` ASC) VISIBLE,
+  INDEX `ix_extrinsic_to_address_id` (`to_address_id` ASC) VISIBLE)
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci
+PARTITION BY RANGE (`block_id`)
+(PARTITION p0000 VALUES LESS THAN (1000000),
+ PARTITION pmax VALUES LESS THAN MAXVALUE);
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`identity_cache`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`identity_cache` (
+  `account_id` VARCHAR(64) NOT NULL,
+  `valid_from_block` INT NOT NULL,
+  `valid_to_block` INT NULL DEFAULT NULL,
+  `identity_display` JSON NULL DEFAULT NULL,
+  `identity_judgement` JSON NULL DEFAULT NULL,
+  PRIMARY KEY (`account_id`, `valid_from_block`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`account_flow`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`account_flow` (
+  `address_id` INT NOT NULL,
+  `block_bucket` INT NOT NULL,
+  `incoming_count` INT NOT NULL DEFAULT '0',
+  `incoming_sum` DECIMAL(39,0) NOT NULL DEFAULT '0',
+  `outgoing_count` INT NOT NULL DEFAULT '0',
+  `outgoing_sum` DECIMAL(39,0) NOT NULL DEFAULT '0',
+  `self_loop_count` INT NOT NULL DEFAULT '0',
+  `self_loop_sum` DECIMAL(39,0) NOT NULL DEFAULT '0',
+  `zero_value_count` INT NOT NULL DEFAULT '0',
+  PRIMARY KEY (`address_id`, `block_bucket`),
+  INDEX `ix_account_flow_block_bucket` (`block_bucket` ASC) VISIBLE)
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`address`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`address` (
+  `address` VARCHAR(64) NOT NULL,
+  `id` INT NOT NULL AUTO_INCREMENT,
+  `pkey` VARCHAR(64) NULL DEFAULT NULL,
+  PRIMARY KEY (`address`),
+  UNIQUE INDEX `ix_address_id` (`id` ASC) VISIBLE,
+  INDEX `ix_address_pkey` (`pkey` ASC) VISIBLE)
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`transfer_event`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`transfer_event` (
+  `block_id` INT NOT NULL,
+  `event_idx` INT NOT NULL,
+  `extrinsic_idx` INT NULL DEFAULT NULL,
+  `from_address_id` INT NOT NULL,
+  `to_address_id` INT NOT NULL,
+  `amount` DECIMAL(39,0) NOT NULL,
+  PRIMARY KEY (`block_id`, `event_idx`),
+  INDEX `ix_transfer_event_from_address_id` (`from_address_id` ASC) VISIBLE,
+  INDEX `ix_transfer_event_to_address_id` (`to_address_id` ASC) VISIBLE)
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`balance_event`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`balance_event` (
+  `block_id` INT NOT NULL,
+  `event_idx` INT NOT NULL,
+  `extrinsic_idx` INT NULL DEFAULT NULL,
+  `module_id` VARCHAR(64) NOT NULL,
+  `event_id` VARCHAR(64) NOT NULL,
+  `address_id` INT NOT NULL,
+  `from_address_id` INT NULL DEFAULT NULL,
+  `amount` DECIMAL(39,0) NULL DEFAULT NULL,
+  PRIMARY KEY (`block_id`, `event_idx`),
+  INDEX `ix_balance_event_event_id` (`event_id` ASC) VISIBLE,
+  INDEX `ix_balance_event_address_id` (`address_id` ASC) VISIBLE)
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`balance_checkpoint`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`balance_checkpoint` (
+  `block_id` INT NOT NULL,
+  `address_id` INT NOT NULL,
+  `balance` DECIMAL(39,0) NOT NULL,
+  PRIMARY KEY (`block_id`, `address_id`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`balance_histogram`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`balance_histogram` (
+  `block_id` INT NOT NULL,
+  `bin_idx` INT NOT NULL,
+  `count` INT NOT NULL,
+  `balance_sum` DECIMAL(39,0) NOT NULL,
+  PRIMARY KEY (`block_id`, `bin_idx`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`balance_quantile`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`balance_quantile` (
+  `block_id` INT NOT NULL,
+  `quantile` DECIMAL(5,4) NOT NULL,
+  `balance` DECIMAL(39,0) NOT NULL,
+  PRIMARY KEY (`block_id`, `quantile`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`wealth_concentration`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`wealth_concentration` (
+  `block_id` INT NOT NULL,
+  `account_count` INT NOT NULL,
+  `balance_total` DECIMAL(39,0) NULL DEFAULT NULL,
+  `gini` DOUBLE NULL DEFAULT NULL,
+  `nakamoto_33` INT NULL DEFAULT NULL,
+  `nakamoto_50` INT NULL DEFAULT NULL,
+  `nakamoto_67` INT NULL DEFAULT NULL,
+  `top_10_share` DOUBLE NULL DEFAULT NULL,
+  `top_100_share` DOUBLE NULL DEFAULT NULL,
+  `top_1000_share` DOUBLE NULL DEFAULT NULL,
+  `top_10000_share` DOUBLE NULL DEFAULT NULL,
+  PRIMARY KEY (`block_id`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`lorenz_point`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`lorenz_point` (
+  `block_id` INT NOT NULL,
+  `population_share` DECIMAL(3,2) NOT NULL,
+  `wealth_share` DOUBLE NOT NULL,
+  PRIMARY KEY (`block_id`, `population_share`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`stake_concentration`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`stake_concentration` (
+  `session_id` INT NOT NULL,
+  `validator_count` INT NOT NULL,
+  `stake_total` DECIMAL(39,0) NULL DEFAULT NULL,
+  `stake_min` DECIMAL(39,0) NULL DEFAULT NULL,
+  `stake_max` DECIMAL(39,0) NULL DEFAULT NULL,
+  `stake_gini` DOUBLE NULL DEFAULT NULL,
+  `nakamoto_33` INT NULL DEFAULT NULL,
+  `nakamoto_50` INT NULL DEFAULT NULL,
+  `own_stake_share` DOUBLE NULL DEFAULT NULL,
+  `commission_mean` DOUBLE NULL DEFAULT NULL,
+  `commission_median` DOUBLE NULL DEFAULT NULL,
+  `commission_zero_share` DOUBLE NULL DEFAULT NULL,
+  `commission_full_share` DOUBLE NULL DEFAULT NULL,
+  `nominator_count` INT NULL DEFAULT NULL,
+  `nominator_exposures` INT NULL DEFAULT NULL,
+  `multi_validator_nominator_share` DOUBLE NULL DEFAULT NULL,
+  `validator_pair_overlap` DOUBLE NULL DEFAULT NULL,
+  `mean_pair_jaccard` DOUBLE NULL DEFAULT NULL,
+  PRIMARY KEY (`session_id`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`block_production`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`block_production` (
+  `session_id` INT NOT NULL,
+  `author` VARCHAR(48) NOT NULL,
+  `blocks` INT NOT NULL,
+  `first_block` INT NOT NULL,
+  `last_block` INT NOT NULL,
+  PRIMARY KEY (`session_id`, `author`),
+  INDEX `ix_block_production_author` (`author` ASC) VISIBLE)
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`session_production`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`session_production` (
+  `session_id` INT NOT NULL,
+  `first_block` INT NOT NULL,
+  `last_block` INT NOT NULL,
+  `first_slot` BIGINT UNSIGNED NOT NULL,
+  `last_slot` BIGINT UNSIGNED NOT NULL,
+  `blocks` INT NOT NULL,
+  `authors` INT NOT NULL,
+  `missed_slots` INT NOT NULL,
+  `max_slot_gap` INT NOT NULL,
+  PRIMARY KEY (`session_id`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`volume_block`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`volume_block` (
+  `block_id` INT NOT NULL,
+  `datetime` DATETIME NULL DEFAULT NULL,
+  `transfer_count` INT NOT NULL DEFAULT '0',
+  `transfer_sum` DECIMAL(39,0) NOT NULL DEFAULT '0',
+  `fee_sum` DECIMAL(39,0) NOT NULL DEFAULT '0',
+  `signed_count` INT NOT NULL DEFAULT '0',
+  `accounts_new` INT NOT NULL DEFAULT '0',
+  `accounts_reaped` INT NOT NULL DEFAULT '0',
+  `sender_count` INT NOT NULL DEFAULT '0',
+  `receiver_count` INT NOT NULL DEFAULT '0',
+  `active_count` INT NOT NULL DEFAULT '0',
+  PRIMARY KEY (`block_id`),
+  INDEX `ix_volume_block_datetime` (`datetime` ASC) VISIBLE)
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`volume_hour`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`volume_hour` (
+  `hour` DATETIME NOT NULL,
+  `transfer_count` INT NOT NULL DEFAULT '0',
+  `transfer_sum` DECIMAL(39,0) NOT NULL DEFAULT '0',
+  `fee_sum` DECIMAL(39,0) NOT NULL DEFAULT '0',
+  `signed_count` INT NOT NULL DEFAULT '0',
+  `accounts_new` INT NOT NULL DEFAULT '0',
+  `accounts_reaped` INT NOT NULL DEFAULT '0',
+  `sender_count` INT NOT NULL DEFAULT '0',
+  `receiver_count` INT NOT NULL DEFAULT '0',
+  `active_count` INT NOT NULL DEFAULT '0',
+  PRIMARY KEY (`hour`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`volume_day`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`volume_day` (
+  `day` DATE NOT NULL,
+  `transfer_count` INT NOT NULL DEFAULT '0',
+  `transfer_sum` DECIMAL(39,0) NOT NULL DEFAULT '0',
+  `fee_sum` DECIMAL(39,0) NOT NULL DEFAULT '0',
+  `signed_count` INT NOT NULL DEFAULT '0',
+  `accounts_new` INT NOT NULL DEFAULT '0',
+  `accounts_reaped` INT NOT NULL DEFAULT '0',
+  `sender_count` INT NOT NULL DEFAULT '0',
+  `receiver_count` INT NOT NULL DEFAULT '0',
+  `active_count` INT NOT NULL DEFAULT '0',
+  PRIMARY KEY (`day`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`active_account_hour`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`active_account_hour` (
+  `hour` DATETIME NOT NULL,
+  `role` SMALLINT NOT NULL,
+  `address_id` INT NOT NULL,
+  PRIMARY KEY (`hour`, `role`, `address_id`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`active_sketch`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`active_sketch` (
+  `day` DATE NOT NULL,
+  `role` SMALLINT NOT NULL,
+  `registers` BLOB NOT NULL,
+  PRIMARY KEY (`day`, `role`))
+ENGINE = InnoDB
+DEFAULT CHARACTER SET = utf8mb4
+COLLATE = utf8mb4_0900_ai_ci;
+
+
+-- -----------------------------------------------------
+-- Table `polkadot_analysis`.`heavy_hitter`
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `polkadot_analysis`.`heavy_hitter` (
+  `window_start` DATE NOT NULL,
+  `metric` VARCHAR(16) NOT NULL,
+  `address_id` INT NOT NULL,
+  `estimate` DECIMAL(39,0) NOT NULL,
+  `error` DECIMAL(39,0) NOT NULL,
+  PRIMARY KEY (`window_start`, `metric`, `address_id`))
 ENGINE = InnoDB
 DEFAULT CHARACTER SET = utf8mb4
 COLLATE = utf8mb4_0900_ai_ci;
 
 USE `polkadot_analysis`;
 
-DELIMITER $$
-USE `polkadot_analysis`$$
-CREATE
-DEFINER=`root`@`localhost`
-TRIGGER `polkadot_analysis`.`account__ai`
-AFTER INSERT ON `polkadot_analysis`.`account`
-FOR EACH ROW
-INSERT INTO account_history SELECT NULL, 
-d.address, d.balance_free, d.balance_reserved, d.is_reaped, d.is_validator, d.is_nominator, d.is_council_member,
-d.is_tech_comm_member, d.is_registrar, d.is_sudo, d.is_treasury, d.identity_display, d.identity_judgement, d.updated_at_block
-    FROM account AS d WHERE d.address = NEW.address$$
-
-USE `polkadot_analysis`$$
-CREATE
-DEFINER=`root`@`localhost`
-TRIGGER `polkadot_analysis`.`account__au`
-AFTER UPDATE ON `polkadot_analysis`.`account`
-FOR EACH ROW
-INSERT INTO account_history SELECT NULL, 
-d.address, d.balance_free, d.balance_reserved, d.is_reaped, d.is_validator, d.is_nominator, d.is_council_member,
-d.is_tech_comm_member, d.is_registrar, d.is_sudo, d.is_treasury, d.identity_display, d.identity_judgement, d.updated_at_block
-    FROM account AS d WHERE d.address = NEW.address$$
-
-
-DELIMITER ;
+-- account_history rows are inserted in bulk by app/scripts/account_state.py, replacing the row triggers
+DROP TRIGGER IF EXISTS `polkadot_analysis`.`account__ai`;
+DROP TRIGGER IF EXISTS `polkadot_analysis`.`account__au`;
 
 SET SQL_MODE=@OLD_SQL_MODE;
 SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS;